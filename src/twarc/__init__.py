@@ -1,4 +1,5 @@
 from .client import Twarc
 from .client2 import Twarc2
+from .async_client2 import AsyncTwarc2
 from .version import version
 from .expansions import ensure_flattened
@@ -0,0 +1,1373 @@
+# -*- coding: utf-8 -*-
+
+"""
+Support for the Twitter v2 API using asyncio.
+"""
+
+import re
+import asyncio
+import logging
+import datetime
+
+from oauthlib.oauth1 import Client as OAuth1Client
+
+from twarc import codec
+from twarc.client2 import Twarc2, _append_metadata, _token_param
+from twarc.decorators2 import (
+    async_catch_request_exceptions,
+    async_rate_limit,
+    requires_app_auth,
+)
+from twarc.ratelimit import RateLimiter
+from twarc.version import user_agent
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+log = logging.getLogger("twarc")
+
+
+class AsyncTwarc2:
+    """
+    An asyncio client for the Twitter v2 API.
+
+    AsyncTwarc2 mirrors the methods of Twarc2, but the paginated methods are
+    async generators and the rest are coroutines. All requests share one
+    pooled httpx.AsyncClient, so a single event loop can drive many
+    paginations at once:
+
+        async with AsyncTwarc2(bearer_token="...") as t:
+            async for page in t.search_recent("blacklivesmatter"):
+                print(page)
+
+    httpx needs to be installed to use this client: `pip install twarc[async]`
+    """
+
+    def __init__(
+        self,
+        consumer_key=None,
+        consumer_secret=None,
+        access_token=None,
+        access_token_secret=None,
+        bearer_token=None,
+        metadata=True,
+        connections=100,
+    ):
+        """
+        Instantiate an AsyncTwarc2 instance to talk to the Twitter V2+ API.
+
+        The credentials are handled the same way as Twarc2: a `bearer_token`
+        or a `consumer_key` and `consumer_secret` on their own use app auth,
+        and adding an `access_token` and `access_token_secret` switches to user
+        auth.
+
+        Args:
+            consumer_key (str):
+                The API key.
+            consumer_secret (str):
+                The API secret.
+            access_token (str):
+                The Access Token
+            access_token_secret (str):
+                The Access Token Secret
+            bearer_token (str):
+                Bearer Token, can be generated from API keys.
+            metadata (bool):
+                Append `__twarc` metadata to results.
+            connections (int):
+                Maximum number of pooled HTTP connections.
+        """
+        if httpx is None:
+            raise ImportError(
+                "AsyncTwarc2 requires httpx, install it with: pip install twarc[async]"
+            )
+
+        self.api_version = "2"
+        self.metadata = metadata
+        self.connections = connections
+        self.bearer_token = None
+
+        if bearer_token:
+            self.bearer_token = bearer_token
+            self.auth_type = "application"
+
+        elif consumer_key and consumer_secret:
+            self.consumer_key = consumer_key
+            self.consumer_secret = consumer_secret
+            if access_token and access_token_secret:
+                self.access_token = access_token
+                self.access_token_secret = access_token_secret
+                self.auth_type = "user"
+            else:
+                self.auth_type = "application"
+
+        else:
+            raise ValueError(
+                "Must pass either a bearer_token or consumer/access_token keys and secrets"
+            )
+
+        self.client = None
+        self.oauth1 = None
+        self.rate_limiter = RateLimiter()
+        # so that only one coroutine opens a new client
+        self._connect_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    _prepare_params = Twarc2._prepare_params
+
+    async def _search(
+        self,
+        url,
+        query,
+        since_id,
+        until_id,
+        start_time,
+        end_time,
+        max_results,
+        expansions,
+        tweet_fields,
+        user_fields,
+        media_fields,
+        poll_fields,
+        place_fields,
+        sort_order,
+        next_token=None,
+        granularity=None,
+    ):
+        """
+        Common function for search, counts endpoints.
+        """
+        params = self._prepare_params(
+            query=query,
+            max_results=max_results,
+            since_id=since_id,
+            until_id=until_id,
+            start_time=start_time,
+            end_time=end_time,
+            next_token=next_token,
+            sort_order=sort_order,
+        )
+
+        if not granularity:
+            params = self._prepare_params(
+                **params,
+                expansions=expansions,
+                tweet_fields=tweet_fields,
+                user_fields=user_fields,
+                media_fields=media_fields,
+                poll_fields=poll_fields,
+                place_fields=place_fields,
+            )
+            async for response in self.get_paginated(url, params=params):
+                # can't return without 'data' if there are no results
+                if "data" in response:
+                    yield response
+                else:
+                    log.info(f"Retrieved an empty page of results.")
+
+            log.info(f"No more results for search {query}.")
+            return
+
+        # See Twarc2._search for why counts need restarting when the API
+        # stops returning results before reaching the start_time.
+        params["granularity"] = granularity
+        time_periods_collected = 0
+        last_time_start = None
+
+        while True:
+            async for response in self.get_paginated(url, params=params):
+                if "data" in response:
+                    last_time_start = response["data"][0]["start"]
+                    time_periods_collected += len(response["data"])
+                    yield response
+                else:
+                    log.info(f"Retrieved an empty page of results.")
+
+            if (
+                start_time is None
+                or (
+                    (start_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z")
+                    == last_time_start
+                )
+                or (time_periods_collected == 0)
+            ):
+                break
+            else:
+                params["end_time"] = last_time_start
+                params.pop("next_token", None)
+                log.info(
+                    "Detected incomplete counts, restarting with "
+                    f"{last_time_start} as the new end_time"
+                )
+
+        log.info(f"No more results for search {query}.")
+
+    def search_recent(
+        self,
+        query,
+        since_id=None,
+        until_id=None,
+        start_time=None,
+        end_time=None,
+        max_results=100,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        next_token=None,
+        sort_order=None,
+    ):
+        """
+        Search Twitter for the given query in the last seven days. See
+        Twarc2.search_recent.
+
+        Returns:
+            async_generator[dict]: an async generator, dict for each paginated response.
+        """
+        return self._search(
+            url="https://api.twitter.com/2/tweets/search/recent",
+            query=query,
+            since_id=since_id,
+            until_id=until_id,
+            start_time=start_time,
+            end_time=end_time,
+            max_results=max_results,
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+            next_token=next_token,
+            sort_order=sort_order,
+        )
+
+    @requires_app_auth
+    def search_all(
+        self,
+        query,
+        since_id=None,
+        until_id=None,
+        start_time=None,
+        end_time=None,
+        max_results=100,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        next_token=None,
+        sort_order=None,
+    ):
+        """
+        Search Twitter for the given query in the full archive. See
+        Twarc2.search_all.
+
+        Returns:
+            async_generator[dict]: an async generator, dict for each paginated response.
+        """
+        if start_time is None and since_id is None and until_id is None:
+            start_time = datetime.datetime(2006, 3, 21, tzinfo=datetime.timezone.utc)
+
+        return self._search(
+            url="https://api.twitter.com/2/tweets/search/all",
+            query=query,
+            since_id=since_id,
+            until_id=until_id,
+            start_time=start_time,
+            end_time=end_time,
+            max_results=max_results,
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+            next_token=next_token,
+            sort_order=sort_order,
+        )
+
+    @requires_app_auth
+    def counts_recent(
+        self,
+        query,
+        since_id=None,
+        until_id=None,
+        start_time=None,
+        end_time=None,
+        granularity="hour",
+    ):
+        """
+        Retrieve counts for the given query in the last seven days. See
+        Twarc2.counts_recent.
+
+        Returns:
+            async_generator[dict]: an async generator, dict for each paginated response.
+        """
+        return self._search(
+            url="https://api.twitter.com/2/tweets/counts/recent",
+            query=query,
+            since_id=since_id,
+            until_id=until_id,
+            start_time=start_time,
+            end_time=end_time,
+            max_results=None,
+            expansions=None,
+            tweet_fields=None,
+            user_fields=None,
+            media_fields=None,
+            poll_fields=None,
+            place_fields=None,
+            granularity=granularity,
+            sort_order=None,
+        )
+
+    @requires_app_auth
+    def counts_all(
+        self,
+        query,
+        since_id=None,
+        until_id=None,
+        start_time=None,
+        end_time=None,
+        granularity="hour",
+        next_token=None,
+    ):
+        """
+        Retrieve counts for the given query in the full archive. See
+        Twarc2.counts_all.
+
+        Returns:
+            async_generator[dict]: an async generator, dict for each paginated response.
+        """
+        return self._search(
+            url="https://api.twitter.com/2/tweets/counts/all",
+            query=query,
+            since_id=since_id,
+            until_id=until_id,
+            start_time=start_time,
+            end_time=end_time,
+            max_results=None,
+            expansions=None,
+            tweet_fields=None,
+            user_fields=None,
+            media_fields=None,
+            poll_fields=None,
+            place_fields=None,
+            next_token=next_token,
+            granularity=granularity,
+            sort_order=None,
+        )
+
+    async def tweet_lookup(
+        self,
+        tweet_ids,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+    ):
+        """
+        Lookup tweets, taking an iterator of IDs and returning pages of fully
+        expanded tweet objects, in blocks of up to 100. See Twarc2.tweet_lookup.
+
+        Args:
+            tweet_ids (iterable): A list of tweet IDs
+
+        Returns:
+            async_generator[dict]: an async generator, dict for each batch of 100 tweets.
+        """
+        params = self._prepare_params(
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+        )
+
+        async def lookup_batch(batch):
+            resp = await self.get(
+                "https://api.twitter.com/2/tweets",
+                params={**params, "ids": ",".join(batch)},
+            )
+            return self._page(resp)
+
+        batch = []
+        for tweet_id in tweet_ids:
+            batch.append(str(int(tweet_id)))
+            if len(batch) == 100:
+                yield await lookup_batch(batch)
+                batch = []
+
+        if batch:
+            yield await lookup_batch(batch)
+
+    async def user_lookup(
+        self,
+        users,
+        usernames=False,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+    ):
+        """
+        Returns fully populated user profiles for the given iterator of
+        user_id or usernames, in blocks of up to 100. See Twarc2.user_lookup.
+
+        Args:
+            users (iterable): User IDs or usernames to lookup.
+            usernames (bool): Parse `users` as usernames, not IDs.
+
+        Returns:
+            async_generator[dict]: an async generator, dict for each batch of 100 users.
+        """
+        if isinstance(users, str):
+            raise TypeError("users must be an iterable other than a string")
+
+        if usernames:
+            url = "https://api.twitter.com/2/users/by"
+        else:
+            url = "https://api.twitter.com/2/users"
+
+        params = self._prepare_params(
+            tweet_fields=tweet_fields, user_fields=user_fields
+        )
+        if expansions:
+            params["expansions"] = "pinned_tweet_id"
+
+        async def lookup_batch(batch):
+            key = "usernames" if usernames else "ids"
+            resp = await self.get(url, params={**params, key: ",".join(batch)})
+            return self._page(resp)
+
+        batch = []
+        for item in users:
+            batch.append(str(item).strip())
+            if len(batch) == 100:
+                yield await lookup_batch(batch)
+                batch = []
+
+        if batch:
+            yield await lookup_batch(batch)
+
+    @requires_app_auth
+    def sample(
+        self,
+        event=None,
+        record_keepalive=False,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        backfill_minutes=None,
+    ):
+        """
+        Returns a sample of all publicly posted tweets. See Twarc2.sample.
+
+        Args:
+            event (asyncio.Event): Manages a flag to stop the process.
+            record_keepalive (bool): whether to output keep-alive events.
+
+        Returns:
+            async_generator[dict]: an async generator, dict for each tweet.
+        """
+        params = self._prepare_params(
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+            backfill_minutes=backfill_minutes,
+        )
+        return self._stream(
+            "https://api.twitter.com/2/tweets/sample/stream",
+            params,
+            event,
+            record_keepalive,
+        )
+
+    @requires_app_auth
+    async def add_stream_rules(self, rules):
+        """
+        Adds new rules to the filter stream. See Twarc2.add_stream_rules.
+
+        Args:
+            rules (list[dict]): A list of rules to add.
+
+        Returns:
+            dict: JSON Response from Twitter API.
+        """
+        url = "https://api.twitter.com/2/tweets/search/stream/rules"
+        return codec.loads((await self.post(url, {"add": rules})).content)
+
+    @requires_app_auth
+    async def get_stream_rules(self):
+        """
+        Returns a list of rules for the filter stream.
+
+        Returns:
+            dict: JSON Response from Twitter API with a list of defined rules.
+        """
+        url = "https://api.twitter.com/2/tweets/search/stream/rules"
+        return codec.loads((await self.get(url)).content)
+
+    @requires_app_auth
+    async def delete_stream_rule_ids(self, rule_ids):
+        """
+        Deletes rules from the filter stream.
+
+        Args:
+            rule_ids (list[int]): A list of rule ids to delete.
+
+        Returns:
+            dict: JSON Response from Twitter API.
+        """
+        url = "https://api.twitter.com/2/tweets/search/stream/rules"
+        return codec.loads(
+            (await self.post(url, {"delete": {"ids": rule_ids}})).content
+        )
+
+    @requires_app_auth
+    def stream(
+        self,
+        event=None,
+        record_keepalive=False,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        backfill_minutes=None,
+    ):
+        """
+        Returns a stream of tweets matching the defined rules. See
+        Twarc2.stream.
+
+        Args:
+            event (asyncio.Event): Manages a flag to stop the process.
+            record_keepalive (bool): whether to output keep-alive events.
+
+        Returns:
+            async_generator[dict]: an async generator, dict for each tweet.
+        """
+        params = self._prepare_params(
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+            backfill_minutes=backfill_minutes,
+        )
+        return self._stream(
+            "https://api.twitter.com/2/tweets/search/stream",
+            params,
+            event,
+            record_keepalive,
+        )
+
+    async def _stream(self, url, params, event, record_keepalive, tries=30):
+        """
+        An async generator that streams data from a response, and reconnects
+        with exponential backoff after any transport error.
+
+        Args:
+            url (str): the streaming endpoint URL
+            params (dict): any query paramters to use with the url
+            event (asyncio.Event): Manages a flag to stop the process.
+            record_keepalive (bool): whether to output keep-alive events.
+            tries (int): the number of times to retry connecting after an error
+        Returns:
+            async_generator[dict]: An async generator of tweet dicts.
+        """
+        errors = 0
+        while True:
+            log.info(f"connecting to stream {url}")
+            resp = await self.get(url, params=params, stream=True)
+
+            try:
+                async for line in resp.aiter_lines():
+                    errors = 0
+
+                    # quit & close the stream if the event is set
+                    if event and event.is_set():
+                        log.info("stopping response stream")
+                        return
+
+                    if not line.strip():
+                        log.info("keep-alive")
+                        if record_keepalive:
+                            yield "keep-alive"
+                        continue
+                    else:
+                        data = codec.loads(line)
+                        if self.metadata:
+                            data = _append_metadata(data, str(resp.url))
+                        yield data
+                        if self._check_for_disconnect(data):
+                            break
+
+            except httpx.TransportError as e:
+                log.warning("caught exception during streaming: %s", e)
+                errors += 1
+                if errors > tries:
+                    log.error(f"too many consecutive errors ({tries}). stopping")
+                    return
+                else:
+                    secs = errors**2
+                    log.info("sleeping %s seconds before reconnecting", secs)
+                    await asyncio.sleep(secs)
+
+            finally:
+                await resp.aclose()
+
+    async def _timeline(
+        self,
+        user_id,
+        timeline_type,
+        since_id,
+        until_id,
+        start_time,
+        end_time,
+        exclude_retweets,
+        exclude_replies,
+        max_results=None,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        pagination_token=None,
+    ):
+        """
+        Helper function for user and mention timelines.
+        """
+        url = f"https://api.twitter.com/2/users/{user_id}/{timeline_type}"
+
+        params = self._prepare_params(
+            since_id=since_id,
+            until_id=until_id,
+            start_time=start_time,
+            end_time=end_time,
+            max_results=max_results,
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+            pagination_token=pagination_token,
+        )
+
+        excludes = []
+        if exclude_retweets:
+            excludes.append("retweets")
+        if exclude_replies:
+            excludes.append("replies")
+        if len(excludes) > 0:
+            params["exclude"] = ",".join(excludes)
+
+        async for response in self.get_paginated(url, params=params):
+            # can return without 'data' if there are no results
+            if "data" in response:
+                yield response
+            else:
+                log.info(f"Retrieved an empty page of results for timeline {user_id}")
+
+        log.info(f"No more results for timeline {user_id}.")
+
+    async def timeline(
+        self,
+        user,
+        since_id=None,
+        until_id=None,
+        start_time=None,
+        end_time=None,
+        exclude_retweets=False,
+        exclude_replies=False,
+        max_results=100,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        pagination_token=None,
+    ):
+        """
+        Retrieve up to the 3200 most recent tweets made by the given user.
+        See Twarc2.timeline.
+
+        Returns:
+            async_generator[dict]: An async generator, dict for each page of results.
+        """
+        user_id = await self._ensure_user_id(user)
+        async for response in self._timeline(
+            user_id=user_id,
+            timeline_type="tweets",
+            since_id=since_id,
+            until_id=until_id,
+            start_time=start_time,
+            end_time=end_time,
+            exclude_retweets=exclude_retweets,
+            exclude_replies=exclude_replies,
+            max_results=max_results,
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+            pagination_token=pagination_token,
+        ):
+            yield response
+
+    async def mentions(
+        self,
+        user,
+        since_id=None,
+        until_id=None,
+        start_time=None,
+        end_time=None,
+        exclude_retweets=False,
+        exclude_replies=False,
+        max_results=100,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        pagination_token=None,
+    ):
+        """
+        Retrieve up to the 800 most recent tweets mentioning the given user.
+        See Twarc2.mentions.
+
+        Returns:
+            async_generator[dict]: An async generator, dict for each page of results.
+        """
+        user_id = await self._ensure_user_id(user)
+        async for response in self._timeline(
+            user_id=user_id,
+            timeline_type="mentions",
+            since_id=since_id,
+            until_id=until_id,
+            start_time=start_time,
+            end_time=end_time,
+            exclude_retweets=exclude_retweets,
+            exclude_replies=exclude_replies,
+            max_results=max_results,
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+            pagination_token=pagination_token,
+        ):
+            yield response
+
+    async def _users(
+        self,
+        url,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        max_results=None,
+        pagination_token=None,
+    ):
+        """
+        Paginates endpoints that return user profiles.
+        """
+        params = self._prepare_params(
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        )
+        if expansions:
+            params["expansions"] = "pinned_tweet_id"
+
+        async for page in self.get_paginated(url, params=params):
+            if "data" in page:
+                yield page
+            else:
+                log.info(f"Retrieved an empty page of results for {url}")
+
+    async def following(
+        self,
+        user,
+        user_id=None,
+        max_results=1000,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        pagination_token=None,
+    ):
+        """
+        Retrieve the user profiles of accounts followed by the given user.
+        See Twarc2.following.
+
+        Returns:
+            async_generator[dict]: An async generator, dict for each page of results.
+        """
+        user_id = await self._ensure_user_id(user) if not user_id else user_id
+        async for page in self._users(
+            f"https://api.twitter.com/2/users/{user_id}/following",
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        ):
+            yield page
+
+    async def followers(
+        self,
+        user,
+        user_id=None,
+        max_results=1000,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        pagination_token=None,
+    ):
+        """
+        Retrieve the user profiles of accounts following the given user.
+        See Twarc2.followers.
+
+        Returns:
+            async_generator[dict]: An async generator, dict for each page of results.
+        """
+        user_id = await self._ensure_user_id(user) if not user_id else user_id
+        async for page in self._users(
+            f"https://api.twitter.com/2/users/{user_id}/followers",
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        ):
+            yield page
+
+    def liking_users(
+        self,
+        tweet_id,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        max_results=100,
+        pagination_token=None,
+    ):
+        """
+        Retrieve the user profiles of accounts that have liked the given tweet.
+        """
+        return self._users(
+            f"https://api.twitter.com/2/tweets/{tweet_id}/liking_users",
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        )
+
+    def retweeted_by(
+        self,
+        tweet_id,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        max_results=100,
+        pagination_token=None,
+    ):
+        """
+        Retrieve the user profiles of accounts that have retweeted the given tweet.
+        """
+        return self._users(
+            f"https://api.twitter.com/2/tweets/{tweet_id}/retweeted_by",
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        )
+
+    async def liked_tweets(
+        self,
+        user_id,
+        max_results=100,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        pagination_token=None,
+    ):
+        """
+        Retrieve the tweets liked by the given user_id.
+        """
+        user_id = await self._ensure_user_id(user_id)
+        url = f"https://api.twitter.com/2/users/{user_id}/liked_tweets"
+
+        params = self._prepare_params(
+            max_results=max_results,
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            media_fields=media_fields,
+            poll_fields=poll_fields,
+            place_fields=place_fields,
+            pagination_token=pagination_token,
+        )
+
+        async for page in self.get_paginated(url, params=params):
+            if "data" in page:
+                yield page
+            else:
+                log.info(
+                    f"Retrieved an empty page of results for liked_tweets of {user_id}"
+                )
+
+    async def quotes(
+        self,
+        tweet_id,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        max_results=100,
+        pagination_token=None,
+    ):
+        """
+        Retrieve the tweets that quote tweet the given tweet.
+        """
+        url = f"https://api.twitter.com/2/tweets/{tweet_id}/quote_tweets"
+
+        params = self._prepare_params(
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        )
+
+        async for page in self.get_paginated(url, params=params):
+            if "data" in page:
+                yield page
+            else:
+                log.info(f"Retrieved an empty page of results for quotes of {tweet_id}")
+
+    async def list_lookup(
+        self, list_id, expansions=None, list_fields=None, user_fields=None
+    ):
+        """
+        Returns the details of a specified List. See Twarc2.list_lookup.
+
+        Returns:
+            dict: Result dictionary.
+        """
+        params = self._prepare_params(list_fields=list_fields, user_fields=user_fields)
+        if expansions:
+            params["expansions"] = "owner_id"
+
+        resp = await self.get(
+            f"https://api.twitter.com/2/lists/{list_id}", params=params
+        )
+        return self._page(resp)
+
+    def list_followers(
+        self,
+        list_id,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        max_results=None,
+        pagination_token=None,
+    ):
+        """
+        Returns a list of users who are followers of the specified List.
+        """
+        return self._users(
+            f"https://api.twitter.com/2/lists/{list_id}/followers",
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        )
+
+    def list_members(
+        self,
+        list_id,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        max_results=None,
+        pagination_token=None,
+    ):
+        """
+        Returns a list of users who are members of the specified List.
+        """
+        return self._users(
+            f"https://api.twitter.com/2/lists/{list_id}/members",
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        )
+
+    def list_tweets(
+        self,
+        list_id,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        max_results=None,
+        pagination_token=None,
+    ):
+        """
+        Returns Tweets from the specified List.
+        """
+        params = self._prepare_params(
+            expansions=expansions,
+            tweet_fields=tweet_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        )
+        return self.get_paginated(
+            f"https://api.twitter.com/2/lists/{list_id}/tweets", params=params
+        )
+
+    async def _lists(
+        self,
+        user,
+        list_type,
+        expansions=None,
+        list_fields=None,
+        user_fields=None,
+        max_results=None,
+        pagination_token=None,
+    ):
+        """
+        Paginates and returns lists for a user.
+        """
+        user_id = await self._ensure_user_id(user)
+        url = f"https://api.twitter.com/2/users/{user_id}/{list_type}"
+
+        params = self._prepare_params(
+            list_fields=list_fields,
+            user_fields=user_fields,
+            max_results=max_results,
+            pagination_token=pagination_token,
+        )
+        if expansions:
+            params["expansions"] = "owner_id"
+
+        async for response in self.get_paginated(url, params=params):
+            # can return without 'data' if there are no results
+            if "data" in response:
+                yield response
+            else:
+                log.info(f"Retrieved an empty page of results of lists for {url}")
+
+    def list_memberships(self, user, **kwargs):
+        """
+        Returns all Lists a specified user is a member of. See
+        Twarc2.list_memberships for the keyword arguments.
+        """
+        return self._lists(user, "list_memberships", **kwargs)
+
+    def owned_lists(self, user, **kwargs):
+        """
+        Returns all Lists owned by the specified user. See Twarc2.owned_lists
+        for the keyword arguments.
+        """
+        return self._lists(user, "owned_lists", **kwargs)
+
+    def followed_lists(self, user, **kwargs):
+        """
+        Returns all Lists a specified user follows. See Twarc2.followed_lists
+        for the keyword arguments.
+        """
+        return self._lists(user, "followed_lists", **kwargs)
+
+    def pinned_lists(self, user, **kwargs):
+        """
+        Returns the Lists pinned by the authenticating user. See
+        Twarc2.pinned_lists for the keyword arguments.
+        """
+        return self._lists(user, "pinned_lists", **kwargs)
+
+    @requires_app_auth
+    async def compliance_job_list(self, job_type, status):
+        """
+        Returns list of compliance jobs. See Twarc2.compliance_job_list.
+
+        Returns:
+            list[dict]: A list of jobs.
+        """
+        params = {}
+        if job_type:
+            params["type"] = job_type
+        if status:
+            params["status"] = status
+        result = codec.loads(
+            (
+                await self.get(
+                    "https://api.twitter.com/2/compliance/jobs", params=params
+                )
+            ).content
+        )
+        if "data" in result or not result:
+            return result
+        else:
+            raise ValueError(f"Unknown response from twitter: {result}")
+
+    @requires_app_auth
+    async def compliance_job_get(self, job_id):
+        """
+        Returns a compliance job. See Twarc2.compliance_job_get.
+
+        Returns:
+            dict: A compliance job.
+        """
+        result = codec.loads(
+            (
+                await self.get(f"https://api.twitter.com/2/compliance/jobs/{job_id}")
+            ).content
+        )
+        if "data" in result:
+            return result
+        else:
+            raise ValueError(f"Unknown response from twitter: {result}")
+
+    @requires_app_auth
+    async def compliance_job_create(self, job_type, job_name, resumable=False):
+        """
+        Creates a new compliace job. See Twarc2.compliance_job_create.
+        """
+        payload = {"type": job_type, "resumable": resumable}
+        if job_name:
+            payload["name"] = job_name
+
+        result = codec.loads(
+            (
+                await self.post("https://api.twitter.com/2/compliance/jobs", payload)
+            ).content
+        )
+        if "data" in result:
+            return result
+        else:
+            raise ValueError(f"Unknown response from twitter: {result}")
+
+    @async_catch_request_exceptions
+    @async_rate_limit
+    async def get(self, url, params=None, stream=False):
+        """
+        Make a GET request to a specified URL.
+
+        Args:
+            url (str): URL to make a GET request.
+            params (dict): Query parameters for the request.
+            stream (bool): Don't read the body, for streaming endpoints.
+
+        Returns:
+            httpx.Response: Response from Twitter API.
+        """
+        await self._ensure_client()
+        log.info("getting %s %s", url, params)
+        # requests drops None values from params but httpx doesn't
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+        # wait before signing, so the OAuth timestamp isn't stale when it's sent
+        await asyncio.sleep(self.rate_limiter.reserve(url))
+        request = self._request("GET", url, params=params)
+        resp = await self.client.send(request, stream=stream)
+        self.rate_limiter.update(url, resp.headers)
+        if stream and resp.status_code != 200:
+            # release the connection back to the pool before any retry
+            await resp.aread()
+        return resp
+
+    async def get_paginated(self, url, params=None):
+        """
+        A wrapper around the `get` method that handles Twitter token based
+        pagination.
+
+        Yields one page (one API response) at a time.
+
+        Args:
+            url (str): URL to make a GET request.
+            params (dict): Query parameters for the request.
+
+        Returns:
+            async_generator[dict]: An async generator, dict for each page of results.
+        """
+        params = dict(params or {})
+        token_param = _token_param(url)
+
+        page = self._page(await self.get(url, params=params))
+        yield page
+
+        while "meta" in page and "next_token" in page["meta"]:
+            params[token_param] = page["meta"]["next_token"]
+            page = self._page(await self.get(url, params=params))
+            yield page
+
+    @async_catch_request_exceptions
+    @async_rate_limit
+    async def post(self, url, json_data):
+        """
+        Make a POST request to the specified URL.
+
+        Args:
+            url (str): URL to make a POST request
+            json_data (dict): JSON data to send.
+
+        Returns:
+            httpx.Response: Response from Twitter API.
+        """
+        await self._ensure_client()
+        await asyncio.sleep(self.rate_limiter.reserve(url))
+        request = self._request("POST", url, json=json_data)
+        resp = await self.client.send(request)
+        self.rate_limiter.update(url, resp.headers)
+        return resp
+
+    async def connect(self):
+        """
+        Sets up the pooled HTTP client to talk to Twitter. If one is active it
+        is closed and another one is opened.
+        """
+        await self.close()
+
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": user_agent},
+            timeout=httpx.Timeout(31, connect=3.05),
+            limits=httpx.Limits(
+                max_connections=self.connections,
+                max_keepalive_connections=self.connections,
+            ),
+        )
+
+        if self.auth_type == "application" and not self.bearer_token:
+            log.info("fetching bearer token via OAuth2")
+            resp = await self.client.post(
+                "https://api.twitter.com/oauth2/token",
+                data={"grant_type": "client_credentials"},
+                auth=(self.consumer_key, self.consumer_secret),
+            )
+            resp.raise_for_status()
+            self.bearer_token = resp.json()["access_token"]
+
+        if self.auth_type == "application":
+            log.info("creating HTTP client headers for app auth.")
+            self.client.headers.update({"Authorization": f"Bearer {self.bearer_token}"})
+        else:
+            log.info("creating user auth client")
+            self.oauth1 = OAuth1Client(
+                self.consumer_key,
+                client_secret=self.consumer_secret,
+                resource_owner_key=self.access_token,
+                resource_owner_secret=self.access_token_secret,
+            )
+
+    async def _ensure_client(self):
+        """
+        Connect if there isn't an open HTTP client. The coroutines waiting on
+        the lock find the client that the first one opened and use it.
+        """
+        async with self._connect_lock:
+            if self.client is None or self.client.is_closed:
+                await self.connect()
+
+    async def close(self):
+        """
+        Close the HTTP client and any pooled connections.
+        """
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    def _request(self, method, url, **kwargs):
+        """
+        Build a request, signing it when user auth is being used.
+        """
+        request = self.client.build_request(method, url, **kwargs)
+        if self.oauth1:
+            _, headers, _ = self.oauth1.sign(str(request.url), http_method=method)
+            request.headers.update(headers)
+        return request
+
+    def _page(self, resp):
+        """
+        Decode a response and append metadata if needed.
+        """
+        data = codec.loads(resp.content)
+        if self.metadata:
+            data = _append_metadata(data, str(resp.url))
+        return data
+
+    async def _ensure_user_id(self, user):
+        """
+        Always return a valid user id, look up if not numeric.
+        """
+        user = str(user)
+        is_numeric = re.match(r"^\d+$", user)
+
+        if len(user) > 15 or (is_numeric and await self._id_exists(user)):
+            return user
+
+        async for results in self.user_lookup([user], usernames=True):
+            if "data" in results and len(results["data"]) > 0:
+                return results["data"][0]["id"]
+
+        if is_numeric:
+            return user
+        else:
+            raise ValueError(f"No such user {user}")
+
+    async def _id_exists(self, user):
+        """
+        Returns True if the user id exists
+        """
+        async for result in self.user_lookup([user]):
+            try:
+                return result["errors"][0]["title"] != "Not Found Error"
+            except KeyError:
+                return True
+
+    def _check_for_disconnect(self, data):
+        """
+        Look for disconnect errors in a response. The function returns True if
+        a disconnect was found and False otherwise. Unlike Twarc2 there is no
+        need to reconnect the client, since _stream reopens the response.
+        """
+        for error in data.get("errors", []):
+            if error.get("disconnect_type") == "OperationalDisconnect":
+                log.info("Received operational disconnect message, reconnecting")
+                return True
+        return False
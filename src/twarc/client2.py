@@ -5,15 +5,16 @@ Support for the Twitter v2 API.
 """
 
 import re
-import json
 import time
 import logging
+import threading
 import datetime
 import requests
 
 from oauthlib.oauth2 import BackendApplicationClient
 from requests_oauthlib import OAuth1Session, OAuth2Session
 
+from twarc import codec, concurrency
 from twarc.expansions import (
     EXPANSIONS,
     TWEET_FIELDS,
@@ -24,6 +25,15 @@ from twarc.expansions import (
     LIST_FIELDS,
 )
 from twarc.decorators2 import *
+from twarc.ratelimit import RateLimiter
+from twarc.concurrency import Prefetch, Interleave, map_batches
+from twarc.stream import (
+    RecentIds,
+    StreamMetrics,
+    StreamReader,
+    StreamStalled,
+    backfill_minutes,
+)
 from twarc.version import version, user_agent
 
 
@@ -44,6 +54,9 @@ class Twarc2:
         bearer_token=None,
         connection_errors=0,
         metadata=True,
+        credentials=None,
+        prefetch=0,
+        passthrough=False,
     ):
         """
         Instantiate a Twarc2 instance to talk to the Twitter V2+ API.
@@ -59,6 +72,12 @@ class Twarc2:
         `access_token_secret` are all passed, then user authentication
         is used instead.
 
+        Additional `credentials` of the same auth type can be added to a pool.
+        Each request is then sent with whichever credentials have the most
+        rate limit headroom for the endpoint. Streams, stream rules and
+        compliance jobs belong to a single app, so they always use the main
+        credentials.
+
         Args:
             consumer_key (str):
                 The API key.
@@ -74,10 +93,23 @@ class Twarc2:
                 Number of retries for GETs
             metadata (bool):
                 Append `__twarc` metadata to results.
+            credentials (list[dict]):
+                Credentials to pool with the main ones, each a dict of the
+                keyword arguments above, e.g. `{"bearer_token": "..."}`
+            prefetch (int):
+                Number of pages to fetch ahead in the background while
+                paginating. Prefetched pages count against your quota even
+                if you stop iterating before using them.
+            passthrough (bool):
+                Return pages of results and tweet lookups as RawPage
+                objects, which keep the bytes that Twitter sent, instead
+                of decoding them.
         """
         self.api_version = "2"
         self.connection_errors = connection_errors
         self.metadata = metadata
+        self.prefetch = prefetch
+        self.passthrough = passthrough
         self.bearer_token = None
 
         if bearer_token:
@@ -103,10 +135,21 @@ class Twarc2:
             )
 
         self.client = None
-        self.last_response = None
+        self._local = threading.local()
+        self._connect_lock = threading.Lock()
+        self.rate_limiter = RateLimiter()
+        self.pool = []
 
         self.connect()
 
+        for kwargs in credentials or []:
+            member = Twarc2(**kwargs, metadata=metadata)
+            if member.auth_type != self.auth_type:
+                raise ValueError(
+                    f"Pooled credentials must use {self.auth_type} authentication"
+                )
+            self.pool.append(member)
+
     def _prepare_params(self, **kwargs):
         """
         Prepare URL parameters and defaults for fields and expansions and others
@@ -204,7 +247,6 @@ class Twarc2:
         sort_order,
         next_token=None,
         granularity=None,
-        sleep_between=0,
     ):
         """
         Common function for search, counts endpoints.
@@ -256,13 +298,6 @@ class Twarc2:
         if using_counts:
             while True:
                 for response in self.get_paginated(url, params=params):
-                    # Note that we're ensuring the appropriate amount of sleep is
-                    # taken before yielding every item. This ensures that we won't
-                    # exceed the rate limit even in cases where a response generator
-                    # is not completely consumed. This might be more conservative
-                    # than necessary.
-                    time.sleep(sleep_between)
-
                     # can't return without 'data' if there are no results
                     if "data" in response:
                         last_time_start = response["data"][0]["start"]
@@ -308,13 +343,6 @@ class Twarc2:
 
         else:
             for response in self.get_paginated(url, params=params):
-                # Note that we're ensuring the appropriate amount of sleep is
-                # taken before yielding every item. This ensures that we won't
-                # exceed the rate limit even in cases where a response generator
-                # is not completely consumed. This might be more conservative
-                # than necessary.
-                time.sleep(sleep_between)
-
                 # can't return without 'data' if there are no results
                 if "data" in response:
                     yield response
@@ -605,7 +633,7 @@ class Twarc2:
             params["expansions"] = "owner_id"
         url = f"https://api.twitter.com/2/lists/{list_id}"
         resp = self.get(url, params=params)
-        data = resp.json()
+        data = codec.loads(resp.content)
 
         if self.metadata:
             data = _append_metadata(data, resp.url)
@@ -774,10 +802,135 @@ class Twarc2:
             poll_fields=poll_fields,
             place_fields=place_fields,
             next_token=next_token,
-            sleep_between=1.05,
             sort_order=sort_order,
         )
 
+    @requires_app_auth
+    def search_all_sharded(
+        self,
+        query,
+        shards=4,
+        start_time=None,
+        end_time=None,
+        max_results=100,
+        expansions=None,
+        tweet_fields=None,
+        user_fields=None,
+        media_fields=None,
+        poll_fields=None,
+        place_fields=None,
+        sort_order=None,
+        boundaries=None,
+    ):
+        """
+        Search Twitter for the given query in the full archive, like
+        `search_all`, but split the time range into shards which are
+        paginated at the same time. Requests from every shard are paced by
+        the client's rate limiter.
+
+        Args:
+            query (str):
+                The query string to be passed directly to the Twitter API.
+            shards (int):
+                The number of equal length time ranges to search at once.
+            start_time (datetime):
+                Return all tweets after this time (UTC datetime). Defaults to
+                the start of Twitter.
+            end_time (datetime):
+                Return all tweets before this time (UTC datetime). Defaults to
+                30 seconds ago.
+            max_results (int):
+                The maximum number of results per request. Max is 500.
+            boundaries (list[datetime]):
+                Times to split the search at, oldest first, including the
+                start and end times, instead of equal length shards.
+
+        Returns:
+            generator[tuple]: a generator of (shard, page) tuples in the
+            order the pages arrive, where shard 0 is the oldest time range.
+        """
+        if boundaries is None:
+            boundaries = _time_shards(start_time, end_time, shards)
+
+        searches = []
+        for shard_start, shard_end in zip(boundaries, boundaries[1:]):
+            searches.append(
+                self.search_all(
+                    query,
+                    start_time=shard_start,
+                    end_time=shard_end,
+                    max_results=max_results,
+                    expansions=expansions,
+                    tweet_fields=tweet_fields,
+                    user_fields=user_fields,
+                    media_fields=media_fields,
+                    poll_fields=poll_fields,
+                    place_fields=place_fields,
+                    sort_order=sort_order,
+                )
+            )
+
+        return Interleave(searches)
+
+    @requires_app_auth
+    def plan_shards(
+        self, query, shards=4, start_time=None, end_time=None, granularity="day"
+    ):
+        """
+        Plan the shards for `search_all_sharded` using `counts_all`, so that
+        each shard holds roughly the same number of tweets rather than the
+        same length of time. Shards can't be split more finely than the
+        granularity of the counts, so a burst of tweets within one hour or
+        day can result in fewer shards.
+
+        Args:
+            query (str): The query string to be passed directly to the Twitter API.
+            shards (int): The number of shards to plan.
+            start_time (datetime): Start of the search, defaults to the start of Twitter.
+            end_time (datetime): End of the search, defaults to 30 seconds ago.
+            granularity (str): Count tweets by "hour" or "day".
+
+        Returns:
+            tuple[list, list]: The shard boundaries, including the start and
+            end times, and the number of tweets counted in each shard.
+        """
+        boundaries = _time_shards(start_time, end_time, 1)
+        buckets = []
+        for response in self.counts_all(
+            query,
+            start_time=boundaries[0],
+            end_time=boundaries[-1],
+            granularity=granularity,
+        ):
+            for bucket in response["data"]:
+                buckets.append(
+                    (_parse_ts(bucket["start"]), bucket["end"], bucket["tweet_count"])
+                )
+        buckets.sort()
+
+        total = sum(bucket[2] for bucket in buckets)
+        if total == 0:
+            boundaries = _time_shards(boundaries[0], boundaries[-1], shards)
+            return boundaries, [0] * (len(boundaries) - 1)
+
+        cuts = [boundaries[0]]
+        shard_counts = [0]
+        shard_size = total / shards
+        counted = 0
+        for bucket_start, bucket_end, tweet_count in buckets:
+            counted += tweet_count
+            shard_counts[-1] += tweet_count
+            if shard_counts[-1] >= shard_size and len(cuts) < shards:
+                bucket_end = _parse_ts(bucket_end)
+                if boundaries[0] < bucket_end < boundaries[-1]:
+                    cuts.append(bucket_end)
+                    shard_counts.append(0)
+                    # share out what is left, in case this shard was too big
+                    shard_size = (total - counted) / (shards - len(cuts) + 1)
+        cuts.append(boundaries[-1])
+
+        return cuts, shard_counts
+
     @requires_app_auth
     def counts_recent(
         self,
@@ -881,7 +1034,6 @@ class Twarc2:
             place_fields=None,
             next_token=next_token,
             granularity=granularity,
-            sleep_between=1.05,
             sort_order=None,
         )
 
@@ -894,6 +1046,8 @@ class Twarc2:
         media_fields=None,
         poll_fields=None,
         place_fields=None,
+        concurrency=1,
+        ordered=True,
     ):
         """
         Lookup tweets, taking an iterator of IDs and returning pages of fully
@@ -906,6 +1060,9 @@ class Twarc2:
 
         Args:
             tweet_ids (iterable): A list of tweet IDs
+            concurrency (int): The number of batches to look up at once.
+            ordered (bool): When looking up batches concurrently, yield
+                pages in the order of the IDs rather than as they arrive.
 
         Returns:
             generator[dict]: a generator, dict for each batch of 100 tweets.
@@ -925,24 +1082,35 @@ class Twarc2:
             params["ids"] = ",".join(tweet_id)
 
             resp = self.get(url, params=params)
-            data = resp.json()
+            if self.passthrough:
+                metadata_url = resp.url if self.metadata else None
+                return RawPage(resp.content, metadata_url, ids=tweet_id)
+
+            data = codec.loads(resp.content)
 
             if self.metadata:
                 data = _append_metadata(data, resp.url)
 
             return data
 
-        tweet_id_batch = []
+        def batches():
+            tweet_id_batch = []
 
-        for tweet_id in tweet_ids:
-            tweet_id_batch.append(str(int(tweet_id)))
+            for tweet_id in tweet_ids:
+                tweet_id_batch.append(str(int(tweet_id)))
 
-            if len(tweet_id_batch) == 100:
-                yield lookup_batch(tweet_id_batch)
-                tweet_id_batch = []
+                if len(tweet_id_batch) == 100:
+                    yield tweet_id_batch
+                    tweet_id_batch = []
 
-        if tweet_id_batch:
-            yield (lookup_batch(tweet_id_batch))
+            if tweet_id_batch:
+                yield tweet_id_batch
+
+        if concurrency > 1:
+            yield from map_batches(lookup_batch, batches(), concurrency, ordered)
+        else:
+            for tweet_id_batch in batches():
+                yield lookup_batch(tweet_id_batch)
 
     def user_lookup(
         self,
@@ -991,7 +1159,7 @@ class Twarc2:
                 params["ids"] = ",".join(users)
 
             resp = self.get(url, params=params)
-            data = resp.json()
+            data = codec.loads(resp.content)
 
             if self.metadata:
                 data = _append_metadata(data, resp.url)
@@ -1021,6 +1189,10 @@ class Twarc2:
         poll_fields=None,
         place_fields=None,
         backfill_minutes=None,
+        buffer_size=1000,
+        overflow="block",
+        metrics=None,
+        stall_timeout=30,
     ):
         """
         Returns a sample of all publicly posted tweets.
@@ -1037,6 +1209,14 @@ class Twarc2:
         Args:
             event (threading.Event): Manages a flag to stop the process.
             record_keepalive (bool): whether to output keep-alive events.
+            buffer_size (int): The number of lines read from the connection
+                that can be buffered while they are being processed.
+            overflow (str): What to do when the buffer is full: "block" to
+                wait, "drop-oldest" or "drop-newest" to discard a line.
+            metrics (StreamMetrics): Collects metrics about the stream.
+            stall_timeout (int): Reconnect if nothing, not even a keep-alive,
+                is received for this many seconds. None to wait for the
+                connection to time out.
 
         Returns:
             generator[dict]: a generator, dict for each tweet.
@@ -1051,7 +1231,16 @@ class Twarc2:
             place_fields=place_fields,
             backfill_minutes=backfill_minutes,
         )
-        yield from self._stream(url, params, event, record_keepalive)
+        yield from self._stream(
+            url,
+            params,
+            event,
+            record_keepalive,
+            buffer_size=buffer_size,
+            overflow=overflow,
+            metrics=metrics,
+            stall_timeout=stall_timeout,
+        )
 
     @requires_app_auth
     def add_stream_rules(self, rules):
@@ -1067,7 +1256,7 @@ class Twarc2:
             dict: JSON Response from Twitter API.
         """
         url = "https://api.twitter.com/2/tweets/search/stream/rules"
-        return self.post(url, {"add": rules}).json()
+        return codec.loads(self.post(url, {"add": rules}).content)
 
     @requires_app_auth
     def get_stream_rules(self):
@@ -1080,7 +1269,7 @@ class Twarc2:
             dict: JSON Response from Twitter API with a list of defined rules.
         """
         url = "https://api.twitter.com/2/tweets/search/stream/rules"
-        return self.get(url).json()
+        return codec.loads(self.get(url).content)
 
     @requires_app_auth
     def delete_stream_rule_ids(self, rule_ids):
@@ -1096,7 +1285,7 @@ class Twarc2:
             dict: JSON Response from Twitter API.
         """
         url = "https://api.twitter.com/2/tweets/search/stream/rules"
-        return self.post(url, {"delete": {"ids": rule_ids}}).json()
+        return codec.loads(self.post(url, {"delete": {"ids": rule_ids}}).content)
 
     @requires_app_auth
     def stream(
@@ -1110,6 +1299,10 @@ class Twarc2:
         poll_fields=None,
         place_fields=None,
         backfill_minutes=None,
+        buffer_size=1000,
+        overflow="block",
+        metrics=None,
+        stall_timeout=30,
     ):
         """
         Returns a stream of tweets matching the defined rules.
@@ -1126,6 +1319,14 @@ class Twarc2:
         Args:
             event (threading.Event): Manages a flag to stop the process.
             record_keepalive (bool): whether to output keep-alive events.
+            buffer_size (int): The number of lines read from the connection
+                that can be buffered while they are being processed.
+            overflow (str): What to do when the buffer is full: "block" to
+                wait, "drop-oldest" or "drop-newest" to discard a line.
+            metrics (StreamMetrics): Collects metrics about the stream.
+            stall_timeout (int): Reconnect if nothing, not even a keep-alive,
+                is received for this many seconds. None to wait for the
+                connection to time out.
 
         Returns:
             generator[dict]: a generator, dict for each tweet.
@@ -1140,53 +1341,122 @@ class Twarc2:
             place_fields=place_fields,
             backfill_minutes=backfill_minutes,
         )
-        yield from self._stream(url, params, event, record_keepalive)
+        yield from self._stream(
+            url,
+            params,
+            event,
+            record_keepalive,
+            buffer_size=buffer_size,
+            overflow=overflow,
+            metrics=metrics,
+            stall_timeout=stall_timeout,
+        )
 
-    def _stream(self, url, params, event, record_keepalive, tries=30):
+    def _stream(
+        self,
+        url,
+        params,
+        event,
+        record_keepalive,
+        tries=30,
+        buffer_size=1000,
+        overflow="block",
+        metrics=None,
+        stall_timeout=30,
+    ):
         """
         A generator that handles streaming data from a response and catches and
         logs any request exceptions, sleeps (exponential backoff) and restarts
         the stream.
 
+        The connection is read in a background thread into a buffer of up to
+        buffer_size lines, so that the time taken to decode and process the
+        tweets doesn't slow down reading the stream, which would cause Twitter
+        to disconnect it.
+
+        If backfill_minutes is in the params, reconnections are backfilled
+        with the fewest minutes that cover the time since anything (a tweet
+        or a keep-alive) was last received, up to the 5 minute maximum.
+        Tweets that are delivered again, after reconnecting or when
+        backfilling, are dropped and counted in the metrics as duplicates.
+
+        Twitter sends a keep-alive every 20 seconds when there are no tweets,
+        so if nothing arrives for stall_timeout seconds the connection is
+        assumed to be dead, and the stream reconnects without waiting for
+        the connection to time out.
+
         Args:
             url (str): the streaming endpoint URL
             params (dict): any query paramters to use with the url
             event (threading.Event): Manages a flag to stop the process.
             record_keepalive (bool): whether to output keep-alive events.
             tries (int): the number of times to retry connecting after an error
+            buffer_size (int): the number of lines that can be buffered
+            overflow (str): what to do when the buffer is full
+            metrics (StreamMetrics): collects metrics about the stream
+            stall_timeout (int): seconds without data before reconnecting
         Returns:
             generator[dict]: A generator of tweet dicts.
         """
+        metrics = metrics or StreamMetrics()
+        recent_ids = RecentIds()
         errors = 0
+
+        # Backfilling needs Academic Research access, so it is only used for
+        # reconnecting if it was asked for when starting.
+        params = dict(params)
+        backfill = params.pop("backfill_minutes", None)
+        if backfill:
+            params["backfill_minutes"] = backfill
+        last_received = None
+
         while True:
+            if backfill is not None and last_received is not None:
+                gap = time.time() - last_received
+                params["backfill_minutes"] = backfill_minutes(gap)
+                metrics.backfill_minutes = params["backfill_minutes"]
+                log.info(
+                    "backfilling %s minutes after %.0f seconds disconnected",
+                    params["backfill_minutes"],
+                    gap,
+                )
+
             log.info(f"connecting to stream {url}")
             resp = self.get(url, params=params, stream=True)
+            metrics.add(connections=1)
+            reader = StreamReader(resp, buffer_size, overflow, metrics, stall_timeout)
 
             try:
-                for line in resp.iter_lines():
+                for line in reader:
                     errors = 0
 
                     # quit & close the stream if the event is set
                     if event and event.is_set():
                         log.info("stopping response stream")
-                        resp.close()
                         return
 
                     # return the JSON data w/ optional keep-alive
                     if not line:
                         log.info("keep-alive")
+                        metrics.keepalive(reader.received)
                         if record_keepalive:
                             yield "keep-alive"
                         continue
                     else:
-                        data = json.loads(line.decode())
+                        data = codec.loads(line)
                         if self.metadata:
                             data = _append_metadata(data, resp.url)
+                        if "data" in data:
+                            if not recent_ids.add(data["data"]["id"]):
+                                log.debug("dropped duplicate %s", data["data"]["id"])
+                                metrics.add(duplicates=1)
+                                continue
+                            metrics.tweet(data["data"]["id"], reader.received)
                         yield data
                         if self._check_for_disconnect(data):
                             break
 
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, StreamStalled) as e:
                 log.warn("caught exception during streaming: %s", e)
                 errors += 1
                 if errors > tries:
@@ -1196,6 +1466,10 @@ class Twarc2:
                     secs = errors**2
                     log.info("sleeping %s seconds before reconnecting", secs)
                     time.sleep(secs)
+            finally:
+                # stop reading and close the connection
+                reader.close()
+                last_received = reader.last_received or last_received
 
     def _timeline(
         self,
@@ -1595,17 +1869,39 @@ class Twarc2:
             requests.Response: Response from Twitter API.
         """
         if not self.client:
-            self.connect()
+            self.reconnect(None)
+        url = args[0] if args else kwargs["url"]
+        key, client = self._choose_client(url)
         log.info("getting %s %s", args, kwargs)
-        r = self.last_response = self.client.get(*args, timeout=(3.05, 31), **kwargs)
+        r = self.last_response = client.get(*args, timeout=(3.05, 31), **kwargs)
+        self.rate_limiter.update(url, r.headers, key)
         return r
 
+    def _choose_client(self, url):
+        """
+        Pick the session with the most rate limit headroom for the URL, and
+        wait until a request can be sent with it.
+        """
+        if not self.pool or "/stream" in url or "/compliance/" in url:
+            self.rate_limiter.wait(url, 0)
+            return 0, self.client
+
+        key, seconds = self.rate_limiter.reserve_any(url, range(len(self.pool) + 1))
+        if seconds > 0:
+            concurrency.sleep(seconds)
+        if key == 0:
+            return key, self.client
+        else:
+            return key, self.pool[key - 1].client
+
     def get_paginated(self, *args, **kwargs):
         """
         A wrapper around the `get` method that handles Twitter token based
         pagination.
 
-        Yields one page (one API response) at a time.
+        Yields one page (one API response) at a time. If the client was
+        created with a `prefetch` depth, up to that many of the following
+        pages are fetched in the background while the current one is used.
 
         Args:
             *args: Variable length argument list.
@@ -1614,55 +1910,42 @@ class Twarc2:
         Returns:
             generator[dict]: A generator, dict for each page of results.
         """
-
-        resp = self.get(*args, **kwargs)
-        page = resp.json()
-
-        url = args[0]
-
-        if self.metadata:
-            page = _append_metadata(page, resp.url)
-
-        yield page
-
-        # Todo: Maybe this should be backwards.. check for `next_token`
-        endings = [
-            "mentions",
-            "tweets",
-            "following",
-            "followers",
-            "liked_tweets",
-            "liking_users",
-            "retweeted_by",
-            "members",
-            "memberships",
-            "followed_lists",
-            "owned_lists",
-            "pinned_lists",
-        ]
-
-        # The search endpoints only take a next_token, but the timeline
-        # endpoints take a pagination_token instead - this is a bit of a hack,
-        # but check the URL ending to see which we should use.
-        if any(url.endswith(end) for end in endings):
-            token_param = "pagination_token"
+        pages = self._paginate(*args, **kwargs)
+        if self.prefetch:
+            return Prefetch(pages, self.prefetch)
         else:
-            token_param = "next_token"
+            return pages
 
-        while "meta" in page and "next_token" in page["meta"]:
-            if "params" in kwargs:
-                kwargs["params"][token_param] = page["meta"]["next_token"]
-            else:
-                kwargs["params"] = {token_param: page["meta"]["next_token"]}
+    def _paginate(self, *args, **kwargs):
+        """
+        Generates the pages for get_paginated.
+        """
+        url = args[0]
+        token_param = _token_param(url)
 
+        while True:
             resp = self.get(*args, **kwargs)
-            page = resp.json()
+            if self.passthrough:
+                page = RawPage(resp.content, resp.url if self.metadata else None)
+            else:
+                page = codec.loads(resp.content)
+                if self.metadata:
+                    page = _append_metadata(page, resp.url)
 
-            if self.metadata:
-                page = _append_metadata(page, resp.url)
+            # Read the token before the page is handed over, in case the
+            # caller modifies it.
+            next_token = page.get("meta", {}).get("next_token")
 
             yield page
 
+            if next_token is None:
+                break
+
+            if "params" in kwargs:
+                kwargs["params"][token_param] = next_token
+            else:
+                kwargs["params"] = {token_param: next_token}
+
     @catch_request_exceptions
     @rate_limit
     def post(self, url, json_data):
@@ -1677,8 +1960,32 @@ class Twarc2:
             requests.Response: Response from Twitter API.
         """
         if not self.client:
-            self.connect()
-        return self.client.post(url, json=json_data)
+            self.reconnect(None)
+        self.rate_limiter.wait(url, 0)
+        r = self.client.post(url, json=json_data)
+        self.rate_limiter.update(url, r.headers, 0)
+        return r
+
+    @property
+    def last_response(self):
+        """
+        The last response received by the calling thread.
+        """
+        return getattr(self._local, "last_response", None)
+
+    @last_response.setter
+    def last_response(self, response):
+        self._local.last_response = response
+
+    def reconnect(self, client):
+        """
+        Replace the HTTP session after a request made with client failed.
+        Threads share the session, so it is only replaced if no other thread
+        has done so already since client was in use.
+        """
+        with self._connect_lock:
+            if self.client is client:
+                self.connect()
 
     def connect(self):
         """
@@ -1724,6 +2031,9 @@ class Twarc2:
         if self.client:
             self.client.headers.update({"User-Agent": user_agent})
 
+        for member in self.pool:
+            member.connect()
+
     @requires_app_auth
     def compliance_job_list(self, job_type, status):
         """
@@ -1743,9 +2053,11 @@ class Twarc2:
             params["type"] = job_type
         if status:
             params["status"] = status
-        result = self.client.get(
-            "https://api.twitter.com/2/compliance/jobs", params=params
-        ).json()
+        result = codec.loads(
+            self.client.get(
+                "https://api.twitter.com/2/compliance/jobs", params=params
+            ).content
+        )
         if "data" in result or not result:
             return result
         else:
@@ -1768,7 +2080,7 @@ class Twarc2:
             "https://api.twitter.com/2/compliance/jobs/{}".format(job_id)
         )
         if result.status_code == 200:
-            result = result.json()
+            result = codec.loads(result.content)
         else:
             raise ValueError(f"Error from API, response: {result.status_code}")
         if "data" in result:
@@ -1799,7 +2111,7 @@ class Twarc2:
         )
 
         if result.status_code == 200:
-            result = result.json()
+            result = codec.loads(result.content)
         else:
             raise ValueError(f"Error from API, response: {result.status_code}")
         if "data" in result:
@@ -1856,7 +2168,7 @@ class Twarc2:
 
         result = self.get(url, params=params)
         if result.status_code == 200:
-            result = result.json()
+            result = codec.loads(result.content)
         else:
             raise ValueError(f"Error from API, response: {result.status_code}")
 
@@ -1939,6 +2251,56 @@ def _ts(dt):
     return dt.isoformat(timespec="seconds")
 
 
+def _time_shards(start_time, end_time, shards):
+    """
+    Split a time range for a full archive search into equal length shards.
+    The API only searches ranges of at least 10 seconds, so a shorter range
+    is split into fewer shards.
+
+    Args:
+        start_time (datetime): Start of the range, defaults to the start of Twitter.
+        end_time (datetime): End of the range, defaults to 30 seconds ago.
+        shards (int): The most shards to split the range into.
+
+    Returns:
+        list[datetime]: The shard boundaries, including the start and end times.
+    """
+    if start_time is None:
+        start_time = datetime.datetime(2006, 3, 21, tzinfo=datetime.timezone.utc)
+    if end_time is None:
+        end_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            seconds=30
+        )
+
+    # The API only takes whole seconds, so round to avoid gaps or overlaps,
+    # and skip any boundary that would leave a shard too short to search.
+    shortest = datetime.timedelta(seconds=10)
+    step = (end_time - start_time) / shards
+    boundaries = [start_time]
+    for i in range(1, shards):
+        boundary = (start_time + step * i).replace(microsecond=0)
+        if boundary - boundaries[-1] >= shortest and end_time - boundary >= shortest:
+            boundaries.append(boundary)
+    boundaries.append(end_time)
+
+    return boundaries
+
+
+def _parse_ts(ts):
+    """
+    Parse a timestamp from the Twitter API.
+
+    Args:
+        ts (str): a timestamp like `2021-03-01T00:00:00.000Z`
+
+    Returns:
+        datetime: the timestamp in UTC.
+    """
+    return datetime.datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%fZ").replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
 def _utcnow():
     """
     Return _now_ in ISO 8601 / RFC 3339 datetime in UTC.
@@ -1949,6 +2311,40 @@ def _utcnow():
     return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
 
 
+def _token_param(url):
+    """
+    The search endpoints only take a next_token, but the timeline endpoints
+    take a pagination_token instead - this is a bit of a hack, but check the
+    URL ending to see which we should use.
+
+    Args:
+        url (str): URL of the API endpoint being paginated.
+
+    Returns:
+        str: The name of the pagination parameter.
+    """
+    # Todo: Maybe this should be backwards.. check for `next_token`
+    endings = [
+        "mentions",
+        "tweets",
+        "following",
+        "followers",
+        "liked_tweets",
+        "liking_users",
+        "retweeted_by",
+        "members",
+        "memberships",
+        "followed_lists",
+        "owned_lists",
+        "pinned_lists",
+    ]
+
+    if any(url.endswith(end) for end in endings):
+        return "pagination_token"
+    else:
+        return "next_token"
+
+
 def _append_metadata(result, url):
     """
     Appends `__twarc` metadata to the result.
@@ -1964,3 +2360,117 @@ def _append_metadata(result, url):
     """
     result["__twarc"] = {"url": url, "version": version, "retrieved_at": _utcnow()}
     return result
+
+
+# What follows the meta key of a page.
+_META_SEPARATOR = re.compile(rb"\s*:\s*")
+# The data key of a page. A quote can't appear unescaped inside a JSON
+# string, so this can only match a key, and tweets don't have a data key.
+_DATA_KEY = re.compile(rb'"data"\s*:')
+
+
+class RawPage:
+    """
+    A page of results as the bytes that Twitter sent, so that it can be
+    written out without decoding and encoding every tweet in it. Only its
+    meta is decoded, which is all that is needed to paginate and show
+    progress, and `__twarc` metadata is added to the end of the bytes.
+
+    Like a decoded page, `"data" in page` is true if it has results and
+    `page["meta"]` is its meta.
+
+    Args:
+        content (bytes): The body of the response.
+        url (str): The URL of the request, to add `__twarc` metadata for,
+            or None to leave it out.
+        ids (list): The ids that were looked up, for lookups, which don't
+            have meta.
+    """
+
+    def __init__(self, content, url=None, ids=None):
+        content = content.strip()
+        if b"\n" in content or b"\r" in content:
+            # JSON strings can't contain new lines, so these are whitespace
+            content = content.translate(None, b"\r\n")
+        self.meta = _raw_meta(content)
+        self.ids = ids
+
+        if url is not None:
+            metadata = _append_metadata({}, url)["__twarc"]
+            separator = b"" if content[:-1].rstrip().endswith(b"{") else b","
+            content = b"".join(
+                [
+                    content[:-1],
+                    separator,
+                    b'"__twarc":',
+                    codec.dumps(metadata).encode("utf-8"),
+                    b"}",
+                ]
+            )
+        self.content = content
+
+    @property
+    def text(self):
+        """
+        str: The page as a line of JSON.
+        """
+        return self.content.decode("utf-8")
+
+    @property
+    def result_count(self):
+        """
+        int: The number of results in the page, according to its meta.
+        """
+        return (self.meta or {}).get("result_count", 0)
+
+    def __contains__(self, key):
+        if key == "meta":
+            return self.meta is not None
+        elif key == "data":
+            if self.meta and "result_count" in self.meta:
+                return self.meta["result_count"] > 0
+            return _DATA_KEY.search(self.content) is not None
+        return False
+
+    def __getitem__(self, key):
+        if key == "meta" and self.meta is not None:
+            return self.meta
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def _raw_meta(content):
+    """
+    Decode the meta of a page of results without decoding the rest of it.
+    Twitter puts the meta last, so it is what comes after the last meta key,
+    up to the closing brace of the page. If it isn't, the page is decoded.
+
+    Args:
+        content (bytes): The page.
+
+    Returns:
+        dict: The meta of the page, or None if it doesn't have one.
+    """
+    pos = len(content)
+    while True:
+        pos = content.rfind(b'"meta"', 0, pos)
+        if pos == -1:
+            return None
+        # a string followed by a colon is a key, otherwise it's a value
+        separator = _META_SEPARATOR.match(content, pos + len(b'"meta"'))
+        if separator:
+            break
+
+    try:
+        meta = codec.loads(content[separator.end() : -1])
+    except ValueError:
+        # a meta key inside something else
+        meta = None
+    if isinstance(meta, dict):
+        return meta
+    return codec.loads(content).get("meta")
@@ -0,0 +1,147 @@
+"""
+Reading and writing JSON.
+
+twarc decodes JSON with orjson or simdjson when one of them is installed
+(pip install twarc[json]) and with the json module in the standard library
+otherwise. Either way the data is the same, except for integers too big for
+64 bits, which Twitter doesn't send.
+
+JSON is written exactly as json.dumps writes it, byte for byte, unless
+compact output is turned on. Compact output is written by orjson when it is
+installed, and it has no spaces after separators and writes non-ASCII
+characters as UTF-8 instead of escaping them. It is quicker to write and
+smaller, and it decodes to the same data.
+"""
+
+import json
+import logging
+import importlib
+
+log = logging.getLogger("twarc")
+
+BACKENDS = ["orjson", "simdjson", "json"]
+
+JSONDecodeError = json.JSONDecodeError
+
+backend = "json"
+compact = False
+
+_decode = None
+_encode = None
+
+
+def configure(name="auto", compact_output=False):
+    """
+    Choose how JSON is read and written.
+
+    Args:
+        name (str): The decoder to use: orjson, simdjson, json (the standard
+            library) or auto, for the first one of these that is installed.
+        compact_output (bool): Write compact JSON with orjson, instead of
+            writing what json.dumps writes.
+
+    Returns:
+        str: The name of the decoder in use.
+    """
+    global backend, compact, _decode, _encode
+
+    if name == "auto":
+        names = BACKENDS
+    elif name in BACKENDS:
+        names = [name]
+    else:
+        raise ValueError(f"unknown JSON backend {name}, use one of {BACKENDS}")
+
+    for candidate in names:
+        decode = _load_decoder(candidate)
+        if decode is not None:
+            break
+    else:
+        raise ValueError(
+            f"{name} is not installed, you can install it with pip install {name}"
+        )
+
+    backend = candidate
+    _decode = decode
+    compact = compact_output
+    _encode = _load_encoder() if compact_output else None
+    log.debug("decoding JSON with %s, compact output %s", backend, compact)
+    return backend
+
+
+def _load_decoder(name):
+    if name == "json":
+        return json.loads
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return None
+    return module.loads
+
+
+def _load_encoder():
+    try:
+        import orjson
+    except ImportError:
+        log.warning("orjson is not installed, writing JSON with json.dumps")
+        return None
+
+    def encode(obj, indent, default):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option).decode("utf-8")
+
+    return encode
+
+
+def loads(data):
+    """
+    Decode JSON.
+
+    Args:
+        data (str or bytes): The JSON text, such as a line of a file or the
+            content of a response.
+
+    Returns:
+        The decoded data.
+    """
+    try:
+        return _decode(data)
+    except ValueError:
+        # orjson and simdjson don't accept NaN or Infinity, which json does.
+        # If it isn't JSON at all this raises json's JSONDecodeError.
+        if _decode is json.loads:
+            raise
+        return json.loads(data)
+
+
+def dumps(obj, indent=None, default=None):
+    """
+    Encode JSON, the same way as json.dumps unless compact output is on.
+
+    Args:
+        obj: The data to encode.
+        indent (int): Indent the output, like json.dumps.
+        default (function): Called for objects that can't otherwise be
+            encoded, like json.dumps.
+
+    Returns:
+        str: The JSON text.
+    """
+    if _encode is not None:
+        try:
+            return _encode(obj, indent, default)
+        except TypeError:
+            # integers bigger than 64 bits and the like
+            return json.dumps(
+                obj,
+                indent=indent,
+                default=default,
+                ensure_ascii=False,
+                separators=(",", ":") if indent is None else (",", ": "),
+            )
+    return json.dumps(obj, indent=indent, default=default)
+
+
+configure()
@@ -2,8 +2,10 @@
 The command line interfact to the Twitter v2 API.
 """
 
+import io
 import os
 import re
+import glob
 import json
 import time
 import twarc
@@ -13,8 +15,12 @@ import pathlib
 import datetime
 import humanize
 import requests
+import hashlib
 import configobj
+import shutil
+import tempfile
 import threading
+import collections
 
 from tqdm.auto import tqdm
 from tqdm.utils import CallbackIOWrapper
@@ -23,11 +29,27 @@ from datetime import timezone
 from click_plugins import with_plugins
 from importlib.metadata import entry_points
 
+from twarc import codec
 from twarc.version import version
 from twarc.handshake import handshake
 from twarc.config import ConfigProvider
+from twarc.client2 import RawPage, _time_shards, _ts
+from twarc.concurrency import Interleave, line_ranges, map_batches
+from twarc.stream import (
+    COMPRESSION_EXTENSIONS,
+    MAX_BACKFILL_MINUTES,
+    OVERFLOW_POLICIES,
+    MetricsReporter,
+    RotatingFile,
+    RuleFiles,
+    StreamMetrics,
+    StreamWriter,
+)
+from twarc.queries import Query, join_queries, pack_queries, tag_matching_queries
+from twarc.export import CSVWriter, ParquetWriter
 from twarc.expansions import (
     ensure_flattened,
+    iter_flattened,
     EXPANSIONS,
     TWEET_FIELDS,
     USER_FIELDS,
@@ -91,6 +113,22 @@ log = logging.getLogger("twarc")
     "higher with user authentication, but not all endpoints are supported.",
     show_default=True,
 )
+@click.option(
+    "--pool/--no-pool",
+    "use_pool",
+    default=True,
+    show_default=True,
+    help="Spread requests over the credentials added with `twarc2 configure --pool`.",
+)
+@click.option(
+    "--prefetch",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Number of pages of results to fetch ahead in the background. Pages "
+    "fetched ahead count against your quota even when --limit stops the "
+    "collection before they are used.",
+)
 @click.option("--log", "-l", "log_file", default="twarc.log")
 @click.option("--verbose", is_flag=True, default=False)
 @click.option(
@@ -99,6 +137,21 @@ log = logging.getLogger("twarc")
     show_default=True,
     help="Include/don't include metadata about when and how data was collected.",
 )
+@click.option(
+    "--json-backend",
+    type=click.Choice(["auto"] + codec.BACKENDS),
+    default="auto",
+    envvar="TWARC_JSON_BACKEND",
+    show_default=True,
+    help="Library to decode JSON with. auto uses orjson or simdjson if installed.",
+)
+@click.option(
+    "--compact-json/--no-compact-json",
+    default=False,
+    show_default=True,
+    help="Write JSON with orjson, without spaces after separators or escaped "
+    "non-ASCII characters, instead of the way Python's json module writes it.",
+)
 @configuration_option(
     cmd_name="twarc", config_file_name="config", provider=config_provider
 )
@@ -113,7 +166,11 @@ def twarc2(
     log_file,
     metadata,
     app_auth,
+    use_pool,
+    prefetch,
     verbose,
+    json_backend,
+    compact_json,
 ):
     """
     Collect data from the Twitter V2 API.
@@ -124,8 +181,15 @@ def twarc2(
         format="%(asctime)s %(levelname)s %(message)s",
     )
 
+    try:
+        codec.configure(json_backend, compact_json)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
     log.info("using config %s", config_provider.file_path)
 
+    credentials = _credential_pool(app_auth) if use_pool else []
+
     if bearer_token or (consumer_key and consumer_secret):
         if app_auth and (bearer_token or (consumer_key and consumer_secret)):
             ctx.obj = twarc.Twarc2(
@@ -133,6 +197,8 @@ def twarc2(
                 consumer_secret=consumer_secret,
                 bearer_token=bearer_token,
                 metadata=metadata,
+                credentials=credentials,
+                prefetch=prefetch,
             )
         # Check everything is present for user auth.
         elif consumer_key and consumer_secret and access_token and access_token_secret:
@@ -142,6 +208,8 @@ def twarc2(
                 access_token=access_token,
                 access_token_secret=access_token_secret,
                 metadata=metadata,
+                credentials=credentials,
+                prefetch=prefetch,
             )
         else:
             click.echo(
@@ -169,9 +237,48 @@ def twarc2(
         ctx.invoke(configure)
 
 
+def _credential_pool(app_auth):
+    """
+    Returns the credentials that have been added to the pool section of the
+    config file, as keyword arguments for Twarc2.
+    """
+    if app_auth:
+        keys = ["consumer_key", "consumer_secret", "bearer_token"]
+    else:
+        keys = [
+            "consumer_key",
+            "consumer_secret",
+            "access_token",
+            "access_token_secret",
+        ]
+
+    credentials = []
+    config = config_provider.config or {}
+    for name, profile in config.get("pool", {}).items():
+        kwargs = {key: profile[key] for key in keys if profile.get(key)}
+        if app_auth and ("bearer_token" in kwargs or len(kwargs) == 2):
+            credentials.append(kwargs)
+        elif not app_auth and len(kwargs) == 4:
+            credentials.append(kwargs)
+        else:
+            log.warning("pool profile %s has no keys for this auth type", name)
+            continue
+        log.info("adding %s to the credential pool", name)
+
+    return credentials
+
+
 @twarc2.command("configure")
+@click.option(
+    "--pool",
+    "profile",
+    type=str,
+    default=None,
+    help="Add the keys to the credential pool under this profile name, "
+    "instead of replacing the main keys.",
+)
 @click.pass_context
-def configure(ctx):
+def configure(ctx, profile):
     """
     Set up your Twitter app keys.
     """
@@ -188,8 +295,16 @@ def configure(ctx):
     if keys is None:
         raise click.ClickException("Unable to authenticate")
 
-    config = configobj.ConfigObj(unrepr=True)
-    config.filename = config_file
+    old_config = configobj.ConfigObj(config_file, unrepr=True)
+    if profile:
+        config = old_config
+        config.setdefault("pool", {})
+        config["pool"][profile] = {}
+        section = config["pool"][profile]
+    else:
+        config = configobj.ConfigObj(unrepr=True)
+        config.filename = config_file
+        section = config
 
     # Only write non empty keys.
     for key in [
@@ -200,13 +315,26 @@ def configure(ctx):
         "bearer_token",
     ]:
         if keys.get(key, None):
-            config[key] = keys[key]
+            section[key] = keys[key]
+
+    # Keep any pooled credentials when replacing the main keys.
+    if not profile and "pool" in old_config:
+        config["pool"] = old_config["pool"]
 
     config.write()
 
-    click.echo(
-        click.style(f"\nYour keys have been written to {config_file}", fg="green")
-    )
+    if profile:
+        click.echo(
+            click.style(
+                f"\nYour keys have been added to the {profile} pool profile "
+                f"in {config_file}",
+                fg="green",
+            )
+        )
+    else:
+        click.echo(
+            click.style(f"\nYour keys have been written to {config_file}", fg="green")
+        )
     click.echo()
     click.echo("\n✨ ✨ ✨  Happy twarcing! ✨ ✨ ✨\n")
 
@@ -240,6 +368,12 @@ def _search(
     poll_fields,
     place_fields,
     sort_order,
+    shards=1,
+    shard_files=False,
+    balance_shards=None,
+    save_state=False,
+    resume=False,
+    passthrough=False,
 ):
     """
     Common function to Search for tweets.
@@ -263,17 +397,34 @@ def _search(
     else:
         search_method = T.search_recent
 
-    hide_progress = True if (outfile.name == "<stdout>") else hide_progress
+    if balance_shards and shards < 2:
+        # the search would otherwise not be sharded, but not resumable either
+        raise click.UsageError("--balance-shards needs --shards of 2 or more")
 
-    with TimestampProgressBar(
-        since_id, until_id, start_time, end_time, disable=hide_progress
-    ) as progress:
-        for result in search_method(
-            query=query,
-            since_id=since_id,
-            until_id=until_id,
-            start_time=start_time,
-            end_time=end_time,
+    if shards > 1 or shard_files or balance_shards:
+        if not archive:
+            raise click.UsageError("--shards can only be used with --archive")
+        if since_id or until_id:
+            raise click.UsageError(
+                "--shards can't be used with --since-id or --until-id"
+            )
+        if resume:
+            raise click.UsageError("--shards can't be used with --resume")
+        if balance_shards:
+            boundaries = _plan_shards(
+                T, query, shards, start_time, end_time, balance_shards, max_results
+            )
+        else:
+            boundaries = _time_shards(start_time, end_time, shards)
+        T.passthrough = passthrough
+        return _search_shards(
+            T,
+            query,
+            outfile,
+            limit,
+            hide_progress,
+            shard_files,
+            boundaries=boundaries,
             max_results=max_results,
             expansions=expansions,
             tweet_fields=tweet_fields,
@@ -282,12 +433,48 @@ def _search(
             poll_fields=poll_fields,
             place_fields=place_fields,
             sort_order=sort_order,
-        ):
+        )
+
+    hide_progress = True if (outfile.name == "<stdout>") else hide_progress
+    T.passthrough = passthrough
+
+    search_kwargs = {
+        "since_id": since_id,
+        "until_id": until_id,
+        "start_time": start_time,
+        "end_time": end_time,
+        "max_results": max_results,
+        "expansions": expansions,
+        "tweet_fields": tweet_fields,
+        "user_fields": user_fields,
+        "media_fields": media_fields,
+        "poll_fields": poll_fields,
+        "place_fields": place_fields,
+        "sort_order": sort_order,
+    }
+
+    state = None
+    if save_state and outfile.name != "<stdout>":
+        SearchState.prepare(outfile, resume)
+        state = SearchState(outfile, query, archive=archive, **search_kwargs)
+        if resume and state.load():
+            count = state.count
+
+    with TimestampProgressBar(
+        since_id, until_id, start_time, end_time, disable=hide_progress
+    ) as progress:
+        progress.tweet_count = count
+        if state and resume:
+            results = _resume_search(search_method, query, state, **search_kwargs)
+        else:
+            results = search_method(query=query, **search_kwargs)
+        for result in results:
             _write(result, outfile)
-            tweet_ids = [t["id"] for t in result.get("data", [])]
-            log.info("archived %s", ",".join(tweet_ids))
+            _log_archived(result)
             progress.update_with_result(result)
-            count += len(result["data"])
+            count += _result_count(result)
+            if state:
+                state.save(result, outfile)
             if limit != 0 and count >= limit:
                 # Display message when stopped early
                 progress.desc = f"Set --limit of {limit} reached"
@@ -295,6 +482,280 @@ def _search(
         else:
             progress.early_stop = False
 
+    if state:
+        SearchState.remove_all(outfile)
+
+
+class SearchState:
+    """
+    Saves how far a search has got next to the output file, so that it can be
+    continued with --resume: the query and its parameters, the next_token for
+    the next page, the oldest tweet id written, the number of tweets written
+    and the size of the output file.
+    """
+
+    def __init__(self, outfile, query, **params):
+        digest = hashlib.sha1(query.encode("utf-8")).hexdigest()[:10]
+        self.path = f"{outfile.name}.{digest}.state"
+        self.query = query
+        self.params = {
+            key: _ts(value) if isinstance(value, datetime.datetime) else value
+            for key, value in params.items()
+        }
+        self.next_token = None
+        self.oldest_id = None
+        self.count = 0
+        self.size = 0
+        self.done = False
+
+    @staticmethod
+    def prepare(outfile, resume):
+        """
+        Truncate the output file before starting: to where the saved searches
+        got to when resuming, or completely when starting again.
+        """
+        if resume:
+            saved = SearchState.saved(outfile)
+            size = max((state["size"] for state in saved), default=0)
+            if not saved:
+                click.echo(
+                    click.style(
+                        f"No saved search state found for {outfile.name}, "
+                        "starting from the beginning.",
+                        fg="yellow",
+                    ),
+                    err=True,
+                )
+            outfile.truncate(size)
+        else:
+            SearchState.remove_all(outfile)
+            outfile.truncate(0)
+
+    @staticmethod
+    def saved(outfile):
+        """
+        Returns the saved state of all of the searches for the output file.
+        """
+        saved = []
+        for path in glob.glob(glob.escape(outfile.name) + ".*.state"):
+            with open(path) as f:
+                saved.append(json.load(f))
+        return saved
+
+    @staticmethod
+    def remove_all(outfile):
+        """
+        Remove the saved state of all of the searches for the output file.
+        """
+        for path in glob.glob(glob.escape(outfile.name) + ".*.state"):
+            os.remove(path)
+
+    def load(self):
+        """
+        Load the saved state, if there is any, and return True if there was.
+        """
+        if not os.path.isfile(self.path):
+            return False
+
+        with open(self.path) as f:
+            saved = json.load(f)
+        if saved["query"] != self.query or saved["params"] != self.params:
+            raise click.UsageError(
+                f"{self.path} was saved by a search with different options, "
+                "remove it to start the search again."
+            )
+
+        self.next_token = saved["next_token"]
+        self.oldest_id = saved["oldest_id"]
+        self.count = saved["count"]
+        self.size = saved["size"]
+        self.done = saved["done"]
+        log.info("resuming search for %s from %s", self.query, self.path)
+        return True
+
+    def save(self, result, outfile):
+        """
+        Save the state after a page of results has been written.
+        """
+        meta = result.get("meta", {})
+        self.next_token = meta.get("next_token")
+        self.oldest_id = meta.get("oldest_id", self.oldest_id)
+        self.count += _result_count(result)
+        outfile.flush()
+        self.size = os.fstat(outfile.fileno()).st_size
+        self._write()
+
+    def finish(self):
+        """
+        Record that the search is complete.
+        """
+        self.done = True
+        self._write()
+
+    def _write(self):
+        # Replace the file in one go, so it is never left half written.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "query": self.query,
+                    "params": self.params,
+                    "next_token": self.next_token,
+                    "oldest_id": self.oldest_id,
+                    "count": self.count,
+                    "size": self.size,
+                    "done": self.done,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+
+def _resume_search(search_method, query, state, **kwargs):
+    """
+    Continue a search from its saved state. If the saved next_token is no
+    longer accepted, continue from the oldest tweet written instead.
+    """
+    if state.next_token:
+        results = search_method(query, next_token=state.next_token, **kwargs)
+        try:
+            first = next(results, None)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 400:
+                raise
+            log.warning(
+                "next_token %s was rejected, resuming with until_id %s",
+                state.next_token,
+                state.oldest_id,
+            )
+        else:
+            if first is not None:
+                yield first
+                yield from results
+            return
+    elif state.oldest_id:
+        # the last page was written, there is nothing more to get
+        return
+
+    if state.oldest_id:
+        kwargs["until_id"] = int(state.oldest_id)
+    yield from search_method(query, **kwargs)
+
+
+def _search_shards(
+    T, query, outfile, limit, hide_progress, shard_files, boundaries, **kwargs
+):
+    """
+    Search the full archive in time shards at the same time. The results are
+    either written to a numbered file per shard, oldest first, or merged into
+    the output file in the same order as a single search.
+    """
+    count = 0
+    hide_progress = True if (outfile.name == "<stdout>") else hide_progress
+    shards = len(boundaries) - 1
+
+    if shard_files and outfile.name == "<stdout>":
+        raise click.UsageError("--shard-files needs an output file")
+    # only once the options have been checked, so a mistake doesn't lose the
+    # results of an earlier search
+    if outfile.name != "<stdout>":
+        outfile.truncate(0)
+
+    if shard_files:
+        tmpdir = None
+        paths = [_numbered_filepath(outfile.name, i + 1) for i in range(shards)]
+    else:
+        # Shards are collected side by side, so keep them in temporary files
+        # until they are finished.
+        outdir = None
+        if outfile.name != "<stdout>":
+            outdir = os.path.dirname(os.path.abspath(outfile.name))
+        tmpdir = tempfile.mkdtemp(prefix="twarc-shards-", dir=outdir)
+        paths = [os.path.join(tmpdir, f"{i}.jsonl") for i in range(shards)]
+
+    files = [open(path, "w") for path in paths]
+    try:
+        with TimestampProgressBar(
+            None, None, boundaries[0], boundaries[-1], disable=hide_progress
+        ) as progress:
+            results = T.search_all_sharded(query, boundaries=boundaries, **kwargs)
+            try:
+                for shard, result in results:
+                    _write(result, files[shard])
+                    _log_archived(result)
+                    progress.update_with_result(result)
+                    count += _result_count(result)
+                    if limit != 0 and count >= limit:
+                        # Display message when stopped early
+                        progress.desc = f"Set --limit of {limit} reached"
+                        break
+                else:
+                    progress.early_stop = False
+            finally:
+                results.close()
+    finally:
+        for f in files:
+            f.close()
+        if tmpdir:
+            # Newest shard first, to match the order of a single search.
+            for path in reversed(paths):
+                with open(path) as f:
+                    shutil.copyfileobj(f, outfile)
+            shutil.rmtree(tmpdir)
+
+    if shard_files:
+        click.echo(
+            click.style(
+                f"Wrote {shards} shards to {paths[0]} to {paths[-1]}", fg="green"
+            ),
+            err=True,
+        )
+
+
+def _plan_shards(T, query, shards, start_time, end_time, granularity, max_results):
+    """
+    Plan shards of equal tweet volume using counts, and print an estimate of
+    the requests and quota the search will use.
+    """
+    click.echo(
+        click.style(f"Counting tweets by {granularity} to plan shards...", fg="blue"),
+        err=True,
+    )
+    boundaries, shard_counts = T.plan_shards(
+        query, shards, start_time, end_time, granularity=granularity
+    )
+
+    total = sum(shard_counts)
+    requests = sum(max(1, -(-count // max_results)) for count in shard_counts)
+    # The full archive search allows 1 request/second for each app.
+    seconds = requests * 1.05 / (1 + len(T.pool))
+
+    for i, count in enumerate(shard_counts):
+        click.echo(
+            f"shard {i + 1}: {_ts(boundaries[i])} to {_ts(boundaries[i + 1])} "
+            f"{count:,} tweets",
+            err=True,
+        )
+    click.echo(
+        click.style(
+            f"About {total:,} tweets of your monthly quota in {requests:,} "
+            f"requests, taking at least "
+            f"{humanize.naturaldelta(datetime.timedelta(seconds=seconds))}.",
+            fg="green",
+        ),
+        err=True,
+    )
+
+    return boundaries
+
+
+def _numbered_filepath(filepath, num):
+    """
+    Add a number to a file name, before the extension.
+    """
+    path, ext = os.path.splitext(filepath)
+    return "{}-{:0>3}{}".format(path, num, ext)
+
 
 class MutuallyExclusiveOption(Option):
     """
@@ -350,6 +811,99 @@ def command_line_progressbar_option(f):
     return f
 
 
+def command_line_passthrough_option(f):
+    """
+    Decorator for writing responses without decoding them.
+    """
+    f = click.option(
+        "--passthrough",
+        is_flag=True,
+        default=False,
+        help="Write the responses as Twitter sent them, without decoding and "
+        "encoding every tweet, which is quicker. Only their meta is decoded.",
+    )(f)
+    return f
+
+
+def command_line_stream_options(f):
+    """
+    Decorator for specifying how a stream is buffered and monitored.
+    """
+    f = click.option(
+        "--buffer-size",
+        type=click.IntRange(min=1),
+        default=1000,
+        show_default=True,
+        help="Number of lines read from the stream that can be buffered while "
+        "they are being written.",
+    )(f)
+    f = click.option(
+        "--overflow",
+        type=click.Choice(OVERFLOW_POLICIES),
+        default="block",
+        show_default=True,
+        help="What to do when the buffer is full: wait for space, or drop the "
+        "oldest or newest line.",
+    )(f)
+    f = click.option(
+        "--backfill",
+        "backfill_minutes",
+        type=click.IntRange(0, MAX_BACKFILL_MINUTES),
+        default=None,
+        help="Minutes of tweets to backfill when the stream starts. Any "
+        "reconnections are then backfilled to cover the time disconnected. "
+        "Requires Academic Research access.",
+    )(f)
+    f = click.option(
+        "--metrics-file",
+        type=click.Path(dir_okay=False),
+        default=None,
+        help="Append metrics about the stream to this file as lines of JSON.",
+    )(f)
+    f = click.option(
+        "--metrics-interval",
+        type=int,
+        default=60,
+        show_default=True,
+        help="Seconds between logging metrics about the stream, 0 to disable.",
+    )(f)
+    f = click.option(
+        "--stall-timeout",
+        type=click.IntRange(min=0),
+        default=30,
+        show_default=True,
+        help="Reconnect if nothing, not even a keep-alive, is received from the "
+        "stream for this many seconds, 0 to wait for the connection to time out.",
+    )(f)
+    f = click.option(
+        "--rotate-size",
+        callback=_validate_size,
+        default=None,
+        help="Write to numbered files, starting a new one when the current one "
+        "reaches this size, e.g. 500M or 2G.",
+    )(f)
+    f = click.option(
+        "--rotate-lines",
+        type=click.IntRange(min=1),
+        default=None,
+        help="Write to numbered files, starting a new one after this many lines.",
+    )(f)
+    f = click.option(
+        "--rotate-interval",
+        callback=_validate_interval,
+        default=None,
+        help="Write to numbered files, starting a new one at the end of every "
+        "interval of the clock, e.g. 1h or 30m.",
+    )(f)
+    f = click.option(
+        "--compress",
+        type=click.Choice(list(COMPRESSION_EXTENSIONS)),
+        default=None,
+        help="Compress the numbered files. zstd needs the zstandard package.",
+    )(f)
+    return f
+
+
 def command_line_search_options(f):
     """
     Decorator for specifying time range search API parameters.
@@ -396,6 +950,32 @@ def command_line_timelines_options(f):
     return f
 
 
+def _validate_size(context, parameter, value):
+    """
+    Convert a size like 100K, 500M or 2G into bytes.
+    """
+    if value is None:
+        return None
+    units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+    match = re.match(r"^(\d+)([KMG]?)B?$", value.strip().upper())
+    if not match or int(match.group(1)) == 0:
+        raise click.BadParameter("must be a size like 100K, 500M or 2G")
+    return int(match.group(1)) * units[match.group(2)]
+
+
+def _validate_interval(context, parameter, value):
+    """
+    Convert an interval like 90, 30m, 1h or 1d into seconds.
+    """
+    if value is None:
+        return None
+    units = {"": 1, "S": 1, "M": 60, "H": 3600, "D": 86400}
+    match = re.match(r"^(\d+)([SMHD]?)$", value.strip().upper())
+    if not match or int(match.group(1)) == 0:
+        raise click.BadParameter("must be an interval like 90, 30m, 1h or 1d")
+    return int(match.group(1)) * units[match.group(2)]
+
+
 def _validate_max_results(context, parameter, value):
     """
     Validate and set appropriate max_results parameter.
@@ -621,13 +1201,42 @@ def command_line_verbose_options(f):
     type=click.Choice(["recency", "relevancy"]),
     help='Filter tweets based on their date ("recency") (default) or based on their relevance as indicated by Twitter ("relevancy")',
 )
+@click.option(
+    "--shards",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Split the time range of an --archive search into this many shards "
+    "that are searched at the same time.",
+)
+@click.option(
+    "--balance-shards",
+    type=click.Choice(["day", "hour"], case_sensitive=False),
+    default=None,
+    help="Count the tweets matching the query by day or hour first, and split "
+    "--shards so that each one holds a similar number of tweets.",
+)
+@click.option(
+    "--shard-files",
+    is_flag=True,
+    default=False,
+    help="Write each shard to its own numbered file instead of merging them "
+    "into the output file.",
+)
 @command_line_search_options
 @command_line_search_archive_options
 @command_line_expansions_shortcuts
 @command_line_expansions_options
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue an interrupted search, appending to the existing output file.",
+)
+@command_line_passthrough_option
 @command_line_progressbar_option
 @click.argument("query", type=str)
-@click.argument("outfile", type=click.File("w"), default="-")
+@click.argument("outfile", type=click.File("a"), default="-")
 @click.pass_obj
 @cli_api_error
 def search(
@@ -642,10 +1251,14 @@ def search(
 
     kwargs = _process_expansions_shortcuts(kwargs)
 
+    # sharded searches write their own files, and aren't resumable
+    save_state = not (kwargs.get("shards", 1) > 1 or kwargs.get("shard_files"))
+
     return _search(
         T,
         query,
         outfile,
+        save_state=save_state,
         **kwargs,
     )
 
@@ -1080,7 +1693,8 @@ def liked_tweets(T, user_id, outfile, limit, max_results, hide_progress):
 @command_line_expansions_shortcuts
 @command_line_expansions_options
 @click.option("--limit", default=0, help="Maximum number of tweets to save")
-@click.argument("outfile", type=click.File("a+"), default="-")
+@command_line_stream_options
+@click.argument("outfile", type=click.File("a+", lazy=True), default="-")
 @click.pass_obj
 @cli_api_error
 def sample(T, outfile, limit, **kwargs):
@@ -1090,8 +1704,6 @@ def sample(T, outfile, limit, **kwargs):
 
     kwargs = _process_expansions_shortcuts(kwargs)
 
-    count = 0
-    event = threading.Event()
     click.echo(
         click.style(
             f"Started a random sample stream, writing to {outfile.name}\nCTRL+C to stop...",
@@ -1099,36 +1711,288 @@ def sample(T, outfile, limit, **kwargs):
         ),
         err=True,
     )
-    for result in T.sample(event=event, **kwargs):
-        count += 1
-        if limit != 0 and count >= limit:
-            event.set()
-        _write(result, outfile)
+    _stream_to_file(T.sample, outfile, limit, **kwargs)
 
-        if result and "data" in result:
-            log.info("archived %s", result["data"]["id"])
+
+def _stream_to_file(
+    stream_method,
+    outfile,
+    limit,
+    buffer_size,
+    overflow,
+    metrics_file,
+    metrics_interval,
+    rotate_size,
+    rotate_lines,
+    rotate_interval,
+    compress,
+    partition_by_rule=False,
+    **kwargs,
+):
+    """
+    Write the results of a stream to the outfile. The results are written in
+    a background thread, so that a slow disk doesn't hold up reading the
+    stream, and metrics about the stream are logged as it runs. When rotating
+    the results are written to numbered files instead, which are compressed
+    in the same background thread, and when partitioning by rule they are
+    written to a file for each rule they matched.
+    """
+    rotating = rotate_size or rotate_lines or rotate_interval or compress
+    if partition_by_rule:
+        if rotating:
+            raise click.UsageError(
+                "--partition-by-rule can't be used with rotating output"
+            )
+        if outfile.name == "-":
+            raise click.UsageError("--partition-by-rule needs an output file")
+        outfile = RuleFiles(outfile.name)
+    elif rotating:
+        if outfile.name == "-":
+            raise click.UsageError(
+                "--rotate-size, --rotate-lines, --rotate-interval and --compress "
+                "need an output file"
+            )
+        outfile = RotatingFile(
+            outfile.name,
+            max_bytes=rotate_size,
+            max_lines=rotate_lines,
+            max_seconds=rotate_interval,
+            compression=compress,
+        )
+
+    event = threading.Event()
+    metrics = StreamMetrics()
+    reporter = MetricsReporter(metrics, metrics_interval, metrics_file)
+    if isinstance(outfile, RuleFiles):
+        write = outfile.write
+    else:
+        write = lambda result: _write(result, outfile)
+    writer = StreamWriter(write, buffer_size, metrics)
+
+    count = 0
+    try:
+        results = stream_method(
+            event=event,
+            buffer_size=buffer_size,
+            overflow=overflow,
+            metrics=metrics,
+            **kwargs,
+        )
+        for result in results:
+            count += 1
+            if limit != 0 and count >= limit:
+                log.info(f"reached limit {limit}")
+                event.set()
+            writer.put(result)
+
+            if result and "data" in result:
+                log.info("archived %s", result["data"]["id"])
+    finally:
+        writer.close()
+        reporter.close()
+        if isinstance(outfile, (RotatingFile, RuleFiles)):
+            outfile.close()
 
 
 @twarc2.command("hydrate")
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of batches of 100 tweet ids to look up at the same time.",
+)
+@click.option(
+    "--ordered/--unordered",
+    default=True,
+    show_default=True,
+    help="With --concurrency, write results in the order of the input ids, "
+    "or as soon as they arrive.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue an interrupted hydrate from its journal, appending to the "
+    "existing output file.",
+)
 @command_line_expansions_shortcuts
 @command_line_expansions_options
-@command_line_input_output_file_arguments
+@command_line_passthrough_option
+@click.argument("infile", type=click.File("r"), default="-")
+@click.argument("outfile", type=click.File("a"), default="-")
 @command_line_progressbar_option
 @click.pass_obj
 @cli_api_error
-def hydrate(T, infile, outfile, hide_progress, **kwargs):
+def hydrate(
+    T,
+    infile,
+    outfile,
+    hide_progress,
+    concurrency,
+    ordered,
+    resume,
+    passthrough,
+    **kwargs,
+):
     """
     Hydrate tweet ids.
+
+    When reading from and writing to files, progress is recorded in a
+    journal next to the output file, so an interrupted hydrate can be
+    continued with --resume.
     """
 
     kwargs = _process_expansions_shortcuts(kwargs)
 
+    journal = None
+    if infile.name != "<stdin>" and outfile.name != "<stdout>":
+        if ordered:
+            journal = HydrateJournal(outfile.name + ".journal")
+        elif resume:
+            raise click.UsageError("--resume can't be used with --unordered")
+    elif resume:
+        raise click.UsageError("--resume needs an input file and an output file")
+
     with FileLineProgressBar(infile, outfile, disable=hide_progress) as progress:
-        for result in T.tweet_lookup(infile, **kwargs):
-            _write(result, outfile)
-            tweet_ids = [t["id"] for t in result.get("data", [])]
-            log.info("archived %s", ",".join(tweet_ids))
-            progress.update_with_result(result, error_resource_type="tweet")
+        if journal:
+            ids = journal.start(infile, outfile, resume)
+            progress.update(journal.lines)
+        else:
+            if outfile.name != "<stdout>":
+                outfile.truncate(0)
+            ids = infile
+
+        T.passthrough = passthrough
+        try:
+            for result in T.tweet_lookup(
+                ids, concurrency=concurrency, ordered=ordered, **kwargs
+            ):
+                _write(result, outfile)
+                _log_archived(result)
+                if isinstance(result, RawPage):
+                    # each id is either a tweet or an error
+                    progress.update(len(result.ids))
+                else:
+                    progress.update_with_result(result, error_resource_type="tweet")
+                if journal:
+                    journal.record(outfile)
+        finally:
+            if journal:
+                journal.close(outfile)
+
+    if journal:
+        journal.remove()
+
+
+class HydrateJournal:
+    """
+    Records how far hydrate has got, so that it can be resumed. After each
+    page of results is written a line is added with the byte offset reached
+    in the input file, the size of the output file and the number of input
+    lines read.
+
+    The journal is only synced to disk every so often, and always after the
+    output file, so it never claims more output than has been saved. When
+    resuming, the output is truncated to the size in the journal to drop any
+    results written after it was last synced.
+    """
+
+    def __init__(self, path, sync_pages=50, sync_seconds=5):
+        self.path = path
+        self.sync_pages = sync_pages
+        self.sync_seconds = sync_seconds
+        self.journal = None
+        self.lines = 0
+        self.batch_ends = collections.deque()
+
+    def start(self, infile, outfile, resume=False):
+        """
+        Position the input and output files, and return a generator of the
+        tweet ids that still need to be hydrated.
+        """
+        offset, size, self.lines = 0, 0, 0
+        if resume and os.path.isfile(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        offset, size, self.lines = map(int, line.split())
+                    except ValueError:
+                        # a partly written line, from before a crash
+                        break
+            log.info("resuming hydrate from %s line %s", infile.name, self.lines)
+        elif resume:
+            click.echo(
+                click.style(
+                    f"No journal found at {self.path}, starting from the beginning.",
+                    fg="yellow",
+                ),
+                err=True,
+            )
+
+        outfile.truncate(size)
+        self.journal = open(self.path, "a" if resume else "w")
+        self.pages = 0
+        self.last_sync = time.time()
+
+        return self._tweet_ids(infile.buffer, offset)
+
+    def _tweet_ids(self, infile, offset):
+        """
+        Yields tweet ids from the binary input file, noting where each batch
+        of 100 ends.
+        """
+        infile.seek(offset)
+        count = 0
+        for line in infile:
+            offset += len(line)
+            count += 1
+            # tweet_lookup hands over a batch as soon as it has 100 ids
+            if count % 100 == 0:
+                self.batch_ends.append((offset, 100))
+            yield line
+        self.batch_ends.append((offset, count % 100))
+
+    def record(self, outfile):
+        """
+        Record that the next batch has been written to the output.
+        """
+        offset, count = self.batch_ends.popleft()
+        self.lines += count
+        outfile.flush()
+        size = os.fstat(outfile.fileno()).st_size
+        self.journal.write(f"{offset} {size} {self.lines}\n")
+
+        self.pages += 1
+        if (
+            self.pages >= self.sync_pages
+            or time.time() - self.last_sync > self.sync_seconds
+        ):
+            self.sync(outfile)
+
+    def sync(self, outfile):
+        """
+        Save the output, and then the journal, to disk.
+        """
+        outfile.flush()
+        os.fsync(outfile.fileno())
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.pages = 0
+        self.last_sync = time.time()
+
+    def close(self, outfile):
+        """
+        Sync and close the journal, when finished or interrupted.
+        """
+        self.sync(outfile)
+        self.journal.close()
+
+    def remove(self):
+        """
+        Remove the journal once all of the input has been hydrated.
+        """
+        os.remove(self.path)
 
 
 @twarc2.command("dehydrate")
@@ -1168,7 +2032,7 @@ def dehydrate(infile, outfile, id_type, hide_progress):
                 continue
 
             try:
-                for tweet in ensure_flattened(json.loads(line)):
+                for tweet in iter_flattened(line, lazy=True):
                     if id_type == "tweets":
                         click.echo(tweet["id"], file=outfile)
                         unique_ids.add(tweet["id"])
@@ -1180,12 +2044,12 @@ def dehydrate(infile, outfile, id_type, hide_progress):
                     f"No {id_type} ID found in JSON data on line {count}", err=True
                 )
                 break
+            except codec.JSONDecodeError as e:
+                click.echo(f"Invalid JSON on line {count}", err=True)
+                break
             except ValueError as e:
                 click.echo(f"Unexpected JSON data on line {count}", err=True)
                 break
-            except json.decoder.JSONDecodeError as e:
-                click.echo(f"Invalid JSON on line {count}", err=True)
-                break
     click.echo(
         f"ℹ️  Parsed {len(unique_ids)} {id_type} IDs from {count} lines in {infile.name} file.",
         err=True,
@@ -1292,6 +2156,7 @@ def mentions(T, user_id, outfile, hide_progress, **kwargs):
 @command_line_timelines_options
 @command_line_expansions_shortcuts
 @command_line_expansions_options
+@command_line_passthrough_option
 @command_line_progressbar_option
 @click.option("--limit", default=0, help="Maximum number of tweets to return")
 @click.option(
@@ -1317,6 +2182,7 @@ def timeline(
     exclude_replies,
     hide_progress,
     sort_order,
+    passthrough,
     **kwargs,
 ):
     """
@@ -1363,6 +2229,7 @@ def timeline(
             "total": user["public_metrics"]["tweet_count"],
         }
 
+    T.passthrough = passthrough
     tweets = _timeline_tweets(
         T,
         use_search=use_search,
@@ -1381,11 +2248,11 @@ def timeline(
         for result in tweets:
             _write(result, outfile)
 
-            count += len(result["data"])
+            count += _result_count(result)
             if isinstance(progress, TimestampProgressBar):
                 progress.update_with_result(result)
             else:
-                progress.update(len(result["data"]))
+                progress.update(_result_count(result))
 
             if limit != 0 and count >= limit:
                 # Display message when stopped early
@@ -1455,24 +2322,22 @@ def timelines(
 
             users = None
             try:
-                # assume this the line contains some tweet json
-                data = json.loads(line)
-
-                # if it parsed as a string or int assume it's a username
-                if isinstance(data, str) or isinstance(data, int):
-                    users = set([line])
-
-                # otherwise try to flatten the data and get the user ids
-                else:
+                # flatten lines of tweet json and get the user ids
+                if line.startswith(("{", "[")):
                     try:
-                        users = set([t["author"]["id"] for t in ensure_flattened(data)])
+                        tweets = iter_flattened(line, lazy=True)
+                        users = set([t["author"]["id"] for t in tweets])
                     except (KeyError, ValueError):
                         log.warn(
                             "ignored line %s which didn't contain users", line_count
                         )
                         continue
 
-            except json.JSONDecodeError:
+                # if it parses as a string or int assume it's a username
+                elif isinstance(codec.loads(line), (str, int)):
+                    users = set([line])
+
+            except codec.JSONDecodeError:
                 # maybe it's a single user?
                 users = set([line])
 
@@ -1584,21 +2449,51 @@ def _timeline_tweets(
     "--combine-queries",
     is_flag=True,
     default=False,
-    help="""Merge consecutive queries into a single OR query.
+    help="""Merge queries into combined OR queries, using as few as possible.
     For example, if the three rows in your file are: banana, apple, pear
     then a single query ((banana) OR (apple) OR (pear)) will be issued.
+    Each tweet is tagged with the queries it matched.
     """,
 )
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Run this many searches at the same time, sharing the rate limits.",
+)
+@click.option(
+    "--query-files",
+    is_flag=True,
+    default=False,
+    help="Write the results of each search to its own numbered file instead "
+    "of the output file.",
+)
+@click.option(
+    "--pack-by-counts",
+    is_flag=True,
+    default=False,
+    help="With --combine-queries, count the tweets matching each query first, "
+    "and combine them so that the fewest requests are needed.",
+)
 @click.option(
     "--granularity",
     default="day",
     type=click.Choice(["day", "hour", "minute"], case_sensitive=False),
     help="Aggregation level for counts (only used when --count-only is used). Can be one of: day, hour, minute. Default is day.",
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue interrupted searches, skipping the queries that were "
+    "completed and appending to the existing output file.",
+)
 @command_line_expansions_shortcuts
 @command_line_expansions_options
 @command_line_progressbar_option
-@command_line_input_output_file_arguments
+@click.argument("infile", type=click.File("r"), default="-")
+@click.argument("outfile", type=click.File("a"), default="-")
 @click.pass_obj
 def searches(
     T,
@@ -1614,8 +2509,12 @@ def searches(
     counts_only,
     granularity,
     combine_queries,
+    concurrency,
+    query_files,
+    pack_by_counts,
     hide_progress,
     sort_order,
+    resume,
     **kwargs,
 ):
     """
@@ -1628,10 +2527,18 @@ def searches(
     Input queries will be deduplicated - if the same literal query is present
     in the file, it will still only be run once.
 
+    With --combine-queries the queries are packed into as few combined
+    queries as possible, and each tweet written gets a matching_queries list
+    of the queries in the input file that it matched.
+
     It is recommended that this command first be run with --counts-only, to
     check that each of the queries is retrieving the volume of tweets
     expected, and to avoid consuming quota unnecessarily.
 
+    Unless --counts-only is used, the progress of each search is saved next
+    to the outfile, so that interrupted searches can be continued with
+    --resume.
+
     """
     line_count = 0
     seen = set()
@@ -1658,6 +2565,11 @@ def searches(
         # Academic track let's you use longer queries
         max_query_length = 1024
 
+    if pack_by_counts and (counts_only or not combine_queries):
+        raise click.UsageError(
+            "--pack-by-counts can only be used with --combine-queries"
+        )
+
     if counts_only:
         api_method = T.counts_all if archive else T.counts_recent
         kwargs.pop("expansions", None)
@@ -1678,6 +2590,14 @@ def searches(
             },
         }
 
+        if resume:
+            raise click.UsageError("--resume can't be used with --counts-only")
+        if query_files:
+            raise click.UsageError("--query-files can't be used with --counts-only")
+        if outfile.name != "<stdout>":
+            outfile.truncate(0)
+        save_state = False
+
         # Write the header for the CSV output
         click.echo(f"query,start,end,{granularity}_count", file=outfile)
 
@@ -1694,16 +2614,163 @@ def searches(
                 "sort_order": sort_order,
             },
         }
+        save_state = outfile.name != "<stdout>" or query_files
+        if save_state and not query_files:
+            SearchState.prepare(outfile, resume)
+
+    if query_files and outfile.name == "<stdout>":
+        raise click.UsageError("--query-files needs an output file")
+    if query_files and resume and pack_by_counts:
+        raise click.UsageError(
+            "--resume can't be used with --query-files and --pack-by-counts"
+        )
 
-    # TODO: Validate the queries are all valid length before beginning and report errors
+    # The output file and search state of each search that is running.
+    running = {}
+    retrieved = collections.Counter()
+    query_outfiles = []
+
+    def start(index, issue_query, group=None):
+        """
+        Start a search, and return a generator of (index, result) for it, or
+        None if it was already completed.
+        """
+        log.info(f'Beginning search for "{issue_query}"')
+
+        out = outfile
+        if query_files:
+            out = open(_numbered_filepath(outfile.name, index + 1), "a")
+            SearchState.prepare(out, resume)
+            query_outfiles.append(out)
+
+        if counts_only:
+            running[index] = (issue_query, out, None)
+            return _search_pages(index, api_method(issue_query, **kwargs))
+
+        state = None
+        response = None
+        if save_state:
+            state = SearchState(
+                out, issue_query, archive=archive, queries=group, **kwargs
+            )
+            if resume and state.load():
+                if state.done:
+                    log.info("search for %s already completed", issue_query)
+                    if query_files:
+                        out.close()
+                    return None
+                retrieved[index] = state.count
+                response = _resume_search(api_method, issue_query, state, **kwargs)
+        if response is None:
+            response = api_method(issue_query, **kwargs)
 
-    # TODO: Needs an inputlines progress bar instead, as the queries are variable
-    # size.
-    with FileLineProgressBar(infile, outfile, disable=hide_progress) as progress:
-        merged_query = ""
-        extended_query = None
-        query = None
+        # Tag the tweets when the results of several queries are mixed up.
+        tags = group
+        if concurrency > 1 and not query_files:
+            tags = group or [issue_query]
+
+        running[index] = (issue_query, out, state)
+        if group and limit:
+            return combined_pages(index, group, response)
+        return _search_pages(index, response, limit, retrieved[index], tags=tags)
+
+    def combined_pages(index, group, response):
+        """
+        Yields the pages of a combined search, which stops once it has limit
+        tweets for each of its queries. The queries that are still short of
+        the limit are then searched on their own, for the tweets older than
+        the combined search got to. Their pages aren't saved in the search
+        state, so they are searched again if the search is resumed.
+
+        This runs in a background thread when searches run side by side, so
+        each of the searches on their own is announced by yielding its query,
+        for write to add it to running.
+        """
+        matched = collections.Counter()
+        total = retrieved[index]
+        oldest_id = None
+        pages = _search_pages(
+            index,
+            response,
+            limit,
+            retrieved[index],
+            tags=group,
+            combined=group,
+            matched=matched,
+        )
+        for _, result in pages:
+            if result is None:
+                break
+            total += len(result.get("data", []))
+            if result.get("meta", {}).get("oldest_id"):
+                oldest = int(result["meta"]["oldest_id"])
+                oldest_id = oldest if oldest_id is None else min(oldest_id, oldest)
+            yield index, result
+
+        # Less than the most the queries could need means there are no more.
+        if total >= limit * len(group):
+            params = dict(kwargs)
+            if oldest_id is not None:
+                params["until_id"] = oldest_id
+            for query in group:
+                if matched[query] >= limit:
+                    continue
+                log.info("searching for %s on its own", query)
+                key = (index, query)
+                yield key, query
+                for _, result in _search_pages(
+                    key,
+                    api_method(query, **params),
+                    limit - matched[query],
+                    tags=group,
+                ):
+                    if result is not None:
+                        yield key, result
+
+        yield index, None
+
+    def write(index, result):
+        if isinstance(result, str):
+            # A query of a combined search is being searched on its own.
+            running[index] = (result, running[index[0]][1], None)
+            return
+
+        issue_query, out, state = running[index]
+
+        if result is None:
+            # The search has finished
+            if state:
+                state.finish()
+            if query_files:
+                out.close()
+            log.info(
+                "finished search for %s with %s tweets", issue_query, retrieved[index]
+            )
+            del running[index]
+            # and the searches for the queries of a combined search on their own
+            for key in [k for k in running if isinstance(k, tuple) and k[0] == index]:
+                del running[key]
+
+        elif counts_only:
+            for r in result["data"]:
+                click.echo(
+                    f'{issue_query},{r["start"]},{r["end"]},{r["tweet_count"]}',
+                    file=out,
+                )
+
+        else:
+            _write(result, out)
+            retrieved[index] += len(result["data"])
+            if state:
+                state.save(result, out)
+
+        if concurrency > 1:
+            progress.set_postfix_str(
+                f"{len(running)} searches running, {sum(retrieved.values())} tweets"
+            )
 
+    def read_queries():
+        nonlocal line_count
         for query in infile:
             query = query.strip()
 
@@ -1723,72 +2790,142 @@ def searches(
                 continue
 
             seen.add(query)
-            retrieved = 0
-
-            if combine_queries and merged_query:
-                extended_query = f"{merged_query} OR ({query})"
-                # We've exceeded the limit, so now we can issue
-                # the merged query.
-                if len(extended_query) >= max_query_length:
-                    issue_query = merged_query
-                    merged_query = f"({query})"
-                else:
-                    # We haven't exceed the length yet, so accept the addon
-                    merged_query = extended_query
-                    continue
+            yield query
 
-            elif combine_queries:
-                merged_query = f"({query})"
-                continue
+    def issue_queries():
+        if not combine_queries:
+            # This is the normal case - we are not doing any combination.
+            for query in read_queries():
+                yield query, None
+            return
 
-            else:
-                # This is the normal case - we are not doing any combination.
-                issue_query = query
+        queries = list(read_queries())
+
+        # Keep the groups of searches that are being resumed.
+        groups = []
+        if resume and save_state and not query_files:
+            for saved in SearchState.saved(outfile):
+                group = saved["params"].get("queries") or []
+                if group and all(q in seen for q in group):
+                    groups.append(group)
+                    queries = [q for q in queries if q not in group]
+
+        volumes = None
+        if pack_by_counts:
+            volumes = _query_volumes(
+                T,
+                queries,
+                archive,
+                limit,
+                since_id=since_id,
+                until_id=until_id,
+                start_time=start_time,
+                end_time=end_time,
+            )
+        groups += pack_queries(
+            queries, max_query_length, volumes, page_size=max_results or 100
+        )
+        log.info(f"combined {len(seen)} queries into {len(groups)} searches")
 
-            log.info(f'Beginning search for "{issue_query}"')
+        for group in groups:
+            yield join_queries(group), group
 
-            response = api_method(issue_query, **kwargs)
+    # TODO: Validate the queries are all valid length before beginning and report errors
 
-            for result in response:
-                if counts_only:
-                    for r in result["data"]:
-                        click.echo(
-                            f'{issue_query},{r["start"]},{r["end"]},{r["tweet_count"]}',
-                            file=outfile,
-                        )
+    # TODO: Needs an inputlines progress bar instead, as the queries are variable
+    # size.
+    with FileLineProgressBar(infile, outfile, disable=hide_progress) as progress:
+        searches = (
+            start(index, issue_query, group)
+            for index, (issue_query, group) in enumerate(issue_queries())
+        )
+        searches = (pages for pages in searches if pages is not None)
 
-                else:
-                    # Apply the limit if not counting
-                    _write(result, outfile)
+        if concurrency == 1:
+            for pages in searches:
+                for index, result in pages:
+                    write(index, result)
+        else:
+            # Searches run side by side, sharing the client's rate limits.
+            results = Interleave(searches, concurrency=concurrency)
+            try:
+                for _, (index, result) in results:
+                    write(index, result)
+            finally:
+                results.close()
+                for issue_query, out, state in running.values():
+                    if query_files:
+                        out.close()
 
-                    retrieved += len(result["data"])
+    if not counts_only and save_state:
+        for out in query_outfiles or [outfile]:
+            SearchState.remove_all(out)
 
-                    if limit and (retrieved >= limit):
-                        break
 
-        # Make sure to process the final batch of queries if using the combined strategy
-        if combine_queries and (
-            merged_query == extended_query or merged_query == f"({query})"
-        ):
-            log.info(f'Beginning search for "{merged_query}"')
-            response = api_method(merged_query, **kwargs)
+def _search_pages(
+    index, response, limit=0, retrieved=0, tags=None, combined=None, matched=None
+):
+    """
+    Yields (index, result) for each page of results of one of the searches
+    run by searches, and (index, None) when it has finished.
 
-            for result in response:
-                if counts_only:
-                    for r in result["data"]:
-                        click.echo(
-                            f'{merged_query},{r["start"]},{r["end"]},{r["tweet_count"]}',
-                            file=outfile,
-                        )
+    The tweets are tagged with the queries in tags that they match, and
+    counted in matched. The search stops once the limit is reached, or for a
+    combined search, once each of the combined queries has reached it or
+    there are as many tweets as all of them could need.
+    """
+    matchers = [Query(q) for q in tags] if tags else []
+    if matched is None:
+        matched = collections.Counter()
+
+    for result in response:
+        if matchers:
+            tag_matching_queries(result, matchers)
+            for tweet in result.get("data", []):
+                matched.update(tweet["matching_queries"])
+
+        yield index, result
+
+        # Apply the limit if not counting
+        retrieved += len(result.get("data", []))
+        if limit and (retrieved >= limit):
+            # Combined queries carry on until each query has its limit, but
+            # not through everything the others match for the sake of a rare
+            # query, which searches runs on its own instead.
+            if not combined or retrieved >= limit * len(combined):
+                break
+            if all(matched[q] >= limit for q in combined):
+                break
 
-                else:
-                    # Apply the limit if not counting
-                    _write(result, outfile)
+    # Tell the consumer the search has finished.
+    yield index, None
 
-                    retrieved += len(result["data"])
 
-                    if limit and (retrieved >= limit):
-                        break
+def _query_volumes(T, queries, archive, limit, **kwargs):
+    """
+    Count the tweets matching each query, so they can be packed into combined
+    queries. Returns None if the counts can't be retrieved.
+    """
+    count_method = T.counts_all if archive else T.counts_recent
+    volumes = {}
+    for query in queries:
+        try:
+            volume = sum(
+                result["meta"]["total_tweet_count"]
+                for result in count_method(query, granularity="day", **kwargs)
+            )
+        except requests.exceptions.HTTPError as e:
+            click.echo(
+                click.style(
+                    f"Unable to count tweets ({e}), combining queries by length only.",
+                    fg="yellow",
+                ),
+                err=True,
+            )
+            return None
+        log.info("counted %s tweets for %s", volume, query)
+        volumes[query] = min(volume, limit) if limit else volume
+    return volumes
 
 
 @twarc2.command("conversation")
@@ -1886,7 +3023,7 @@ def conversations(
             elif line:
 
                 def f():
-                    for tweet in ensure_flattened(json.loads(line)):
+                    for tweet in iter_flattened(line, lazy=True):
                         yield tweet.get("conversation_id")
 
                 conv_ids = f()
@@ -1918,10 +3055,17 @@ def conversations(
 
 
 @twarc2.command("flatten")
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes to flatten with. The input must be a file.",
+)
 @command_line_progressbar_option
 @command_line_input_output_file_arguments
 @cli_api_error
-def flatten(infile, outfile, hide_progress):
+def flatten(infile, outfile, processes, hide_progress):
     """
     "Flatten" tweets, or move expansions inline with tweet objects and ensure
     that each line of output is a single tweet.
@@ -1936,13 +3080,227 @@ def flatten(infile, outfile, hide_progress):
         )
         return
 
+    if processes > 1:
+        if infile.name == "<stdin>":
+            raise click.UsageError("--processes needs an input file")
+        # Flatten chunks of the file in parallel, writing them out in order.
+        ranges = line_ranges(infile.name, FLATTEN_CHUNK_SIZE)
+        chunks = (
+            (infile.name, start, end, codec.backend, codec.compact)
+            for start, end in ranges
+        )
+        with FileSizeProgressBar(infile, outfile, disable=hide_progress) as progress:
+            for lines, size in map_batches(
+                _flatten_chunk, chunks, processes, processes=True
+            ):
+                outfile.write(lines)
+                progress.update(size)
+        return
+
     with FileSizeProgressBar(infile, outfile, disable=hide_progress) as progress:
         for line in infile:
-            for tweet in ensure_flattened(json.loads(line)):
+            for tweet in iter_flattened(line):
                 _write(tweet, outfile, False)
             progress.update(len(line))
 
 
+# The number of bytes of input flattened at a time by each process.
+FLATTEN_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _flatten_chunk(chunk):
+    """
+    Flatten the lines in a range of bytes of a file.
+
+    Args:
+        chunk (tuple): The path of the file, the start and end of the
+            range, and the JSON backend and output to use, since the process
+            may not have inherited them.
+
+    Returns:
+        tuple: The flattened tweets as lines of JSON, and the size of the
+            range.
+    """
+    path, start, end, backend, compact = chunk
+    codec.configure(backend, compact)
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    lines = []
+    for line in data.splitlines():
+        if line.strip():
+            for tweet in iter_flattened(line):
+                lines.append(codec.dumps(tweet) + "\n")
+    return "".join(lines), end - start
+
+
+@twarc2.command("export")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["parquet", "csv"]),
+    default="parquet",
+    show_default=True,
+    help="The format to export to.",
+)
+@click.option(
+    "--row-group-size",
+    type=click.IntRange(min=1),
+    default=10000,
+    show_default=True,
+    help="Number of tweets in each Parquet row group. A row group is held in "
+    "memory until it is written.",
+)
+@click.option(
+    "--compression",
+    type=click.Choice(["zstd", "snappy", "gzip", "none"]),
+    default="zstd",
+    show_default=True,
+    help="How to compress the Parquet columns.",
+)
+@click.option(
+    "--columns",
+    help="Comma separated list of the CSV columns, like id,author.username,text. "
+    "Defaults to the columns of twarc-csv.",
+)
+@click.option(
+    "--date-format",
+    help='A strftime format to write the CSV timestamps in, like "%Y-%m-%d %H:%M:%S". '
+    "Defaults to the format Twitter sends them in.",
+)
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes to export CSV with. The input must be a file.",
+)
+@command_line_progressbar_option
+@click.argument("infile", type=click.File("r"), default="-")
+@click.argument("outfile", type=click.File("wb", lazy=True), default="-")
+@cli_api_error
+def export(
+    infile,
+    outfile,
+    output_format,
+    row_group_size,
+    compression,
+    columns,
+    date_format,
+    processes,
+    hide_progress,
+):
+    """
+    Flatten tweets and export them to a table. Parquet files have a column
+    for each of the tweet fields, with the author, entities and other nested
+    objects as struct and list columns. CSV files have the columns given
+    with --columns.
+    """
+    if output_format == "csv":
+        if columns is not None:
+            columns = [column.strip() for column in columns.split(",")]
+            if not all(columns):
+                raise click.UsageError("--columns has an empty column name")
+        _export_csv(infile, outfile, columns, date_format, processes, hide_progress)
+        return
+
+    if processes > 1:
+        raise click.UsageError("--processes only works with --format csv")
+
+    # the output file is lazy, so standard output is still called -
+    if outfile.name == "-":
+        raise click.UsageError("--format parquet needs an output file")
+
+    try:
+        writer = ParquetWriter(outfile.name, row_group_size, compression)
+    except RuntimeError as e:
+        raise click.UsageError(str(e))
+
+    try:
+        with FileSizeProgressBar(infile, outfile, disable=hide_progress) as progress:
+            for line in infile:
+                if line.strip():
+                    for tweet in iter_flattened(line):
+                        writer.write(tweet)
+                progress.update(len(line))
+    finally:
+        writer.close()
+
+
+def _export_csv(infile, outfile, columns, date_format, processes, hide_progress):
+    if processes > 1 and infile.name == "<stdin>":
+        raise click.UsageError("--processes needs an input file")
+
+    # csv needs a text file that doesn't translate its line endings
+    output = io.TextIOWrapper(outfile.open(), encoding="utf-8", newline="")
+    writer = CSVWriter(output, columns, date_format)
+    # the output file is lazy, so standard output is still called -
+    hide_progress = hide_progress or outfile.name == "-"
+    # When only some columns are wanted it is quicker to flatten tweets into
+    # views, which only expand the fields that are looked up.
+    lazy = columns is not None
+    try:
+        with FileSizeProgressBar(infile, outfile, disable=hide_progress) as progress:
+            if processes > 1:
+                # Export chunks of the file in parallel, writing them out in
+                # order after the header.
+                writer.close()
+                ranges = line_ranges(infile.name, FLATTEN_CHUNK_SIZE)
+                chunks = (
+                    (
+                        (infile.name, start, end),
+                        (codec.backend, codec.compact),
+                        (columns, date_format, lazy),
+                    )
+                    for start, end in ranges
+                )
+                for rows, size in map_batches(
+                    _export_csv_chunk, chunks, processes, processes=True
+                ):
+                    output.write(rows)
+                    progress.update(size)
+            else:
+                for line in infile:
+                    if line.strip():
+                        for tweet in iter_flattened(line, lazy):
+                            writer.write(tweet)
+                    progress.update(len(line))
+    finally:
+        writer.close()
+        output.flush()
+        # leave the file, which may be standard output, for click to close
+        output.detach()
+
+
+def _export_csv_chunk(chunk):
+    """
+    Export the tweets in a range of bytes of a file as CSV rows.
+
+    Args:
+        chunk (tuple): The path of the file and the start and end of the
+            range, the JSON backend and output, and the columns, date format
+            and whether to flatten into views.
+
+    Returns:
+        tuple: The CSV rows, without a header, and the size of the range.
+    """
+    (path, start, end), (backend, compact), (columns, date_format, lazy) = chunk
+    codec.configure(backend, compact)
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    output = io.StringIO(newline="")
+    writer = CSVWriter(output, columns, date_format, header=False)
+    for line in data.splitlines():
+        if line.strip():
+            for tweet in iter_flattened(line, lazy):
+                writer.write(tweet)
+    writer.close()
+    return output.getvalue(), end - start
+
+
 @twarc2.command("places")
 @click.option(
     "--type",
@@ -2004,7 +3362,15 @@ def places(T, value, outfile, search_type, granularity, max_results, json):
 @click.option("--limit", default=0, help="Maximum number of tweets to return")
 @command_line_expansions_shortcuts
 @command_line_expansions_options
-@click.argument("outfile", type=click.File("a+"), default="-")
+@command_line_stream_options
+@click.option(
+    "--partition-by-rule",
+    is_flag=True,
+    default=False,
+    help="Write tweets to a file for each rule they matched, named after the "
+    "rule's tag, e.g. stream-cats.jsonl for the tag cats.",
+)
+@click.argument("outfile", type=click.File("a+", lazy=True), default="-")
 @click.pass_obj
 @cli_api_error
 def stream(T, outfile, limit, **kwargs):
@@ -2013,23 +3379,13 @@ def stream(T, outfile, limit, **kwargs):
     """
 
     kwargs = _process_expansions_shortcuts(kwargs)
-    event = threading.Event()
-    count = 0
     click.echo(click.style(f"Started a stream with rules:", fg="green"), err=True)
     _print_stream_rules(T)
     click.echo(
         click.style(f"Writing to {outfile.name}\nCTRL+C to stop...", fg="green"),
         err=True,
     )
-    for result in T.stream(event=event, **kwargs):
-        count += 1
-        if limit != 0 and count == limit:
-            log.info(f"reached limit {limit}")
-            event.set()
-        _write(result, outfile)
-
-        if result and "data" in result:
-            log.info("archived %s", result["data"]["id"])
+    _stream_to_file(T.stream, outfile, limit, **kwargs)
 
 
 @twarc2.group()
@@ -2540,7 +3896,7 @@ def compliance_job_list(T, job_type, status, verbose, json_output):
         results = tweets_jobs + users_jobs
 
     if json_output:
-        click.echo(json.dumps(results))
+        click.echo(codec.dumps(results))
         return
 
     if len(results) == 0:
@@ -2569,7 +3925,7 @@ def compliance_job_get(T, job, verbose, json_output):
     """
     if json_output:
         result = T.compliance_job_get(job)
-        click.echo(json.dumps(result))
+        click.echo(codec.dumps(result))
         return
 
     job = _get_job(T, job)
@@ -2977,8 +4333,35 @@ def _error_str(errors):
 
 
 def _write(results, outfile, pretty=False):
+    if isinstance(results, RawPage):
+        click.echo(results.text, file=outfile)
+        return
     indent = 2 if pretty else None
-    click.echo(json.dumps(results, indent=indent), file=outfile)
+    click.echo(codec.dumps(results, indent=indent), file=outfile)
+
+
+def _result_count(result):
+    """
+    The number of tweets or users in a page of results, which may be raw.
+    """
+    if isinstance(result, RawPage):
+        return result.result_count
+    return len(result.get("data", []))
+
+
+def _log_archived(result):
+    """
+    Log the ids of the tweets in a page of results, or the range of them if
+    the page is raw.
+    """
+    if isinstance(result, RawPage) and result.ids is not None:
+        log.info("looked up %s", ",".join(result.ids))
+    elif isinstance(result, RawPage):
+        meta = result.get("meta", {})
+        log.info("archived %s to %s", meta.get("oldest_id"), meta.get("newest_id"))
+    else:
+        tweet_ids = [t["id"] for t in result.get("data", [])]
+        log.info("archived %s", ",".join(tweet_ids))
 
 
 def _write_with_progress(
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers for running API requests in the background, and for processing
+large files in parallel.
+"""
+
+import os
+import time
+import queue
+import logging
+import itertools
+import threading
+import collections
+
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+
+log = logging.getLogger("twarc")
+
+# Marks the end of the items produced by a background thread.
+_DONE = object()
+
+# Holds the stop event of the Prefetch or Interleave that a background thread
+# is producing items for.
+_local = threading.local()
+
+
+class Stopped(Exception):
+    """
+    Raised by sleep in a background thread whose consumer has stopped.
+    """
+
+
+def sleep(seconds):
+    """
+    Sleep before sending a request, like time.sleep. In the background thread
+    of a Prefetch or Interleave this wakes up as soon as it is closed, and
+    raises Stopped, so that a request isn't sent after a rate limit wait when
+    nothing is going to use its result.
+
+    Args:
+        seconds (float): How long to sleep for.
+    """
+    stopped = getattr(_local, "stopped", None)
+    if stopped is None:
+        if seconds > 0:
+            time.sleep(seconds)
+    elif stopped.wait(max(seconds, 0)):
+        raise Stopped()
+
+
+class Prefetch:
+    """
+    Iterate over an iterable in a background thread, keeping up to depth
+    items buffered ahead of the consumer. This lets the next page of results
+    be fetched while the current one is being processed.
+
+    Any exception raised by the iterable is raised again in the consumer.
+    Closing the prefetch, or letting it be garbage collected, stops the
+    background thread and closes the iterable, so at most depth + 1 items
+    are fetched without being used. A rate limit wait in the background
+    thread (see sleep) ends when it is closed, without sending the request.
+    """
+
+    def __init__(self, iterable, depth=1):
+        if depth < 1:
+            raise ValueError("prefetch depth must be at least 1")
+        self.buffer = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.done = False
+        self.thread = threading.Thread(
+            target=_produce,
+            args=(iter(iterable), self.buffer, self.stopped),
+            daemon=True,
+        )
+        self.thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        item, error = self.buffer.get()
+        if item is _DONE:
+            self.done = True
+            if error is not None:
+                raise error
+            raise StopIteration
+        return item
+
+    def close(self):
+        """
+        Stop the background thread, and discard anything it has buffered.
+        """
+        self.done = True
+        self.stopped.set()
+        try:
+            while True:
+                self.buffer.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __del__(self):
+        self.close()
+
+
+class Interleave:
+    """
+    Iterate over several iterables at once, each in its own background
+    thread, yielding (index, item) tuples in the order the items arrive.
+
+    If concurrency is given, at most that many of the iterables are running
+    at the same time, and the next one is only taken from iterables when one
+    of them finishes, so iterables can be a generator.
+
+    Any exception raised by one of the iterables is raised again in the
+    consumer, after stopping the others. Closing the interleave, or letting
+    it be garbage collected, stops all of the background threads.
+    """
+
+    def __init__(self, iterables, depth=1, concurrency=None):
+        if concurrency is None:
+            iterables = list(iterables)
+            concurrency = len(iterables)
+        self.iterables = enumerate(iterables)
+        self.buffer = queue.Queue(maxsize=max(depth, concurrency))
+        self.stopped = threading.Event()
+        self.running = 0
+        self.threads = []
+        for _ in range(concurrency):
+            self._start_next()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.running > 0:
+            item, error = self.buffer.get()
+            if item is not _DONE:
+                return item
+            self.running -= 1
+            if error is not None:
+                self.close()
+                raise error
+            self._start_next()
+        raise StopIteration
+
+    def _start_next(self):
+        """
+        Start a thread for the next iterable, if there are any left.
+        """
+        if self.stopped.is_set():
+            return
+        for i, iterable in self.iterables:
+            thread = threading.Thread(
+                target=_produce,
+                args=(_tagged(i, iterable), self.buffer, self.stopped),
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+            self.running += 1
+            break
+
+    def close(self):
+        """
+        Stop the background threads, and discard anything they have buffered.
+        """
+        self.running = 0
+        self.stopped.set()
+        try:
+            while True:
+                self.buffer.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __del__(self):
+        self.close()
+
+
+def _tagged(index, iterable):
+    """
+    Yields (index, item) for each item in the iterable.
+    """
+    iterator = iter(iterable)
+    try:
+        for item in iterator:
+            yield index, item
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()
+
+
+def _produce(iterator, buffer, stopped):
+    """
+    Moves items from the iterator to the buffer until it is exhausted, or
+    the consumer has stopped.
+    """
+    _local.stopped = stopped
+    error = None
+    try:
+        for item in iterator:
+            if not _put(buffer, (item, None), stopped) or stopped.is_set():
+                break
+    except Exception as e:
+        error = e
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()
+        _put(buffer, (_DONE, error), stopped)
+
+
+def _put(buffer, item, stopped):
+    """
+    Put an item in the buffer, waiting for space unless the consumer stops.
+    Returns False if the consumer has stopped.
+    """
+    while not stopped.is_set():
+        try:
+            buffer.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def map_batches(func, batches, concurrency, ordered=True, processes=False):
+    """
+    Call func on each batch using a pool of worker threads, and yield the
+    results. Only a few batches per worker are read ahead from the batches
+    iterable, so it can be a generator over a very large input.
+
+    Args:
+        func (callable): Called with each batch.
+        batches (iterable): The batches to process.
+        concurrency (int): The number of workers.
+        ordered (bool): Yield results in the order of the batches, rather
+            than in the order they complete.
+        processes (bool): Use worker processes instead of threads, for work
+            that needs more than one CPU. func, the batches and the results
+            must then be picklable.
+
+    Returns:
+        generator: A generator of the results of calling func.
+    """
+    batches = iter(batches)
+    pending = collections.deque()
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=concurrency)
+    else:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def submit():
+        for batch in itertools.islice(batches, 2 * concurrency - len(pending)):
+            pending.append(executor.submit(func, batch))
+
+    try:
+        submit()
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = next(f for f in pending if f in done)
+                pending.remove(future)
+            result = future.result()
+            submit()
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def line_ranges(path, chunk_size):
+    """
+    Split a file into ranges of about chunk_size bytes which start and end
+    at the start of a line, so that they can be processed separately.
+
+    Args:
+        path (str): The file to split.
+        chunk_size (int): The size of each range.
+
+    Returns:
+        generator[tuple]: A (start, end) tuple of byte offsets for each range.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            if f.tell() < size:
+                f.readline()
+            end = f.tell()
+            yield start, end
+            start = end
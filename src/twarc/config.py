@@ -2,7 +2,8 @@ import logging
 import configobj
 
 # Adapted from click_config_file.configobj_provider so that we can store the
-# file path that the config was loaded from in order to log it later.
+# file path that the config was loaded from in order to log it later, and the
+# config itself so that sections like the credential pool can be read.
 
 log = logging
 
@@ -10,7 +11,9 @@ log = logging
 class ConfigProvider:
     def __init__(self):
         self.file_path = None
+        self.config = None
 
     def __call__(self, file_path, cmd_name):
         self.file_path = file_path
-        return configobj.ConfigObj(file_path, unrepr=True)
+        self.config = configobj.ConfigObj(file_path, unrepr=True)
+        return self.config
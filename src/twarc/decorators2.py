@@ -1,5 +1,6 @@
 import os
 import time
+import asyncio
 import click
 import logging
 import requests
@@ -9,6 +10,8 @@ import humanize
 from tqdm.auto import tqdm
 from functools import wraps
 
+from twarc import concurrency
+
 
 log = logging.getLogger("twarc")
 
@@ -29,62 +32,7 @@ def rate_limit(f, tries=30):
                 errors = 0
                 return resp
             elif resp.status_code == 429:
-                # Check the headers, and try to infer why we're hitting the
-                # rate limit. Because the search/all endpoints also have a
-                # 1r/s rate limit that isn't obvious in the headers, we need
-                # to infer the reason for the rate limit. Note that this is
-                # included to help debug problems with multiple concurrent
-                # clients - this shouldn't be hit in normal of operation of a
-                # single twarc client.
-                remaining = int(resp.headers["x-rate-limit-remaining"])
-
-                # If we have a 429 rate limit, but there are remaining calls for
-                # this endpoint, we've probably hit the 1r/s limit.
-                if remaining:
-                    log.warning(
-                        "Hit the 1 request/second rate limit, sleeping for 10 seconds. "
-                        "This shouldn't happen with normal usage of twarc, and may indicate "
-                        "multiple clients interacting with the Twitter API at the "
-                        "same time."
-                    )
-                    time.sleep(10)
-                    continue
-
-                # Just a regular 15 minute window rate limit.
-                else:
-                    reset = int(resp.headers["x-rate-limit-reset"])
-                    now = time.time()
-
-                    # The time to sleep depends on having an accurate system time,
-                    # so check to see if there's something really bad happening
-                    # to warn the user.
-                    target_sleep_seconds = reset - now
-
-                    # Never sleep longer than 15 minutes, as that is the basis for
-                    # all of the read time based rate limits in the Twitter API
-                    seconds = min(901, max(10, (target_sleep_seconds + 10)))
-
-                    if target_sleep_seconds >= 900:
-                        # If we need to sleep for more than a rate limit period, the
-                        # system clock could be wrong.
-                        log.warning(
-                            "Detected overlong sleep interval - is your system clock accurate? "
-                            "An accurate system time is needed to calculate how long to sleep for, "
-                            "and data collection might be slowed. "
-                            f"The rate limit resets at {reset} and the current time is {now}."
-                        )
-                    elif target_sleep_seconds < 0:
-                        # If we need to sleep for negative time something weird might be up.
-                        log.warning(
-                            "Detected negative sleep interval - is your system clock accurate? "
-                            "If your system time is running fast, rate limiting may not be "
-                            "effective. "
-                            f"The rate limit resets at {reset} and the current time is {now}."
-                        )
-
-                    log.warning("rate limit exceeded: sleeping %s secs", seconds)
-                    time.sleep(seconds)
-
+                concurrency.sleep(_rate_limit_seconds(resp))
             elif resp.status_code >= 500:
                 errors += 1
                 if errors > tries:
@@ -102,6 +50,100 @@ def rate_limit(f, tries=30):
     return new_f
 
 
+def async_rate_limit(f, tries=30):
+    """
+    The asyncio equivalent of rate_limit, for decorating the coroutines of
+    AsyncTwarc2. Rate limits and server errors are handled the same way, but
+    the sleeps are awaited so that other tasks on the event loop can proceed.
+    """
+
+    @wraps(f)
+    async def new_f(*args, **kwargs):
+        errors = 0
+        while True:
+            resp = await f(*args, **kwargs)
+            if resp.status_code in [200, 201]:
+                errors = 0
+                return resp
+            elif resp.status_code == 429:
+                await asyncio.sleep(_rate_limit_seconds(resp))
+            elif resp.status_code >= 500:
+                errors += 1
+                if errors > tries:
+                    log.warning(f"too many errors ({tries}) from Twitter, giving up")
+                    resp.raise_for_status()
+                seconds = errors**2
+                log.warning(
+                    "caught %s from Twitter API, sleeping %s", resp.status_code, seconds
+                )
+                await asyncio.sleep(seconds)
+            else:
+                log.error("Unexpected HTTP response: %s", resp)
+                resp.raise_for_status()
+
+    return new_f
+
+
+def _rate_limit_seconds(resp):
+    """
+    Work out how long to sleep for after a 429 response, using the rate limit
+    headers in the response.
+    """
+    # Check the headers, and try to infer why we're hitting the
+    # rate limit. Because the search/all endpoints also have a
+    # 1r/s rate limit that isn't obvious in the headers, we need
+    # to infer the reason for the rate limit. Note that this is
+    # included to help debug problems with multiple concurrent
+    # clients - this shouldn't be hit in normal of operation of a
+    # single twarc client.
+    remaining = int(resp.headers["x-rate-limit-remaining"])
+
+    # If we have a 429 rate limit, but there are remaining calls for
+    # this endpoint, we've probably hit the 1r/s limit.
+    if remaining:
+        log.warning(
+            "Hit the 1 request/second rate limit, sleeping for 10 seconds. "
+            "This shouldn't happen with normal usage of twarc, and may indicate "
+            "multiple clients interacting with the Twitter API at the "
+            "same time."
+        )
+        return 10
+
+    # Just a regular 15 minute window rate limit.
+    reset = int(resp.headers["x-rate-limit-reset"])
+    now = time.time()
+
+    # The time to sleep depends on having an accurate system time,
+    # so check to see if there's something really bad happening
+    # to warn the user.
+    target_sleep_seconds = reset - now
+
+    # Never sleep longer than 15 minutes, as that is the basis for
+    # all of the read time based rate limits in the Twitter API
+    seconds = min(901, max(10, (target_sleep_seconds + 10)))
+
+    if target_sleep_seconds >= 900:
+        # If we need to sleep for more than a rate limit period, the
+        # system clock could be wrong.
+        log.warning(
+            "Detected overlong sleep interval - is your system clock accurate? "
+            "An accurate system time is needed to calculate how long to sleep for, "
+            "and data collection might be slowed. "
+            f"The rate limit resets at {reset} and the current time is {now}."
+        )
+    elif target_sleep_seconds < 0:
+        # If we need to sleep for negative time something weird might be up.
+        log.warning(
+            "Detected negative sleep interval - is your system clock accurate? "
+            "If your system time is running fast, rate limiting may not be "
+            "effective. "
+            f"The rate limit resets at {reset} and the current time is {now}."
+        )
+
+    log.warning("rate limit exceeded: sleeping %s secs", seconds)
+    return seconds
+
+
 def catch_request_exceptions(f, tries=30):
     """
     A decorator to handle all request exceptions. This decorator will catch
@@ -126,6 +168,9 @@ def catch_request_exceptions(f, tries=30):
     def new_f(self, *args, **kwargs):
         errors = 0
         while errors < tries:
+            # remember the session in use, so that a failure only replaces it
+            # once when several threads share it
+            client = self.client
             try:
                 resp = f(self, *args, **kwargs)
                 errors = 0
@@ -143,7 +188,45 @@ def catch_request_exceptions(f, tries=30):
                 seconds = errors**2
                 log.info("sleeping %s", seconds)
                 time.sleep(seconds)
-                self.connect()
+                self.reconnect(client)
+
+    return new_f
+
+
+def async_catch_request_exceptions(f, tries=30):
+    """
+    The asyncio equivalent of catch_request_exceptions, for decorating the
+    coroutines of AsyncTwarc2. Any transport level error from httpx causes
+    another try, up to tries times consecutively. The connection pool is
+    shared by every coroutine, so it is only replaced if it has been closed,
+    instead of being torn down under the other requests that are using it.
+    """
+
+    try:
+        import httpx
+
+        TransportError = httpx.TransportError
+    except ImportError:
+        TransportError = ()
+
+    @wraps(f)
+    async def new_f(self, *args, **kwargs):
+        errors = 0
+        while True:
+            try:
+                resp = await f(self, *args, **kwargs)
+                errors = 0
+                return resp
+            except TransportError as e:
+                errors += 1
+                log.warning("caught httpx exception: %s", e)
+                if errors > tries:
+                    log.error(f"giving up, too many request exceptions: {tries}")
+                    raise e
+                seconds = errors**2
+                log.info("sleeping %s", seconds)
+                await asyncio.sleep(seconds)
+                await self._ensure_client()
 
     return new_f
 
@@ -419,11 +502,15 @@ class TimestampProgressBar(tqdm):
         Update progress bar based on snowflake ids from an API response.
         """
         try:
-            newest_id = result["meta"]["newest_id"]
-            oldest_id = result["meta"]["oldest_id"]
+            meta = result["meta"]
+            newest_id = meta["newest_id"]
+            oldest_id = meta["oldest_id"]
             n = _snowflake2millis(int(newest_id)) - _snowflake2millis(int(oldest_id))
             self.update(n)
-            self.tweet_count += len(result["data"])
+            if "result_count" in meta:
+                self.tweet_count += meta["result_count"]
+            else:
+                self.tweet_count += len(result["data"])
         except Exception as e:
             log.error(f"Failed to update progress bar: {e}")
 
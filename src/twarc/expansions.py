@@ -4,12 +4,18 @@ for each expansion, and a function flatten() for "flattening" a result set,
 including all expansions inline. 
 
 ensure_flattened() can be used in tweet processing programs that need to make 
-sure that data is flattened.
+sure that data is flattened. Both can return lazy FlattenedTweet views, for
+programs that only read the tweets.
 """
 
+import re
+import json
 import logging
 from itertools import chain
 from collections import defaultdict
+from collections.abc import Mapping
+
+from twarc import codec
 
 log = logging.getLogger("twarc")
 
@@ -110,6 +116,43 @@ LIST_FIELDS = [
 ]
 
 
+# Fields of tweets and users that never contain anything to expand, which
+# flatten doesn't need to look inside.
+_PLAIN_FIELDS = {
+    "author_id",
+    "context_annotations",
+    "conversation_id",
+    "created_at",
+    "description",
+    "edit_controls",
+    "edit_history_tweet_ids",
+    "geo",
+    "id",
+    "in_reply_to_user_id",
+    "lang",
+    "location",
+    "name",
+    "pinned_tweet_id",
+    "possibly_sensitive",
+    "profile_image_url",
+    "protected",
+    "public_metrics",
+    "referenced_tweets",
+    "reply_settings",
+    "source",
+    "text",
+    "url",
+    "username",
+    "verified",
+    "verified_type",
+    "withheld",
+}
+
+# Entities that never contain anything to expand. Mentions are expanded
+# where they are, in the entities.
+_PLAIN_ENTITIES = {"annotations", "cashtags", "hashtags", "mentions", "urls"}
+
+
 def extract_includes(response, expansion, _id="id"):
     if "includes" in response and expansion in response["includes"]:
         return defaultdict(
@@ -120,15 +163,188 @@ def extract_includes(response, expansion, _id="id"):
         return defaultdict(lambda: {})
 
 
-def flatten(response):
+class _Includes:
     """
-    Flatten an API response by moving all "included" entities inline with the
-    tweets they are referenced from. flatten expects an entire page response
-    from the API (data, includes, meta) and will raise a ValueError if what is
-    passed in does not appear to be an API response. It will return a list of
-    dictionaries where each dictionary represents a tweet. Empty objects will
-    be returned for things that are missing in includes, which can happen when
-    protected or delete users or tweets are referenced.
+    The objects included in a page of results, indexed for expanding.
+    """
+
+    def __init__(self, response):
+        # Users by both id and username for expanding mentions
+        self.users = {
+            **extract_includes(response, "users", "id"),
+            **extract_includes(response, "users", "username"),
+        }
+        self.media = extract_includes(response, "media", "media_key")
+        self.polls = extract_includes(response, "polls")
+        self.places = extract_includes(response, "places")
+        self.tweets = extract_includes(response, "tweets")
+
+
+class FlattenedTweet(Mapping):
+    """
+    A read-only view of a tweet as flatten would return it, which expands
+    the tweet's fields from the page's includes when they are looked up,
+    instead of copying them all up front. Referenced and pinned tweets, and
+    the fields that have expansions inside them, are views too.
+
+    A view can be turned into a plain dict with to_dict, or serialized with
+    json.dumps(tweet, default=dict). This gives the same as flatten, except
+    that tweets referenced by other referenced tweets are always expanded.
+    """
+
+    __slots__ = (
+        "_tweet",
+        "_includes",
+        "_leading",
+        "_trailing",
+        "_plain",
+        "_keys",
+        "_cache",
+    )
+
+    def __init__(
+        self, tweet, includes, leading=None, trailing=None, plain=_PLAIN_FIELDS
+    ):
+        self._tweet = tweet
+        self._includes = includes
+        # keys that come before the tweet's, like the type of a reference
+        self._leading = leading or {}
+        # keys that come after the tweet's, like the matching rules
+        self._trailing = trailing or {}
+        # fields that never contain anything to expand
+        self._plain = plain
+        self._keys = None
+        self._cache = {}
+
+    def __repr__(self):
+        return f"FlattenedTweet({self.to_dict()!r})"
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = self._resolve(key)
+        return self._cache[key]
+
+    def __contains__(self, key):
+        return key in self._key_order()
+
+    def __iter__(self):
+        return iter(self._key_order())
+
+    def __len__(self):
+        return len(self._key_order())
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The tweet with all of its expansions, as flatten returns it.
+        """
+        return {key: _materialize(value) for key, value in self.items()}
+
+    def _key_order(self):
+        if self._keys is None:
+            tweet = self._tweet
+            keys = dict.fromkeys(self._leading)
+            keys.update(dict.fromkeys(tweet))
+            # in the order that flatten adds them
+            for field, expanded in _ADDED_FIELDS.items():
+                if field in tweet and (field != "poll_ids" or tweet[field]):
+                    keys[expanded] = None
+            keys.update(dict.fromkeys(self._trailing))
+            self._keys = keys
+        return self._keys
+
+    def _resolve(self, key):
+        tweet = self._tweet
+        includes = self._includes
+
+        if key in self._trailing:
+            return self._trailing[key]
+        field = _EXPANDED_FROM.get(key)
+        if field in tweet and (field != "poll_ids" or tweet[field]):
+            value = tweet[field]
+            if key == "media":
+                return [includes.media.get(media_key, {}) for media_key in value]
+            if key == "poll":
+                return includes.polls.get(value[-1], {})
+            if key == "pinned_tweet":
+                return FlattenedTweet(includes.tweets.get(value, {}), includes)
+            return includes.users.get(value, {})
+        if key not in tweet:
+            if key in self._leading:
+                return self._leading[key]
+            raise KeyError(key)
+
+        value = tweet[key]
+        if key == "geo" and "place_id" in value:
+            return {**value, **includes.places.get(value["place_id"], {})}
+        if key == "mentions":
+            return [
+                {**mention, **includes.users.get(mention["username"], {})}
+                for mention in value
+            ]
+        if key == "referenced_tweets":
+            return [
+                FlattenedTweet(includes.tweets.get(ref["id"], {}), includes, ref)
+                for ref in value
+            ]
+        if key in self._plain:
+            return value
+        if key == "entities" and isinstance(value, dict):
+            return FlattenedTweet(value, includes, plain=_PLAIN_ENTITIES)
+        return _expand_value(value, includes)
+
+
+# The fields that flatten adds to tweets and users, by the field they expand.
+_ADDED_FIELDS = {
+    "author_id": "author",
+    "in_reply_to_user_id": "in_reply_to_user",
+    "media_keys": "media",
+    "poll_ids": "poll",
+    "pinned_tweet_id": "pinned_tweet",
+}
+_EXPANDED_FROM = {expanded: field for field, expanded in _ADDED_FIELDS.items()}
+
+
+def _expand_value(value, includes):
+    if isinstance(value, dict):
+        return FlattenedTweet(value, includes, plain=())
+    if isinstance(value, list):
+        return [_expand_value(item, includes) for item in value]
+    return value
+
+
+def _materialize(value):
+    if isinstance(value, FlattenedTweet):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_materialize(item) for item in value]
+    return value
+
+
+def _flatten_lazy(response):
+    includes = _Includes(response)
+    trailing = {
+        key: response[key] for key in ("__twarc", "matching_rules") if key in response
+    }
+    data = response["data"]
+    if isinstance(data, dict):
+        data = [data]
+    elif not isinstance(data, list):
+        return []
+    return [
+        (
+            FlattenedTweet(tweet, includes, trailing=trailing)
+            if isinstance(tweet, dict)
+            else tweet
+        )
+        for tweet in data
+    ]
+
+
+def _expander(response):
+    """
+    Expand the tweets in a response's includes, and return a function that
+    expands a tweet or user from its data in place.
     """
 
     # Users extracted both by id and by username for expanding mentions
@@ -148,24 +364,10 @@ def flatten(response):
     # Errors are returned but unused here for now
     includes_errors = extract_includes(response, "errors")
 
-    def expand_payload(payload):
+    def expand_fields(payload):
         """
-        Recursively step through an object and sub objects and append extra data.
-        Can be applied to any tweet, list of tweets, sub object of tweet etc.
+        Add the included objects for any expansion fields in a dict.
         """
-
-        # Don't try to expand on primitive values, return strings as is:
-        if isinstance(payload, (str, bool, int, float)):
-            return payload
-        # expand list items individually:
-        elif isinstance(payload, list):
-            payload = [expand_payload(item) for item in payload]
-            return payload
-        # Try to expand on dicts within dicts:
-        elif isinstance(payload, dict):
-            for key, value in payload.items():
-                payload[key] = expand_payload(value)
-
         if "author_id" in payload:
             payload["author"] = includes_users[payload["author_id"]]
 
@@ -202,9 +404,80 @@ def flatten(response):
 
         return payload
 
+    def expand_payload(payload):
+        """
+        Recursively step through an object and sub objects and append extra data.
+        Can be applied to any tweet, list of tweets, sub object of tweet etc.
+        """
+
+        # Don't try to expand on primitive values, return strings as is:
+        if isinstance(payload, (str, bool, int, float)):
+            return payload
+        # expand list items individually:
+        elif isinstance(payload, list):
+            payload = [expand_payload(item) for item in payload]
+            return payload
+        # Try to expand on dicts within dicts:
+        elif isinstance(payload, dict):
+            for key, value in payload.items():
+                payload[key] = expand_payload(value)
+
+        return expand_fields(payload)
+
+    def expand_object(payload):
+        """
+        Expand a tweet or user, only looking inside the fields that can have
+        something to expand. Fields that aren't known are searched with
+        expand_payload.
+        """
+        if not isinstance(payload, dict):
+            return expand_payload(payload)
+
+        for key, value in payload.items():
+            if key in _PLAIN_FIELDS:
+                continue
+            elif key == "entities" and isinstance(value, dict):
+                for entity_type, entities in value.items():
+                    if entity_type not in _PLAIN_ENTITIES:
+                        value[entity_type] = expand_payload(entities)
+                expand_fields(value)
+            elif key == "attachments" and isinstance(value, dict):
+                expand_fields(value)
+            else:
+                payload[key] = expand_payload(value)
+
+        return expand_fields(payload)
+
     # First expand the tweets in "includes", before processing actual result tweets:
     for included_id, included_tweet in extract_includes(response, "tweets").items():
-        includes_tweets[included_id] = expand_payload(included_tweet)
+        includes_tweets[included_id] = expand_object(included_tweet)
+
+    return expand_object
+
+
+def flatten(response, lazy=False):
+    """
+    Flatten an API response by moving all "included" entities inline with the
+    tweets they are referenced from. flatten expects an entire page response
+    from the API (data, includes, meta) and will raise a ValueError if what is
+    passed in does not appear to be an API response. It will return a list of
+    dictionaries where each dictionary represents a tweet. Empty objects will
+    be returned for things that are missing in includes, which can happen when
+    protected or delete users or tweets are referenced. Only the fields of
+    tweets and users that can have something to expand are looked inside, see
+    utils/flatten_benchmark.py for how long it takes.
+
+    If lazy is True, a FlattenedTweet view is returned for each tweet instead,
+    which looks up its expansions when they are used. This is quicker for
+    programs that only read some of each tweet, and doesn't change the
+    response.
+    """
+    if lazy:
+        if "data" not in response:
+            raise ValueError(f"missing data stanza in response: {response}")
+        return _flatten_lazy(response)
+
+    expand_object = _expander(response)
 
     # Now expand the list of tweets or an individual tweet in "data"
     tweets = []
@@ -212,9 +485,9 @@ def flatten(response):
         data = response["data"]
 
         if isinstance(data, list):
-            tweets = expand_payload(response["data"])
+            tweets = [expand_object(item) for item in data]
         elif isinstance(data, dict):
-            tweets = [expand_payload(response["data"])]
+            tweets = [expand_object(data)]
 
         # Add the __twarc metadata and matching rules to each tweet if it's a result set
         if "__twarc" in response:
@@ -229,7 +502,7 @@ def flatten(response):
     return tweets
 
 
-def ensure_flattened(data):
+def ensure_flattened(data, lazy=False):
     """
     Will ensure that the supplied data is "flattened". The input data can be a
     response from the Twitter API, a list of tweet dictionaries, or a single tweet
@@ -240,18 +513,19 @@ def ensure_flattened(data):
     ensure_flattened is designed for use in twarc plugins and other tweet
     processing applications that want to operate on a stream of tweets, and
     examine included entities like users and tweets without hunting and
-    pecking in the response data.
+    pecking in the response data. Programs that only read the tweets can use
+    lazy=True to get FlattenedTweet views of responses, see flatten.
     """
 
     # If it's a single response from the API, with data and includes, we flatten it:
     if isinstance(data, dict) and "data" in data and "includes" in data:
-        return flatten(data)
+        return flatten(data, lazy)
 
     # If it's a single response with data, but without includes:
     elif isinstance(data, dict) and "data" in data and "includes" not in data:
         # flatten() will still work, just with {} empty expansions, log a warning.
         log.warning(f"Unable to expand dictionary without includes: {data}")
-        return flatten(data)
+        return flatten(data, lazy)
 
     # If it's just an object with errors return an empty list
     elif (
@@ -271,14 +545,79 @@ def ensure_flattened(data):
         # Same as above,
         if "data" in data[0] and "includes" in data[0]:
             # but flatten each object individually and return a single list
-            return list(chain.from_iterable([flatten(item) for item in data]))
+            return list(chain.from_iterable([flatten(item, lazy) for item in data]))
         elif "data" in data[0] and "includes" not in data[0]:
             # same as above, log warnings and return a single list
             log.warning(f"Unable to expand dictionary without includes: {data[0]}")
-            return list(chain.from_iterable([flatten(item) for item in data]))
+            return list(chain.from_iterable([flatten(item, lazy) for item in data]))
         # Return already flattened data as is
         elif "data" not in data[0] and "includes" not in data[0]:
             return data
     # Unknown format, eg: list of lists, or primitive
     else:
         raise ValueError(f"Cannot flatten unrecognized data: {data}")
+
+
+# The start of a page of results, with a list of tweets in data.
+_PAGE_START = re.compile(r'\s*\{\s*"data"\s*:\s*\[')
+# The includes key. A quote can't appear unescaped inside a JSON string, so
+# this can only match a key, and tweets and users don't have includes.
+_INCLUDES_KEY = re.compile(r'"includes"\s*:\s*')
+_WHITESPACE = re.compile(r"\s*")
+_decoder = json.JSONDecoder()
+
+
+def iter_flattened(line, lazy=False):
+    """
+    Parse a line of JSON and flatten it like ensure_flattened, yielding one
+    tweet at a time. When the line is a page of results, only its includes
+    are parsed up front, and the tweets in its data are parsed and flattened
+    one by one as they are used, so a large page isn't held in memory twice
+    and the first tweets are available sooner.
+
+    Args:
+        line (str): A line of JSON, such as a page of results.
+        lazy (bool): Yield FlattenedTweet views, see flatten.
+
+    Returns:
+        generator[dict]: The flattened tweets.
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+
+    start = _PAGE_START.match(line)
+    includes_key = start and _INCLUDES_KEY.search(line, start.end())
+    if not includes_key:
+        yield from ensure_flattened(codec.loads(line), lazy)
+        return
+
+    # The includes, and the keys after them, like __twarc.
+    includes, end = _decoder.raw_decode(line, includes_key.end())
+    rest = line[end:].strip()
+    rest = codec.loads("{" + rest[1:] if rest.startswith(",") else "{" + rest)
+    page = {"includes": includes, **rest}
+    trailing = {key: page[key] for key in ("__twarc", "matching_rules") if key in page}
+    if lazy:
+        page_includes = _Includes(page)
+    else:
+        expand_object = _expander(page)
+
+    pos = _WHITESPACE.match(line, start.end()).end()
+    more = not line.startswith("]", pos)
+    while more:
+        tweet, pos = _decoder.raw_decode(line, pos)
+        pos = _WHITESPACE.match(line, pos).end()
+        # Each tweet is followed by another one, or the end of the list.
+        if line.startswith(",", pos):
+            pos = _WHITESPACE.match(line, pos + 1).end()
+        elif line.startswith("]", pos):
+            more = False
+        else:
+            raise json.JSONDecodeError("Expecting ',' delimiter", line, pos)
+
+        if lazy:
+            yield FlattenedTweet(tweet, page_includes, trailing=trailing)
+        else:
+            tweet = expand_object(tweet)
+            tweet.update(trailing)
+            yield tweet
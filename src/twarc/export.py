@@ -0,0 +1,688 @@
+"""
+Writing flattened tweets out as tables.
+
+ParquetWriter writes them to a Parquet file with a fixed schema that is
+derived from the tweet, user, media, poll and place fields that twarc asks
+for, with the entities and other nested objects as struct and list columns.
+It needs pyarrow, which can be installed with pip install twarc[parquet].
+
+CSVWriter writes them to a CSV file with a column for each of a list of
+fields, by default the same columns as the twarc-csv plugin.
+"""
+
+import csv
+import logging
+import datetime
+
+from twarc import codec
+from twarc.expansions import (
+    MEDIA_FIELDS,
+    PLACE_FIELDS,
+    POLL_FIELDS,
+    TWEET_FIELDS,
+    USER_FIELDS,
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+log = logging.getLogger("twarc")
+
+# Columns of strings with only a few different values, which are written as
+# dictionaries so that they are read as categories. Strings are dictionary
+# encoded in the file either way.
+_CATEGORIES = {"lang", "reply_settings", "source"}
+
+
+def _timestamp():
+    return pyarrow.timestamp("ms", tz="UTC")
+
+
+def _struct(fields):
+    return pyarrow.struct(list(fields.items()))
+
+
+def _list(value_type):
+    return pyarrow.list_(value_type)
+
+
+def _entity_types():
+    """
+    The types of the entities of tweets and user descriptions, except for
+    mentions, which have the mentioned user's fields added by flatten.
+    """
+    string, int64 = pyarrow.string(), pyarrow.int64()
+    span = {"start": int64, "end": int64}
+    url = _struct(
+        {
+            **span,
+            "url": string,
+            "expanded_url": string,
+            "display_url": string,
+            "media_key": string,
+            "status": int64,
+            "title": string,
+            "description": string,
+            "unwound_url": string,
+            "images": _list(_struct({"url": string, "width": int64, "height": int64})),
+        }
+    )
+    return {
+        "annotations": _list(
+            _struct(
+                {
+                    **span,
+                    "probability": pyarrow.float64(),
+                    "type": string,
+                    "normalized_text": string,
+                }
+            )
+        ),
+        "cashtags": _list(_struct({**span, "tag": string})),
+        "hashtags": _list(_struct({**span, "tag": string})),
+        "urls": _list(url),
+    }
+
+
+def _withheld_type():
+    return _struct(
+        {
+            "copyright": pyarrow.bool_(),
+            "country_codes": _list(pyarrow.string()),
+            "scope": pyarrow.string(),
+        }
+    )
+
+
+def user_type():
+    """
+    Returns:
+        pyarrow.StructType: The type of a user, with a field for each of
+            USER_FIELDS.
+    """
+    string, int64 = pyarrow.string(), pyarrow.int64()
+    entities = _entity_types()
+    types = {
+        "created_at": _timestamp(),
+        "entities": _struct(
+            {
+                "url": _struct({"urls": entities["urls"]}),
+                "description": _struct(
+                    {
+                        "cashtags": entities["cashtags"],
+                        "hashtags": entities["hashtags"],
+                        "mentions": _list(
+                            _struct({"start": int64, "end": int64, "username": string})
+                        ),
+                        "urls": entities["urls"],
+                    }
+                ),
+            }
+        ),
+        "protected": pyarrow.bool_(),
+        "public_metrics": _struct(
+            {
+                "followers_count": int64,
+                "following_count": int64,
+                "tweet_count": int64,
+                "listed_count": int64,
+                "like_count": int64,
+            }
+        ),
+        "verified": pyarrow.bool_(),
+        "withheld": _withheld_type(),
+    }
+    return _struct({name: types.get(name, string) for name in USER_FIELDS})
+
+
+def media_type():
+    """
+    Returns:
+        pyarrow.StructType: The type of a media object, with a field for each
+            of MEDIA_FIELDS.
+    """
+    string, int64 = pyarrow.string(), pyarrow.int64()
+    types = {
+        "duration_ms": int64,
+        "height": int64,
+        "width": int64,
+        "variants": _list(
+            _struct({"bit_rate": int64, "content_type": string, "url": string})
+        ),
+        "public_metrics": _struct({"view_count": int64}),
+    }
+    return _struct({name: types.get(name, string) for name in MEDIA_FIELDS})
+
+
+def poll_type():
+    """
+    Returns:
+        pyarrow.StructType: The type of a poll, with a field for each of
+            POLL_FIELDS.
+    """
+    string, int64 = pyarrow.string(), pyarrow.int64()
+    types = {
+        "duration_minutes": int64,
+        "end_datetime": _timestamp(),
+        "options": _list(_struct({"position": int64, "label": string, "votes": int64})),
+    }
+    return _struct({name: types.get(name, string) for name in POLL_FIELDS})
+
+
+def _place_types():
+    string = pyarrow.string()
+    return {
+        name: {
+            "contained_within": _list(string),
+            "geo": _struct({"type": string, "bbox": _list(pyarrow.float64())}),
+        }.get(name, string)
+        for name in PLACE_FIELDS
+    }
+
+
+def tweet_type(referenced=True):
+    """
+    The type of a flattened tweet, with a field for each of TWEET_FIELDS, and
+    for the objects that flatten adds to them: the author, the user replied
+    to, and the media, poll and place of the tweet.
+
+    Args:
+        referenced (bool): Include the referenced tweets in full. They are
+            only included one level deep, so the referenced tweets of
+            referenced tweets are only their type and id.
+
+    Returns:
+        pyarrow.StructType: The type of a tweet.
+    """
+    string, int64 = pyarrow.string(), pyarrow.int64()
+    user = user_type()
+    entities = _entity_types()
+    references = {"type": string, "id": string}
+    if referenced:
+        references.update(
+            (field.name, field.type)
+            for field in tweet_type(referenced=False)
+            if field.name not in references
+        )
+
+    types = {
+        "attachments": _struct(
+            {
+                "media_keys": _list(string),
+                "poll_ids": _list(string),
+                "media": _list(media_type()),
+                "poll": poll_type(),
+            }
+        ),
+        "context_annotations": _list(
+            _struct(
+                {
+                    kind: _struct({"id": string, "name": string, "description": string})
+                    for kind in ("domain", "entity")
+                }
+            )
+        ),
+        "created_at": _timestamp(),
+        "entities": _struct(
+            {
+                **entities,
+                "mentions": _list(
+                    _struct(
+                        {
+                            "start": int64,
+                            "end": int64,
+                            **{field.name: field.type for field in user},
+                        }
+                    )
+                ),
+            }
+        ),
+        "geo": _struct(
+            {
+                "place_id": string,
+                "coordinates": _struct(
+                    {"type": string, "coordinates": _list(pyarrow.float64())}
+                ),
+                **_place_types(),
+            }
+        ),
+        "public_metrics": _struct(
+            {
+                "retweet_count": int64,
+                "reply_count": int64,
+                "like_count": int64,
+                "quote_count": int64,
+                "bookmark_count": int64,
+                "impression_count": int64,
+            }
+        ),
+        "possibly_sensitive": pyarrow.bool_(),
+        "referenced_tweets": _list(_struct(references)),
+        "withheld": _withheld_type(),
+        "edit_controls": _struct(
+            {
+                "edits_remaining": int64,
+                "is_edit_eligible": pyarrow.bool_(),
+                "editable_until": _timestamp(),
+            }
+        ),
+        "edit_history_tweet_ids": _list(string),
+    }
+    fields = {name: types.get(name, string) for name in TWEET_FIELDS}
+    fields["author"] = user
+    fields["in_reply_to_user"] = user
+    return _struct(fields)
+
+
+def tweet_schema():
+    """
+    Returns:
+        pyarrow.Schema: The schema of a table of flattened tweets, with the
+            fields of tweet_type, and the __twarc metadata and the stream
+            rules that the tweets matched.
+    """
+    string = pyarrow.string()
+    categories = pyarrow.dictionary(pyarrow.int32(), string)
+    fields = [
+        field.with_type(categories) if field.name in _CATEGORIES else field
+        for field in tweet_type()
+    ]
+    fields.append(
+        pyarrow.field(
+            "__twarc",
+            _struct({"url": string, "version": string, "retrieved_at": _timestamp()}),
+        )
+    )
+    fields.append(
+        pyarrow.field("matching_rules", _list(_struct({"id": string, "tag": string})))
+    )
+    return pyarrow.schema(fields)
+
+
+def _converter(value_type):
+    """
+    Compile a function that prepares a value for a column of a type, by
+    parsing the timestamps in it. The values of columns that don't have
+    timestamps in them don't need preparing, and this returns None for them.
+    Fields that aren't in the type are ignored when the column is built.
+    """
+    if pyarrow.types.is_timestamp(value_type):
+        return _parse_timestamp
+
+    elif pyarrow.types.is_struct(value_type):
+        fields = [(field.name, _converter(field.type)) for field in value_type]
+        fields = [(name, convert) for name, convert in fields if convert]
+        if not fields:
+            return None
+
+        def convert_struct(value):
+            if not isinstance(value, dict):
+                return None
+            value = dict(value)
+            for name, convert in fields:
+                if name in value:
+                    value[name] = convert(value[name])
+            return value
+
+        return convert_struct
+
+    elif pyarrow.types.is_list(value_type):
+        convert = _converter(value_type.value_type)
+        if convert is None:
+            return None
+
+        def convert_list(value):
+            if not isinstance(value, list):
+                return None
+            return [convert(item) for item in value]
+
+        return convert_list
+
+    return None
+
+
+def _parse_timestamp(value):
+    if not isinstance(value, str):
+        return None
+    try:
+        # Twitter's timestamps are like 2022-05-01T12:00:00.000Z
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        log.warning("ignored invalid timestamp %s", value)
+        return None
+
+
+class ParquetWriter:
+    """
+    Writes flattened tweets to a Parquet file, in row groups of a number of
+    tweets at a time, so that only that many are held in memory. Strings
+    are dictionary encoded, and the columns for strings with only a few
+    different values, like lang and source, are dictionaries in Arrow too.
+
+    Args:
+        outfile (str or file): The path or binary file to write to.
+        row_group_size (int): The number of tweets in each row group.
+        compression (str): The compression for the columns, like snappy or
+            zstd.
+    """
+
+    def __init__(self, outfile, row_group_size=10000, compression="zstd"):
+        if pyarrow is None:
+            raise RuntimeError(
+                "Parquet export needs the pyarrow package, which can be "
+                "installed with: pip install twarc[parquet]"
+            )
+
+        self.schema = tweet_schema()
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.count = 0
+        self.writer = pyarrow.parquet.ParquetWriter(
+            outfile, self.schema, compression=compression, use_dictionary=True
+        )
+        converters = ((field.name, _converter(field.type)) for field in self.schema)
+        self.converters = [(name, convert) for name, convert in converters if convert]
+
+    def write(self, tweet):
+        """
+        Add a flattened tweet, writing a row group when there are enough.
+
+        Args:
+            tweet (dict): A tweet, as flatten returns it.
+        """
+        row = dict(tweet)
+        for name, convert in self.converters:
+            if name in row:
+                row[name] = convert(row[name])
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the tweets that have been added as a row group.
+        """
+        if not self.rows:
+            return
+        table = pyarrow.Table.from_pylist(self.rows, schema=self.schema)
+        self.writer.write_table(table, row_group_size=len(self.rows))
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        """
+        Write the remaining tweets and the footer of the file.
+        """
+        self.flush()
+        self.writer.close()
+
+
+# The columns that CSVWriter writes by default, which are the columns of the
+# twarc-csv plugin.
+CSV_COLUMNS = [
+    "id",
+    "conversation_id",
+    "referenced_tweets.replied_to.id",
+    "referenced_tweets.retweeted.id",
+    "referenced_tweets.quoted.id",
+    "author_id",
+    "in_reply_to_user_id",
+    "in_reply_to_username",
+    "retweeted_user_id",
+    "retweeted_username",
+    "quoted_user_id",
+    "quoted_username",
+    "created_at",
+    "text",
+    "lang",
+    "source",
+    "public_metrics.impression_count",
+    "public_metrics.reply_count",
+    "public_metrics.retweet_count",
+    "public_metrics.quote_count",
+    "public_metrics.like_count",
+    "public_metrics.bookmark_count",
+    "reply_settings",
+    "edit_history_tweet_ids",
+    "edit_controls.edits_remaining",
+    "edit_controls.editable_until",
+    "edit_controls.is_edit_eligible",
+    "possibly_sensitive",
+    "withheld.scope",
+    "withheld.copyright",
+    "withheld.country_codes",
+    "entities.annotations",
+    "entities.cashtags",
+    "entities.hashtags",
+    "entities.mentions",
+    "entities.urls",
+    "context_annotations",
+    "attachments.media",
+    "attachments.media_keys",
+    "attachments.poll.duration_minutes",
+    "attachments.poll.end_datetime",
+    "attachments.poll.id",
+    "attachments.poll.options",
+    "attachments.poll.voting_status",
+    "attachments.poll_ids",
+    "author.id",
+    "author.created_at",
+    "author.username",
+    "author.name",
+    "author.description",
+    "author.entities.description.cashtags",
+    "author.entities.description.hashtags",
+    "author.entities.description.mentions",
+    "author.entities.description.urls",
+    "author.entities.url.urls",
+    "author.url",
+    "author.location",
+    "author.pinned_tweet_id",
+    "author.profile_image_url",
+    "author.protected",
+    "author.public_metrics.followers_count",
+    "author.public_metrics.following_count",
+    "author.public_metrics.listed_count",
+    "author.public_metrics.tweet_count",
+    "author.verified",
+    "author.verified_type",
+    "author.withheld.scope",
+    "author.withheld.copyright",
+    "author.withheld.country_codes",
+    "geo.coordinates.coordinates",
+    "geo.coordinates.type",
+    "geo.country",
+    "geo.country_code",
+    "geo.full_name",
+    "geo.geo.bbox",
+    "geo.geo.type",
+    "geo.id",
+    "geo.name",
+    "geo.place_id",
+    "geo.place_type",
+    "matching_rules",
+    "__twarc.retrieved_at",
+    "__twarc.url",
+    "__twarc.version",
+]
+
+# Columns that are short for a field of a referenced tweet.
+_CSV_ALIASES = {
+    "in_reply_to_username": "referenced_tweets.replied_to.author.username",
+    "retweeted_user_id": "referenced_tweets.retweeted.author_id",
+    "retweeted_username": "referenced_tweets.retweeted.author.username",
+    "quoted_user_id": "referenced_tweets.quoted.author_id",
+    "quoted_username": "referenced_tweets.quoted.author.username",
+}
+
+# Entities are written as lists of their text, like twarc-csv does.
+_ENTITY_TEXT = {
+    "cashtags": lambda entity: "$" + entity["tag"],
+    "hashtags": lambda entity: "#" + entity["tag"],
+    "mentions": lambda entity: "@" + entity["username"],
+    "urls": lambda entity: (
+        entity.get("display_url")
+        if "media_key" in entity
+        else entity.get("expanded_url") or entity.get("url")
+    ),
+}
+
+# The fields that have timestamps in them.
+_TIMESTAMP_FIELDS = {"created_at", "editable_until", "end_datetime", "retrieved_at"}
+
+
+def csv_extractors(columns, date_format=None):
+    """
+    Compile CSV columns into functions that get their values from a tweet,
+    so that working out what each column means is done once, and not for
+    every tweet.
+
+    A column is a path of keys in a flattened tweet, separated by dots, like
+    author.username. A path through referenced_tweets picks the referenced
+    tweet of a type, like referenced_tweets.quoted.author.username, and the
+    entities are written as lists of their text. Lists and objects are
+    written as JSON.
+
+    Args:
+        columns (list[str]): The columns.
+        date_format (str): A strftime format to write timestamps in, instead
+            of as Twitter sends them.
+
+    Returns:
+        list[function]: A function for each column that is given a tweet
+            and returns the value to write.
+    """
+    extractors = []
+    for column in columns:
+        keys = _CSV_ALIASES.get(column, column).split(".")
+        if keys[0] == "referenced_tweets" and len(keys) > 2:
+            get = _referenced_getter(keys[1], _path_getter(keys[2:]))
+        else:
+            get = _path_getter(keys)
+
+        if "entities" in keys[:-1] and keys[-1] in _ENTITY_TEXT:
+            get = _entities_getter(get, _ENTITY_TEXT[keys[-1]])
+        elif date_format and keys[-1] in _TIMESTAMP_FIELDS:
+            get = _timestamp_getter(get, date_format)
+
+        extractors.append(_cell_getter(get))
+    return extractors
+
+
+def _path_getter(keys):
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda tweet: tweet.get(key)
+
+    def get(tweet):
+        value = tweet
+        for key in keys:
+            try:
+                value = value.get(key)
+            except AttributeError:
+                # None, or a value that isn't an object
+                return None
+        return value
+
+    return get
+
+
+def _referenced_getter(reference_type, get):
+    def get_referenced(tweet):
+        referenced = None
+        for reference in tweet.get("referenced_tweets") or []:
+            if reference.get("type") == reference_type:
+                referenced = reference
+        return None if referenced is None else get(referenced)
+
+    return get_referenced
+
+
+def _entities_getter(get, text):
+    def get_entities(tweet):
+        entities = get(tweet)
+        if not isinstance(entities, list):
+            return entities
+        return [text(entity) for entity in entities]
+
+    return get_entities
+
+
+def _timestamp_getter(get, date_format):
+    def get_timestamp(tweet):
+        value = get(tweet)
+        timestamp = _parse_timestamp(value)
+        return value if timestamp is None else timestamp.strftime(date_format)
+
+    return get_timestamp
+
+
+def _cell_getter(get):
+    def get_cell(tweet):
+        value = get(tweet)
+        if isinstance(value, str):
+            if "\n" in value or "\r" in value:
+                # keep each tweet on one line, like twarc-csv
+                return value.replace("\r", "").replace("\n", r"\n")
+            return value
+        if value is None or isinstance(value, (int, float)):
+            return value
+        return codec.dumps(value, default=dict)
+
+    return get_cell
+
+
+class CSVWriter:
+    """
+    Writes flattened tweets to a CSV file, with a row for each tweet and a
+    column for each of a list of fields. Rows are written in batches.
+
+    Args:
+        outfile (file): The text file to write to, opened with newline="".
+        columns (list[str]): The columns, see csv_extractors. Defaults to
+            CSV_COLUMNS.
+        date_format (str): A strftime format to write timestamps in.
+        header (bool): Write a header row with the names of the columns.
+        batch_size (int): The number of rows to write at a time.
+    """
+
+    def __init__(
+        self, outfile, columns=None, date_format=None, header=True, batch_size=1000
+    ):
+        self.columns = list(columns or CSV_COLUMNS)
+        self.extractors = csv_extractors(self.columns, date_format)
+        self.writer = csv.writer(outfile)
+        self.batch_size = batch_size
+        self.rows = []
+        self.count = 0
+        if header:
+            self.writer.writerow(self.columns)
+
+    def write(self, tweet):
+        """
+        Add a flattened tweet, writing the rows when there are enough.
+
+        Args:
+            tweet (dict): A tweet, as flatten returns it.
+        """
+        self.rows.append([extract(tweet) for extract in self.extractors])
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows of the tweets that have been added.
+        """
+        self.writer.writerows(self.rows)
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        """
+        Write the remaining rows. The file is left open.
+        """
+        self.flush()
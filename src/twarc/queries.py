@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers for combining many search queries into fewer API requests: packing
+queries into combined OR queries, and working out locally which of the
+original queries each returned tweet matched.
+"""
+
+import re
+import math
+import logging
+
+log = logging.getLogger("twarc")
+
+# Splits text into the words that keywords are matched against.
+_WORDS = re.compile(r"\w+")
+
+# Splits a query into parentheses, quoted phrases (optionally after an
+# operator like place:) and everything else up to the next space or
+# parenthesis.
+_TOKENS = re.compile(r'\(|\)|-?(?:[\w$#@]+:)?"[^"]*"|[^\s()]+')
+
+
+def join_queries(queries):
+    """
+    Combine queries into a single query that matches any of them.
+
+    Args:
+        queries (list[str]): The queries to combine.
+
+    Returns:
+        str: The combined query.
+    """
+    return " OR ".join(f"({query})" for query in queries)
+
+
+def pack_queries(queries, max_length, volumes=None, page_size=100):
+    """
+    Group queries so that each group can be sent as one combined query no
+    longer than max_length, using as few requests as possible.
+
+    Queries are placed longest first into the group where they add the
+    fewest requests, and then where they fill the most of the remaining
+    length. Without volumes every group costs one request, so this packs the
+    queries into as few groups as it can. With volumes, the number of
+    requests a group needs is estimated from the number of tweets its
+    queries match.
+
+    Args:
+        queries (list[str]): The queries to pack.
+        max_length (int): Combined queries must be shorter than this.
+        volumes (dict): The number of tweets expected for each query.
+        page_size (int): The number of tweets returned per request.
+
+    Returns:
+        list[list[str]]: The groups of queries, in the order their first
+            query appears in queries.
+    """
+    volumes = volumes or {}
+    order = {query: i for i, query in enumerate(queries)}
+
+    def requests(volume):
+        return max(1, math.ceil(volume / page_size))
+
+    groups = []
+    for query in sorted(queries, key=lambda q: (-len(q), order[q])):
+        volume = volumes.get(query, 0)
+        best = None
+        for group in groups:
+            length = group["length"] + len(query) + len(" OR ()")
+            if length >= max_length:
+                continue
+            added = requests(group["volume"] + volume) - requests(group["volume"])
+            key = (added, -length)
+            if best is None or key < best[0]:
+                best = (key, group, length)
+
+        if best is None:
+            length = len(query) + len("()")
+            if length >= max_length:
+                log.warning("query is too long to combine: %s", query)
+            groups.append({"queries": [query], "length": length, "volume": volume})
+        else:
+            _, group, length = best
+            group["queries"].append(query)
+            group["length"] = length
+            group["volume"] += volume
+
+    packed = [sorted(g["queries"], key=order.get) for g in groups]
+    return sorted(packed, key=lambda g: order[g[0]])
+
+
+class Query:
+    """
+    A search query parsed so that it can be matched against tweets locally.
+
+    Keywords, quoted phrases, hashtags, cashtags, mentions, the from:, to:,
+    lang:, conversation_id:, is: and has: operators, negation, OR and
+    grouping are understood. Other operators can't be checked locally, so
+    they are assumed to match.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.tokens = _TOKENS.findall(query)
+        self.pos = 0
+        self.expression = self._or()
+        self.tokens = None
+
+    def __repr__(self):
+        return f"Query({self.query!r})"
+
+    def matches(self, tweet, includes=None):
+        """
+        Check whether a tweet could have matched the query.
+
+        Args:
+            tweet (dict): A tweet from the data of an API response.
+            includes (dict): The includes of the API response, used to look
+                up the usernames of authors and the text of retweets.
+
+        Returns:
+            bool: False if the tweet definitely doesn't match the query.
+        """
+        return _evaluate(self.expression, _TweetContext(tweet, includes)) is not False
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _or(self):
+        terms = [self._and()]
+        while self._peek() == "OR":
+            self.pos += 1
+            terms.append(self._and())
+        return terms[0] if len(terms) == 1 else ("or", terms)
+
+    def _and(self):
+        terms = []
+        while self._peek() not in (None, ")", "OR"):
+            terms.append(self._unary())
+        if not terms:
+            # an empty query or group, like "cats OR" or "()"
+            return ("unknown",)
+        return terms[0] if len(terms) == 1 else ("and", terms)
+
+    def _unary(self):
+        token = self._peek()
+        self.pos += 1
+        if token == "(":
+            expression = self._or()
+            if self._peek() == ")":
+                self.pos += 1
+            return expression
+        if token == "-" and self._peek() == "(":
+            return ("not", self._unary())
+        if token.startswith("-") and len(token) > 1:
+            return ("not", _term(token[1:]))
+        return _term(token)
+
+
+def _term(token):
+    """
+    Parse a single query term into an expression.
+    """
+    if token.startswith('"'):
+        return ("phrase", _words(token.strip('"')))
+    if token[0] in "#$@" and len(token) > 1:
+        return (token[0], token[1:].lower())
+
+    operator, sep, value = token.partition(":")
+    if sep and value and operator.isalpha():
+        return ("operator", operator.lower(), value.strip('"').lower())
+
+    return ("phrase", _words(token))
+
+
+def _words(text):
+    return [w.lower() for w in _WORDS.findall(text)]
+
+
+class _TweetContext:
+    """
+    The parts of a tweet that query terms are matched against.
+    """
+
+    def __init__(self, tweet, includes=None):
+        includes = includes or {}
+        users = {u["id"]: u for u in includes.get("users", [])}
+        tweets = {t["id"]: t for t in includes.get("tweets", [])}
+
+        self.tweet = tweet
+        self.references = {
+            ref["type"]: tweets.get(ref["id"], {})
+            for ref in tweet.get("referenced_tweets", [])
+        }
+
+        # The text of a retweet is truncated, so match against the original.
+        sources = [tweet, self.references.get("retweeted", {})]
+        text = " ".join(source.get("text", "") for source in sources)
+        entities = [source.get("entities", {}) for source in sources]
+        urls = [u.get("expanded_url", "") for e in entities for u in e.get("urls", [])]
+
+        self.words = _words(" ".join([text] + urls))
+        self.word_set = set(self.words)
+        self.tags = {
+            "#": {h["tag"].lower() for e in entities for h in e.get("hashtags", [])},
+            "$": {c["tag"].lower() for e in entities for c in e.get("cashtags", [])},
+            "@": {
+                m["username"].lower() for e in entities for m in e.get("mentions", [])
+            },
+        }
+
+        author = users.get(tweet.get("author_id"), {})
+        reply_to = users.get(tweet.get("in_reply_to_user_id"), {})
+        self.author = {tweet.get("author_id"), author.get("username", "").lower()}
+        self.reply_to = {
+            tweet.get("in_reply_to_user_id"),
+            reply_to.get("username", "").lower(),
+        }
+
+    def phrase(self, words):
+        if not words:
+            return None
+        if len(words) == 1:
+            return words[0] in self.word_set
+        n = len(words)
+        return any(
+            self.words[i : i + n] == words for i in range(len(self.words) - n + 1)
+        )
+
+    def operator(self, operator, value):
+        tweet = self.tweet
+        if operator == "from":
+            return value in self.author
+        if operator == "to":
+            return value in self.reply_to
+        if operator == "lang":
+            return tweet.get("lang", "").lower() == value if "lang" in tweet else None
+        if operator == "conversation_id" and "conversation_id" in tweet:
+            return tweet["conversation_id"] == value
+        if operator == "is" and value in ("retweet", "reply", "quote"):
+            types = {"retweet": "retweeted", "reply": "replied_to", "quote": "quoted"}
+            return types[value] in self.references
+        if operator == "has":
+            if value == "hashtags":
+                return bool(self.tags["#"])
+            if value == "cashtags":
+                return bool(self.tags["$"])
+            if value == "mentions":
+                return bool(self.tags["@"])
+            if value == "links":
+                return "urls" in tweet.get("entities", {})
+            if value == "media":
+                return "media_keys" in tweet.get("attachments", {})
+        return None
+
+
+def _evaluate(expression, context):
+    """
+    Evaluate an expression for a tweet, returning True, False or None if it
+    can't be checked locally.
+    """
+    kind = expression[0]
+    if kind == "unknown":
+        return None
+    if kind == "or":
+        results = [_evaluate(e, context) for e in expression[1]]
+        return True if True in results else (None if None in results else False)
+    if kind == "and":
+        results = [_evaluate(e, context) for e in expression[1]]
+        return False if False in results else (None if None in results else True)
+    if kind == "not":
+        result = _evaluate(expression[1], context)
+        return None if result is None else not result
+    if kind == "phrase":
+        return context.phrase(expression[1])
+    if kind == "operator":
+        return context.operator(expression[1], expression[2])
+    return expression[1] in context.tags[kind]
+
+
+def tag_matching_queries(response, queries):
+    """
+    Add a matching_queries list to each tweet in an API response, with the
+    original queries that the tweet matched. Tweets that can't be matched
+    locally to any of the queries are tagged with all of them, since the API
+    returned them for at least one.
+
+    Args:
+        response (dict): An API response from a combined query.
+        queries (list[Query]): The queries that were combined.
+
+    Returns:
+        dict: The response.
+    """
+    includes = response.get("includes", {})
+    for tweet in response.get("data", []):
+        matched = [q.query for q in queries if q.matches(tweet, includes)]
+        tweet["matching_queries"] = matched or [q.query for q in queries]
+    return response
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+"""
+Proactive rate limiting for the Twitter v2 API.
+"""
+
+import re
+import time
+import logging
+import threading
+
+from urllib.parse import urlsplit
+
+from twarc import concurrency
+
+log = logging.getLogger("twarc")
+
+# The full archive endpoints have a 1 request/second limit in addition to the
+# 15 minute window, which isn't reported in the response headers.
+MIN_INTERVALS = {
+    "/2/tweets/search/all": 1.05,
+    "/2/tweets/counts/all": 1.05,
+}
+
+# All of the read rate limits in the Twitter API use a 15 minute window.
+WINDOW_SECONDS = 15 * 60
+
+
+class RateLimiter:
+    """
+    A token bucket per API endpoint, shared by every thread and generator
+    using a client. The size of each bucket and when it refills are learned
+    from the `x-rate-limit-limit`, `x-rate-limit-remaining` and
+    `x-rate-limit-reset` response headers, so requests can be paced to avoid
+    ever seeing a 429 response.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def reserve(self, url, key=None):
+        """
+        Reserve a request to the endpoint for the given URL, and return how
+        long the caller needs to wait before sending it.
+
+        Args:
+            url (str): The URL that will be requested.
+            key (str): Identifies the credentials used for the request, since
+                each set of credentials has its own rate limits.
+
+        Returns:
+            float: The number of seconds to wait before sending the request.
+        """
+        return self.reserve_any(url, [key])[1]
+
+    def reserve_any(self, url, keys):
+        """
+        Reserve a request to the endpoint for the given URL using whichever
+        of the credentials has the most headroom: the one that can send the
+        soonest, and then the one with the most requests left in its window.
+
+        Args:
+            url (str): The URL that will be requested.
+            keys (list): Identifies each of the credentials to choose from.
+
+        Returns:
+            tuple: The chosen key, and the number of seconds to wait before
+                sending the request.
+        """
+        endpoint = _endpoint(url)
+        with self.lock:
+            now = time.time()
+            key = min(keys, key=lambda k: self._bucket(k, endpoint).headroom(now))
+            send_at = self._bucket(key, endpoint).take(now)
+
+        seconds = send_at - now
+        if seconds > 5:
+            log.info("rate limit for %s reached: waiting %.0f secs", endpoint, seconds)
+        return key, seconds
+
+    def wait(self, url, key=None):
+        """
+        Reserve a request to the endpoint for the given URL, and sleep until
+        it can be sent.
+
+        Args:
+            url (str): The URL that will be requested.
+            key (str): Identifies the credentials used for the request.
+        """
+        seconds = self.reserve(url, key)
+        if seconds > 0:
+            concurrency.sleep(seconds)
+
+    def update(self, url, headers, key=None):
+        """
+        Learn the state of the rate limit window from the headers of a
+        response.
+
+        Args:
+            url (str): The URL that was requested.
+            headers (dict): Headers from the response.
+            key (str): Identifies the credentials used for the request.
+        """
+        try:
+            limit = int(headers["x-rate-limit-limit"])
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset = int(headers["x-rate-limit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        endpoint = _endpoint(url)
+        with self.lock:
+            bucket = self._bucket(key, endpoint)
+            bucket.limit = limit
+            if bucket.reset is not None and bucket.remaining is not None:
+                if reset <= bucket.reset + 1:
+                    # Other requests may be in flight in the same window, and
+                    # they have already been subtracted from the local count.
+                    remaining = min(remaining, bucket.remaining)
+            bucket.remaining = remaining
+            bucket.reset = reset
+
+    def _bucket(self, key, endpoint):
+        bucket = self.buckets.get((key, endpoint))
+        if bucket is None:
+            bucket = Bucket(MIN_INTERVALS.get(endpoint, 0))
+            self.buckets[(key, endpoint)] = bucket
+        return bucket
+
+
+class Bucket:
+    """
+    The rate limit state of a single endpoint. The limit, remaining and reset
+    are None until a response has been seen.
+    """
+
+    def __init__(self, min_interval=0):
+        self.min_interval = min_interval
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.next_request = 0
+
+    def headroom(self, now):
+        """
+        A sort key which puts the bucket that can send the soonest, with the
+        most requests remaining, first.
+        """
+        send_at = max(now, self.next_request)
+        remaining = self.remaining
+        if self.reset is not None and send_at >= self.reset:
+            remaining = self.limit
+        if remaining is None:
+            return (send_at, -float("inf"))
+        if remaining <= 0:
+            send_at = self.reset + 1 if self.reset is not None else now + WINDOW_SECONDS
+        return (send_at, -remaining)
+
+    def take(self, now):
+        """
+        Take a request from the bucket, and return the time it can be sent.
+        """
+        send_at = max(now, self.next_request)
+
+        if self.reset is not None and send_at >= self.reset:
+            # the window has passed, the next response will tell us more
+            self.remaining = self.limit
+            self.reset = None
+
+        if self.remaining is not None and self.remaining <= 0:
+            if self.reset is not None:
+                # leave a second of leeway for clock differences
+                send_at = self.reset + 1
+            else:
+                send_at = now + WINDOW_SECONDS
+            self.remaining = self.limit
+            self.reset = send_at + WINDOW_SECONDS
+
+        if self.remaining is not None:
+            self.remaining -= 1
+        self.next_request = send_at + self.min_interval
+        return send_at
+
+
+def _endpoint(url):
+    """
+    Rate limits apply to endpoints, not individual URLs, so replace IDs in
+    the path with a placeholder.
+    """
+    version, _, path = urlsplit(str(url)).path.lstrip("/").partition("/")
+    return f"/{version}/" + re.sub(r"(?<![^/])\d+(?=/|$)", ":id", path)
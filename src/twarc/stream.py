@@ -0,0 +1,702 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers for reading the streaming endpoints without falling behind: a
+reader thread that only pulls lines off the connection into a bounded
+buffer, a writer thread for the output, rotating compressed output files,
+output files for each stream rule, and metrics about all of them.
+"""
+
+import os
+import re
+import glob
+import gzip
+import json
+import math
+import time
+import queue
+import logging
+import threading
+import collections
+
+from twarc import codec
+from twarc.concurrency import _DONE
+from twarc.decorators2 import _snowflake2millis
+
+log = logging.getLogger("twarc")
+
+OVERFLOW_POLICIES = ["block", "drop-oldest", "drop-newest"]
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# The most that the streaming endpoints can backfill after a disconnect.
+MAX_BACKFILL_MINUTES = 5
+
+
+class StreamStalled(Exception):
+    """
+    Raised when nothing has been received from a stream for too long.
+    """
+
+
+class StreamMetrics:
+    """
+    Counters describing the health of a stream, which are updated as it
+    runs. The buffer counters show backpressure: how full the buffer between
+    the connection and the consumer is, how long the reader spent waiting for
+    space in it, and how many lines were dropped because it was full.
+
+    Delivery lag (the time a tweet was received minus the time it was
+    created), the rate of tweets and the longest gap between keep-alives are
+    measured over the time since the previous snapshot, and idle_seconds is
+    the time since anything was last received.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.connections = 0
+        self.stalls = 0
+        self.lines = 0
+        self.keepalives = 0
+        self.tweets = 0
+        self.duplicates = 0
+        self.backfill_minutes = 0
+        self.buffer_size = 0
+        self.buffer_peak = 0
+        self.blocked_seconds = 0.0
+        self.dropped = 0
+        self.written = 0
+        self.write_buffer_size = 0
+        self.last_received = None
+        self._last_keepalive = None
+        self._window_start = self.started
+        self._window_tweets = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._keepalive_gap = 0.0
+
+    def add(self, **counts):
+        """
+        Add to some of the counters.
+        """
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def tweet(self, tweet_id, received=None):
+        """
+        Count a tweet, and how long after it was created it was received.
+
+        Args:
+            tweet_id (str): The id of the tweet, which contains the time it
+                was created.
+            received (float): When the tweet was received.
+        """
+        received = received or time.time()
+        lag = max(0.0, received - _snowflake2millis(int(tweet_id)) / 1000)
+        with self.lock:
+            self.tweets += 1
+            self._lag_total += lag
+            self._lag_max = max(self._lag_max, lag)
+
+    def keepalive(self, received=None):
+        """
+        Count a keep-alive, and the time since the previous one.
+
+        Args:
+            received (float): When the keep-alive was received.
+        """
+        received = received or time.time()
+        with self.lock:
+            self.keepalives += 1
+            if self._last_keepalive is not None:
+                gap = received - self._last_keepalive
+                self._keepalive_gap = max(self._keepalive_gap, gap)
+            self._last_keepalive = received
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: The current value of each of the metrics.
+        """
+        now = time.time()
+        with self.lock:
+            metrics = {
+                name: value
+                for name, value in vars(self).items()
+                if name not in ("lock", "started", "last_received")
+                and not name.startswith("_")
+            }
+
+            tweets = self.tweets - self._window_tweets
+            seconds = now - self._window_start
+            metrics["tweets_per_second"] = round(tweets / seconds, 2) if seconds else 0
+            metrics["lag_seconds"] = round(self._lag_total / tweets, 3) if tweets else 0
+            metrics["lag_max_seconds"] = round(self._lag_max, 3)
+            metrics["keepalive_gap_seconds"] = round(self._keepalive_gap, 1)
+            last_received = self.last_received or self.started
+            metrics["idle_seconds"] = round(now - last_received, 1)
+
+            self._window_start = now
+            self._window_tweets = self.tweets
+            self._lag_total = 0.0
+            self._lag_max = 0.0
+            self._keepalive_gap = 0.0
+
+        metrics["uptime"] = round(now - self.started, 1)
+        metrics["blocked_seconds"] = round(metrics["blocked_seconds"], 3)
+        return metrics
+
+
+class StreamReader:
+    """
+    Read lines from a streaming response in a background thread into a
+    bounded buffer, so that the connection keeps being read while the
+    consumer decodes and writes the data.
+
+    When the buffer is full the overflow policy decides what happens: "block"
+    waits for space (which will eventually slow down reading from the
+    connection), "drop-oldest" discards the oldest buffered line and
+    "drop-newest" discards the line that was just read.
+
+    Any exception raised while reading is raised again in the consumer. If
+    stall_timeout is set and nothing is read for that many seconds, the
+    consumer gets a StreamStalled exception.
+    """
+
+    def __init__(
+        self,
+        resp,
+        buffer_size=1000,
+        overflow="block",
+        metrics=None,
+        stall_timeout=None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.resp = resp
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.overflow = overflow
+        self.metrics = metrics or StreamMetrics()
+        self.stall_timeout = stall_timeout
+        self.connected = time.time()
+        self.last_received = None
+        self.received = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item, value = self._get()
+        self.metrics.buffer_size = self.buffer.qsize()
+        if item is _DONE:
+            self.stopped.set()
+            if value is not None:
+                raise value
+            raise StopIteration
+        # the time the line was received
+        self.received = value
+        return item
+
+    def close(self):
+        """
+        Stop reading, and close the response.
+        """
+        self.stopped.set()
+        self.resp.close()
+
+    def _get(self):
+        if not self.stall_timeout:
+            return self.buffer.get()
+        while True:
+            # anything already buffered was received in time
+            try:
+                return self.buffer.get_nowait()
+            except queue.Empty:
+                pass
+            last = self.last_received or self.connected
+            remaining = last + self.stall_timeout - time.time()
+            if remaining <= 0:
+                self.metrics.add(stalls=1)
+                raise StreamStalled(
+                    f"nothing received for {self.stall_timeout} seconds"
+                )
+            try:
+                return self.buffer.get(timeout=remaining)
+            except queue.Empty:
+                continue
+
+    def _read(self):
+        error = None
+        try:
+            for line in self.resp.iter_lines():
+                if self.stopped.is_set():
+                    return
+                received = self.last_received = time.time()
+                self.metrics.last_received = received
+                self.metrics.add(lines=1)
+                self._put((line, received))
+        except Exception as e:
+            error = e
+        finally:
+            # The end of the stream is never dropped.
+            while not self.stopped.is_set():
+                try:
+                    self.buffer.put((_DONE, error), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def _put(self, item):
+        buffer = self.buffer
+        try:
+            buffer.put_nowait(item)
+        except queue.Full:
+            if self.overflow == "drop-newest":
+                self.metrics.add(dropped=1)
+                return
+            if self.overflow == "drop-oldest":
+                try:
+                    buffer.get_nowait()
+                    self.metrics.add(dropped=1)
+                except queue.Empty:
+                    pass
+                buffer.put_nowait(item)
+            else:
+                started = time.time()
+                while not self.stopped.is_set():
+                    try:
+                        buffer.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                self.metrics.add(blocked_seconds=time.time() - started)
+
+        size = buffer.qsize()
+        self.metrics.buffer_size = size
+        if size > self.metrics.buffer_peak:
+            self.metrics.buffer_peak = size
+
+
+def backfill_minutes(gap_seconds):
+    """
+    The number of minutes of backfill needed to cover a gap in a stream,
+    which is capped at the most that the API allows.
+
+    Args:
+        gap_seconds (float): How long it has been since data was last
+            received from the stream.
+
+    Returns:
+        int: The number of minutes to backfill.
+    """
+    # allow a few seconds for the time taken to connect
+    minutes = max(1, math.ceil((gap_seconds + 5) / 60))
+    if minutes > MAX_BACKFILL_MINUTES:
+        log.warning(
+            "stream was disconnected for %.0f seconds, but only %s minutes can "
+            "be backfilled",
+            gap_seconds,
+            MAX_BACKFILL_MINUTES,
+        )
+        minutes = MAX_BACKFILL_MINUTES
+    return minutes
+
+
+class RecentIds:
+    """
+    The tweet ids delivered recently, for dropping tweets that a stream
+    delivers again after reconnecting or when backfilling. Ids are forgotten
+    once they are more than window_seconds older than the newest id seen,
+    going by the time in the ids themselves, or when there are more than
+    max_size of them.
+    """
+
+    def __init__(self, window_seconds=(MAX_BACKFILL_MINUTES + 1) * 60, max_size=500000):
+        # the time in a snowflake id is in milliseconds, shifted 22 bits
+        self.window = int(window_seconds * 1000) << 22
+        self.max_size = max_size
+        self.ids = set()
+        self.order = collections.deque()
+        self.newest = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, tweet_id):
+        """
+        Remember a tweet id.
+
+        Args:
+            tweet_id (str): The id of a delivered tweet.
+
+        Returns:
+            bool: False if the id was already seen.
+        """
+        tweet_id = int(tweet_id)
+        if tweet_id in self.ids:
+            return False
+
+        self.ids.add(tweet_id)
+        self.order.append(tweet_id)
+        self.newest = max(self.newest, tweet_id)
+
+        oldest = self.newest - self.window
+        order = self.order
+        while order and (len(order) > self.max_size or order[0] < oldest):
+            self.ids.discard(order.popleft())
+        return True
+
+
+class StreamWriter:
+    """
+    Call a write function for each item in a background thread, so that a
+    slow disk doesn't hold up reading the stream. Items are buffered up to
+    buffer_size, after which put waits for the writer to catch up.
+
+    Any exception raised by the write function is raised again by the next
+    call to put or close.
+    """
+
+    def __init__(self, write, buffer_size=1000, metrics=None):
+        self.write = write
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.metrics = metrics or StreamMetrics()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        """
+        Queue an item to be written.
+        """
+        self._check()
+        self.buffer.put(item)
+        self.metrics.write_buffer_size = self.buffer.qsize()
+
+    def close(self):
+        """
+        Wait for everything queued to be written, and stop the thread.
+        """
+        if self.thread.is_alive():
+            self.buffer.put(_DONE)
+            self.thread.join()
+        self._check()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.buffer.get()
+            if item is _DONE:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.write(item)
+                self.metrics.add(written=1)
+            except Exception as e:
+                self.error = e
+            self.metrics.write_buffer_size = self.buffer.qsize()
+
+
+class RotatingFile:
+    """
+    A file-like object which writes to a series of numbered segment files,
+    starting a new segment when the current one reaches max_bytes, has
+    max_lines lines, or reaches the end of a max_seconds interval of the
+    clock (so 3600 rotates on the hour). Segments can be compressed as they
+    are written with gzip or zstd (which needs the zstandard package).
+
+    For an output path of stream.jsonl the segments are stream-001.jsonl,
+    stream-002.jsonl and so on, numbered after any segments that already
+    exist. A segment is written to a .part file, which is renamed once it is
+    complete.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_bytes=None,
+        max_lines=None,
+        max_seconds=None,
+        compression=None,
+    ):
+        if compression not in (None, *COMPRESSION_EXTENSIONS):
+            raise ValueError(f"unknown compression: {compression}")
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError(
+                    "zstd compression needs the zstandard package, which can be "
+                    "installed with: pip install zstandard"
+                )
+            self.zstd = zstandard.ZstdCompressor()
+
+        self.name = path
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.max_seconds = max_seconds
+        self.compression = compression
+        self.segment = self._last_segment()
+        self.segment_path = None
+        self.raw = None
+        self.file = None
+
+    def write(self, text):
+        """
+        Write text to the current segment, starting a new one first if the
+        current one is complete.
+        """
+        if self.file is None or self._full():
+            self._rotate()
+        self.file.write(text.encode("utf-8"))
+        self.lines += text.count("\n")
+
+    def flush(self):
+        """
+        Flushing is left to the compressor, since flushing it for every line
+        would spoil the compression.
+        """
+        if self.file is not None and self.compression is None:
+            self.file.flush()
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        """
+        Complete the current segment.
+        """
+        if self.file is None:
+            return
+        self.file.close()
+        if self.raw is not self.file:
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+            self.raw.close()
+        os.replace(self.segment_path + ".part", self.segment_path)
+        log.info("completed stream segment %s", self.segment_path)
+        self.file = None
+
+    def _full(self):
+        if self.max_lines and self.lines >= self.max_lines:
+            return True
+        if self.max_bytes and self.raw.tell() >= self.max_bytes:
+            return True
+        if self.max_seconds and time.time() >= self.segment_end:
+            return True
+        return False
+
+    def _rotate(self):
+        self.close()
+        self.segment += 1
+        self.segment_path = self._segment_path(self.segment)
+        self.lines = 0
+        if self.max_seconds:
+            now = time.time()
+            self.segment_end = (now // self.max_seconds + 1) * self.max_seconds
+
+        self.raw = open(self.segment_path + ".part", "wb")
+        if self.compression == "gzip":
+            self.file = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        elif self.compression == "zstd":
+            self.file = self.zstd.stream_writer(self.raw, closefd=False)
+        else:
+            self.file = self.raw
+
+    def _segment_path(self, num):
+        path, ext = os.path.splitext(self.name)
+        return "{}-{:0>3}{}{}".format(
+            path, num, ext, COMPRESSION_EXTENSIONS.get(self.compression, "")
+        )
+
+    def _last_segment(self):
+        """
+        The number of the last segment written for the path before.
+        """
+        path, ext = os.path.splitext(self.name)
+        pattern = re.compile(re.escape(path) + r"-(\d+)" + re.escape(ext))
+        last = 0
+        for segment in glob.glob(glob.escape(path) + "-*" + glob.escape(ext) + "*"):
+            match = pattern.match(segment)
+            if match:
+                last = max(last, int(match.group(1)))
+        return last
+
+
+class RuleFiles:
+    """
+    Write each result from the filtered stream to a file for each of the
+    rules that it matched, named after the rule's tag (or its id if it has
+    no tag). For an output path of stream.jsonl the tweets matching a rule
+    tagged cats go to stream-cats.jsonl, and results that didn't match any
+    rules, like errors, go to stream-unmatched.jsonl.
+
+    Lines are batched for each file and written when there are batch_size of
+    them, and everything batched is written every max_delay seconds by a
+    background thread, so the tweets for a quiet rule aren't held back. Up
+    to max_open files are kept open, closing the least recently used.
+    """
+
+    def __init__(self, path, max_open=64, batch_size=100, max_delay=1.0):
+        self.name = path
+        self.max_open = max_open
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.files = collections.OrderedDict()
+        self.batches = collections.defaultdict(list)
+        self.paths = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self._path(_UNMATCHED, "unmatched")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, result):
+        """
+        Queue a result to be written to the files for its rules.
+
+        Args:
+            result (dict): A result from the filtered stream.
+        """
+        rules = result.get("matching_rules")
+        if rules is None:
+            rules = result.get("data", {}).get("matching_rules", [])
+
+        line = codec.dumps(result) + "\n"
+        # rules often share a tag, and the tweet only goes in its file once
+        keys = {}
+        for rule in rules:
+            tag = rule.get("tag")
+            key = ("tag", tag) if tag else ("id", rule.get("id"))
+            keys.setdefault(key, rule.get("id"))
+        if not keys:
+            # errors and other messages that aren't tweets
+            keys[_UNMATCHED] = None
+        with self.lock:
+            for key, rule_id in keys.items():
+                self._path(key, rule_id)
+                batch = self.batches[key]
+                batch.append(line)
+                if len(batch) >= self.batch_size:
+                    self._write(key)
+
+    def flush(self):
+        """
+        Write all the batched lines.
+        """
+        with self.lock:
+            for key in list(self.batches):
+                self._write(key)
+            for f in self.files.values():
+                f.flush()
+
+    def close(self):
+        """
+        Stop flushing in the background, write all the batched lines, and
+        close the files.
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+        with self.lock:
+            while self.files:
+                self.files.popitem()[1].close()
+
+    def _run(self):
+        while not self.stopped.wait(self.max_delay):
+            self.flush()
+
+    def _write(self, key):
+        batch = self.batches.pop(key, None)
+        if not batch:
+            return
+        f = self.files.get(key)
+        if f is None:
+            if len(self.files) >= self.max_open:
+                self.files.popitem(last=False)[1].close()
+            f = self.files[key] = open(self.paths[key], "a")
+        else:
+            self.files.move_to_end(key)
+        f.write("".join(batch))
+
+    def _path(self, key, rule_id):
+        """
+        The file for a tag or a rule id. When a tag would share a file with
+        another tag, or with a rule's id, the id of its rule is added to the
+        file name.
+        """
+        if key not in self.paths:
+            path, ext = os.path.splitext(self.name)
+            name = _file_name(key[1])
+            taken = set(self.paths.values())
+            candidate = f"{path}-{name}{ext}"
+            if candidate in taken:
+                candidate = f"{path}-{name}-{_file_name(rule_id)}{ext}"
+                number = 1
+                while candidate in taken:
+                    number += 1
+                    candidate = f"{path}-{name}-{_file_name(rule_id)}-{number}{ext}"
+                log.warning(
+                    "rule %s %s would share a file with another rule, writing it "
+                    "to %s",
+                    *key,
+                    candidate,
+                )
+            self.paths[key] = candidate
+        return self.paths[key]
+
+
+# The key of the file for results that didn't match any rules.
+_UNMATCHED = (None, "unmatched")
+
+
+def _file_name(value):
+    return re.sub(r"[^\w.-]+", "_", str(value)).strip("._") or "untagged"
+
+
+class MetricsReporter:
+    """
+    Log a snapshot of the stream metrics every interval seconds, and
+    optionally append it as a line of JSON to a file.
+    """
+
+    def __init__(self, metrics, interval=60, path=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.path = path
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        if interval > 0:
+            self.thread.start()
+
+    def report(self):
+        """
+        Log the current metrics.
+        """
+        snapshot = self.metrics.snapshot()
+        snapshot["time"] = round(time.time(), 3)
+        log.info("stream metrics: %s", json.dumps(snapshot))
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(snapshot) + "\n")
+
+    def close(self):
+        """
+        Stop reporting, after a final report.
+        """
+        self.stopped.set()
+        self.report()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
@@ -1,12 +1,16 @@
 import os
+import csv
+import json
 import pytz
 import twarc
 import dotenv
+import time
 import pytest
 import logging
 import pathlib
 import datetime
 import threading
+import collections
 
 from unittest import TestCase
 from twarc.version import version, user_agent
@@ -115,6 +119,113 @@ def test_search_recent(sort_order):
     assert 100 <= found_tweets <= 200
 
 
+def test_search_recent_prefetch(monkeypatch):
+    from twarc import client2, concurrency
+
+    threads = []
+
+    class RecordedPrefetch(concurrency.Prefetch):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            threads.append(self.thread)
+
+    monkeypatch.setattr(client2, "Prefetch", RecordedPrefetch)
+    T.prefetch = 2
+    pages = []
+    search = T.search_recent("politics")
+    for response_page in search:
+        pages.append(response_page)
+        if len(pages) == 3:
+            break
+    search.close()
+    T.prefetch = 0
+
+    # pages arrive in order, chained by their next_token
+    for page, next_page in zip(pages, pages[1:]):
+        assert page["meta"]["oldest_id"] > next_page["meta"]["newest_id"]
+
+    # the background fetching stops when the generator is closed
+    assert len(threads) == 1
+    threads[0].join(timeout=10)
+    assert not threads[0].is_alive()
+
+
+def test_prefetch_close_during_wait():
+    from twarc import concurrency
+
+    sent = []
+
+    def pages():
+        for i in range(3):
+            # a rate limit wait before each request
+            concurrency.sleep(0.5 if i else 0)
+            sent.append(i)
+            yield i
+
+    prefetch = concurrency.Prefetch(pages(), depth=1)
+    assert next(prefetch) == 0
+    time.sleep(0.1)
+    prefetch.close()
+    prefetch.thread.join(timeout=5)
+    assert not prefetch.thread.is_alive()
+    # closed while waiting to send the second request
+    assert sent == [0]
+
+
+def test_reconnect_once_for_shared_session(monkeypatch):
+    import threading
+    import requests
+
+    t = twarc.Twarc2(bearer_token="x")
+    client = t.client
+    barrier = threading.Barrier(4)
+    failed = set()
+    connects = []
+
+    def get(session, url, **kwargs):
+        thread = threading.current_thread()
+        if thread not in failed:
+            failed.add(thread)
+            # every thread is using the session when it fails
+            barrier.wait(timeout=5)
+            raise requests.exceptions.ConnectionError("connection reset")
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.url = url
+        return resp
+
+    connect = t.connect
+
+    def counted_connect():
+        connects.append(t.client)
+        connect()
+
+    monkeypatch.setattr(requests.Session, "get", get)
+    monkeypatch.setattr(t, "connect", counted_connect)
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+
+    responses = {}
+
+    def run(i):
+        resp = t.get(f"https://api.twitter.com/2/tweets?ids={i}")
+        responses[i] = (resp, t.last_response)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    # only the session that failed is replaced, and only once
+    assert connects == [client]
+    assert t.client is not client
+    assert len(responses) == 4
+    for i, (resp, last_response) in responses.items():
+        assert resp.status_code == 200
+        assert last_response is resp
+    assert t.last_response is None
+
+
 def test_counts_recent():
     found_counts = 0
 
@@ -166,6 +277,105 @@ def test_search_times():
     assert found
 
 
+def test_rate_limiter():
+    limiter = twarc.ratelimit.RateLimiter()
+
+    # the 1 request/second limit of the full archive search
+    url = "https://api.twitter.com/2/tweets/search/all"
+    waits = [limiter.reserve(url) for i in range(3)]
+    assert waits[0] == 0
+    assert 1 < waits[1] < waits[2] < 2.2
+
+    # requests are paced until the window resets once the limit is known,
+    # and IDs in the path share the same bucket
+    reset = int(time.time()) + 60
+    limiter.update(
+        "https://api.twitter.com/2/users/12/tweets",
+        {
+            "x-rate-limit-limit": "900",
+            "x-rate-limit-remaining": "1",
+            "x-rate-limit-reset": str(reset),
+        },
+    )
+    assert limiter.reserve("https://api.twitter.com/2/users/34/tweets") == 0
+    assert limiter.reserve("https://api.twitter.com/2/users/56/tweets") > 55
+
+    # a different endpoint is unaffected
+    assert limiter.reserve("https://api.twitter.com/2/users/12/mentions") == 0
+
+
+def test_search_all_sharded():
+    start_time = datetime.datetime(2021, 3, 1, tzinfo=pytz.utc)
+    end_time = datetime.datetime(2021, 3, 2, tzinfo=pytz.utc)
+
+    found = set()
+    for response in T.search_all("gouda", start_time=start_time, end_time=end_time):
+        found.update(t["id"] for t in response["data"])
+
+    sharded = set()
+    shards = set()
+    for shard, response in T.search_all_sharded(
+        "gouda", shards=3, start_time=start_time, end_time=end_time
+    ):
+        shards.add(shard)
+        sharded.update(t["id"] for t in response["data"])
+
+    assert shards == {0, 1, 2}
+    assert sharded == found
+
+
+def test_plan_shards():
+    start_time = datetime.datetime(2021, 3, 1, tzinfo=pytz.utc)
+    end_time = datetime.datetime(2021, 3, 8, tzinfo=pytz.utc)
+
+    boundaries, shard_counts = T.plan_shards(
+        "gouda", shards=3, start_time=start_time, end_time=end_time
+    )
+    assert boundaries[0] == start_time
+    assert boundaries[-1] == end_time
+    assert boundaries == sorted(boundaries)
+    assert len(shard_counts) == len(boundaries) - 1 <= 3
+
+    total = 0
+    for response in T.counts_all(
+        "gouda", start_time=start_time, end_time=end_time, granularity="day"
+    ):
+        total += response["meta"]["total_tweet_count"]
+    assert sum(shard_counts) == total
+
+
+def test_time_shards_short_range():
+    from twarc.client2 import _time_shards
+
+    start_time = datetime.datetime(2021, 3, 1, tzinfo=pytz.timezone("UTC"))
+    end_time = start_time + datetime.timedelta(seconds=3)
+    assert _time_shards(start_time, end_time, 4) == [start_time, end_time]
+
+    end_time = start_time + datetime.timedelta(seconds=25, microseconds=5)
+    boundaries = _time_shards(start_time, end_time, 8)
+    assert len(boundaries) == 3
+    shards = zip(boundaries, boundaries[1:])
+    assert all(end - start >= datetime.timedelta(seconds=10) for start, end in shards)
+
+
+def test_invalid_shard_options_keep_outfile(tmp_path):
+    from click.testing import CliRunner
+    from twarc.command2 import twarc2
+
+    out = tmp_path / "tweets.jsonl"
+    out.write_text("an earlier search\n")
+    for options in [
+        ["--archive", "--balance-shards", "day"],
+        ["--shards", "4"],
+        ["--archive", "--shards", "4", "--resume"],
+        ["--archive", "--shards", "4", "--since-id", "1"],
+    ]:
+        result = CliRunner().invoke(twarc2, ["search", *options, "gouda", str(out)])
+        assert result.exit_code == 2
+        assert "--shards" in result.output
+        assert out.read_text() == "an earlier search\n"
+
+
 def test_user_ids_lookup():
     users_found = 0
     users_not_found = 0
@@ -213,6 +423,408 @@ def test_tweet_lookup():
     assert tweets_found + tweets_not_found == 1000
 
 
+def test_tweet_lookup_concurrency():
+    sequential = [
+        [t["id"] for t in response.get("data", [])]
+        for response in T.tweet_lookup(range(1000, 2000))
+    ]
+
+    # pages come back in the same order as the input
+    concurrent = [
+        [t["id"] for t in response.get("data", [])]
+        for response in T.tweet_lookup(range(1000, 2000), concurrency=4)
+    ]
+    assert concurrent == sequential
+
+    # or in whatever order they complete, but with the same tweets
+    unordered = [
+        [t["id"] for t in response.get("data", [])]
+        for response in T.tweet_lookup(range(1000, 2000), concurrency=4, ordered=False)
+    ]
+    assert sorted(unordered) == sorted(sequential)
+
+
+def test_hydrate_resume(tmp_path):
+    from click.testing import CliRunner
+    from twarc.command2 import twarc2
+
+    ids = tmp_path / "ids.txt"
+    ids.write_text("\n".join(str(i) for i in range(1000, 1250)) + "\n")
+    out = tmp_path / "tweets.jsonl"
+    journal = tmp_path / "tweets.jsonl.journal"
+
+    # pretend the first two batches were hydrated before an interruption
+    runner = CliRunner()
+    result = runner.invoke(twarc2, ["hydrate", str(ids), str(out)])
+    assert result.exit_code == 0
+    assert not journal.exists()
+    pages = out.read_text().splitlines()
+    size = len(pages[0]) + len(pages[1]) + 2
+    offset = len("".join(f"{i}\n" for i in range(1000, 1200)))
+    journal.write_text(f"{offset} {size} 200\n")
+    out.write_text(pages[0] + "\n" + pages[1] + "\n" + "partial")
+
+    result = runner.invoke(twarc2, ["hydrate", "--resume", str(ids), str(out)])
+    assert result.exit_code == 0
+    resumed = out.read_text().splitlines()
+    assert len(resumed) == 3
+    assert resumed[:2] == pages[:2]
+    assert not journal.exists()
+
+
+def test_search_resume(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+    from twarc.command2 import twarc2, SearchState
+
+    out = tmp_path / "tweets.jsonl"
+
+    # keep the state of a finished search around to resume it
+    monkeypatch.setattr(SearchState, "remove_all", lambda outfile: None)
+    runner = CliRunner()
+    result = runner.invoke(twarc2, ["search", "--limit", "200", "blue", str(out)])
+    assert result.exit_code == 0
+    state_files = list(tmp_path.glob("tweets.jsonl.*.state"))
+    assert len(state_files) == 1
+    state = json.loads(state_files[0].read_text())
+    assert state["query"] == "blue"
+    assert state["count"] >= 200
+    assert state["size"] == out.stat().st_size
+
+    # an expired next_token falls back to continuing from the oldest id
+    state["next_token"] = "expired"
+    state_files[0].write_text(json.dumps(state))
+    monkeypatch.undo()
+    result = runner.invoke(
+        twarc2, ["search", "--resume", "--limit", "300", "blue", str(out)]
+    )
+    assert result.exit_code == 0
+    pages = [json.loads(line) for line in out.read_text().splitlines()]
+    ids = [int(t["id"]) for page in pages for t in page["data"]]
+    assert len(ids) >= 300
+    assert len(ids) == len(set(ids))
+    assert min(ids[state["count"] :]) < int(state["oldest_id"])
+    assert not list(tmp_path.glob("tweets.jsonl.*.state"))
+
+
+def test_searches_concurrency(tmp_path):
+    from click.testing import CliRunner
+    from twarc.command2 import twarc2
+
+    queries = tmp_path / "queries.txt"
+    queries.write_text("blue\nred\n\nblue\ngreen\n")
+    out = tmp_path / "tweets.jsonl"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        twarc2,
+        ["searches", "--concurrency", "3", "--limit", "100", str(queries), str(out)],
+    )
+    assert result.exit_code == 0
+    found = collections.Counter()
+    for line in out.read_text().splitlines():
+        for tweet in json.loads(line)["data"]:
+            found.update(tweet["matching_queries"])
+    assert set(found) == {"blue", "red", "green"}
+    assert all(count >= 100 for count in found.values())
+
+    result = runner.invoke(
+        twarc2,
+        [
+            "searches",
+            "--concurrency",
+            "2",
+            "--query-files",
+            "--limit",
+            "100",
+            str(queries),
+            str(out),
+        ],
+    )
+    assert result.exit_code == 0
+    assert len(list(tmp_path.glob("tweets-00?.jsonl"))) == 3
+    assert not list(tmp_path.glob("*.state"))
+
+
+def test_search_pages_combined_limit():
+    from twarc.command2 import _search_pages
+
+    requested = []
+
+    def pages():
+        for i in range(100):
+            requested.append(i)
+            # dogs only turn up once in a while
+            text = "dogs" if i % 20 == 0 else "cats"
+            yield {"data": [{"id": str(1000 - i), "text": text}] * 10}
+
+    matched = collections.Counter()
+    results = list(
+        _search_pages(
+            0,
+            pages(),
+            limit=20,
+            tags=["cats", "dogs"],
+            combined=["cats", "dogs"],
+            matched=matched,
+        )
+    )
+    # the search stops when it has as many tweets as both queries could need
+    assert len(requested) == 4
+    assert results[-1] == (0, None)
+    assert matched == {"cats": 30, "dogs": 10}
+
+
+def test_searches_combined_concurrency(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+    from twarc.command2 import twarc2
+    from twarc.queries import Query
+
+    # dogs are rare, so they are searched for on their own
+    tweets = [
+        {"id": str(i), "text": "cats" if i % 5 else "dogs"} for i in range(1000, 0, -1)
+    ]
+
+    def search_recent(self, query, until_id=None, **kwargs):
+        q = Query(query)
+        found = [
+            t
+            for t in tweets
+            if q.matches(t) and (until_id is None or int(t["id"]) < int(until_id))
+        ]
+        for i in range(0, len(found), 10):
+            page = found[i : i + 10]
+            yield {"data": page, "meta": {"oldest_id": page[-1]["id"]}}
+
+    monkeypatch.setattr(twarc.Twarc2, "search_recent", search_recent)
+    monkeypatch.setattr(twarc.Twarc2, "connect", lambda self: None)
+
+    queries = tmp_path / "queries.txt"
+    queries.write_text("cats\ndogs\nmice\n")
+    out = tmp_path / "tweets.jsonl"
+    result = CliRunner().invoke(
+        twarc2,
+        [
+            "searches",
+            "--combine-queries",
+            "--concurrency",
+            "2",
+            "--limit",
+            "30",
+            "--hide-progress",
+            str(queries),
+            str(out),
+        ],
+    )
+    assert result.exit_code == 0
+    found = collections.Counter()
+    ids = []
+    for line in out.read_text().splitlines():
+        for tweet in json.loads(line)["data"]:
+            ids.append(tweet["id"])
+            found.update(tweet["matching_queries"])
+    assert len(ids) == len(set(ids))
+    assert found["cats"] >= 30 and found["dogs"] >= 30
+
+
+def test_pack_queries():
+    from twarc.queries import pack_queries, join_queries
+
+    queries = ["a" * 10, "b" * 40, "c" * 30, "d" * 5, "e" * 50]
+    groups = pack_queries(queries, 60)
+    assert sorted(q for g in groups for q in g) == sorted(queries)
+    assert len(groups) == 3
+    assert all(len(join_queries(g)) < 60 for g in groups)
+
+    # queries are put where they add the fewest requests
+    volumes = {"catcat": 950, "mouse": 30, "dog": 60}
+    assert pack_queries(list(volumes), 18) == [["catcat", "dog"], ["mouse"]]
+    groups = pack_queries(list(volumes), 18, volumes)
+    assert groups == [["catcat"], ["mouse", "dog"]]
+
+
+def test_query_matches():
+    from twarc.queries import Query, tag_matching_queries
+
+    response = {
+        "data": [
+            {
+                "id": "2",
+                "text": "RT @deray: Black Lives Matter…",
+                "author_id": "1",
+                "lang": "en",
+                "referenced_tweets": [{"type": "retweeted", "id": "3"}],
+            },
+            {"id": "4", "text": "a tweet about cats", "author_id": "5"},
+        ],
+        "includes": {
+            "users": [{"id": "1", "username": "Example"}],
+            "tweets": [
+                {
+                    "id": "3",
+                    "text": "Black Lives Matter #blm",
+                    "entities": {"hashtags": [{"tag": "BLM"}]},
+                }
+            ],
+        },
+    }
+    tweet = response["data"][0]
+    includes = response["includes"]
+
+    assert Query('"lives matter"').matches(tweet, includes)
+    assert not Query('"matter lives"').matches(tweet, includes)
+    assert Query("#blm from:example").matches(tweet, includes)
+    assert not Query("#blm -is:retweet").matches(tweet, includes)
+    assert Query("(cats OR black) lang:en").matches(tweet, includes)
+    assert not Query("cats OR dogs").matches(tweet, includes)
+    # operators that can't be checked locally are assumed to match
+    assert Query("black place:nyc").matches(tweet, includes)
+    # and so are empty queries and groups
+    for query in ["", "()", "cats OR", "(cats OR)", "dogs ()"]:
+        Query(query)
+    assert Query("").matches(tweet, includes)
+    assert Query("cats OR").matches(tweet, includes)
+    assert not Query("dogs ()").matches(tweet, includes)
+
+    queries = [Query("#blm"), Query("cats"), Query("dogs")]
+    tag_matching_queries(response, queries)
+    assert response["data"][0]["matching_queries"] == ["#blm"]
+    assert response["data"][1]["matching_queries"] == ["cats"]
+
+
+def test_credential_pool():
+    pooled = twarc.Twarc2(
+        consumer_key=consumer_key,
+        consumer_secret=consumer_secret,
+        credentials=[{"bearer_token": bearer_token}],
+    )
+
+    tweets_found = 0
+    for response in pooled.tweet_lookup(range(1000, 1400)):
+        tweets_found += len(response.get("data", []))
+    assert tweets_found >= 1
+
+    # requests were spread over both sets of credentials
+    keys = {key for key, endpoint in pooled.rate_limiter.buckets}
+    assert keys == {0, 1}
+
+    with pytest.raises(ValueError):
+        twarc.Twarc2(
+            bearer_token=bearer_token,
+            credentials=[
+                {
+                    "consumer_key": consumer_key,
+                    "consumer_secret": consumer_secret,
+                    "access_token": access_token,
+                    "access_token_secret": access_token_secret,
+                }
+            ],
+        )
+
+
+def test_async_search_and_lookup():
+    pytest.importorskip("httpx")
+    import asyncio
+
+    async def collect():
+        async with twarc.AsyncTwarc2(
+            consumer_key=consumer_key, consumer_secret=consumer_secret
+        ) as t:
+            # paginate a search and a lookup at the same time on one client
+            async def search():
+                found = 0
+                async for page in t.search_recent("politics"):
+                    found += len(page["data"])
+                    if found >= 200:
+                        break
+                return found
+
+            async def lookup():
+                found = 0
+                async for page in t.tweet_lookup(range(1000, 1200)):
+                    found += len(page.get("data", [])) + len(
+                        [e for e in page["errors"] if e["resource_type"] == "tweet"]
+                    )
+                return found
+
+            return await asyncio.gather(search(), lookup())
+
+    searched, looked_up = asyncio.run(collect())
+    assert 100 <= searched <= 200
+    assert looked_up == 200
+
+
+def test_async_transport_error_keeps_client(monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    import asyncio
+
+    async def get_all():
+        t = twarc.AsyncTwarc2(bearer_token="x")
+        await t.connect()
+        client = t.client
+        sent = []
+
+        async def send(request, stream=False):
+            sent.append(request)
+            if len(sent) == 1:
+                raise httpx.ConnectError("connection reset")
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={"data": []}, request=request)
+
+        monkeypatch.setattr(client, "send", send)
+        url = "https://api.twitter.com/2/tweets"
+        responses = await asyncio.gather(
+            *[t.get(url, params={"ids": str(i)}) for i in range(5)]
+        )
+        # the error is retried on the client that the other requests share
+        assert t.client is client
+        assert not client.is_closed
+        await t.close()
+        return responses
+
+    responses = asyncio.run(get_all())
+    assert [resp.status_code for resp in responses] == [200] * 5
+
+
+def test_async_sign_after_rate_limit_wait(monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    import asyncio
+
+    async def get():
+        t = twarc.AsyncTwarc2(
+            consumer_key="a",
+            consumer_secret="b",
+            access_token="c",
+            access_token_secret="d",
+        )
+        await t.connect()
+        events = []
+        sign = t.oauth1.sign
+
+        def signed(*args, **kwargs):
+            events.append("sign")
+            return sign(*args, **kwargs)
+
+        async def send(request, stream=False):
+            events.append("send")
+            return httpx.Response(200, json={"data": []}, request=request)
+
+        monkeypatch.setattr(t.oauth1, "sign", signed)
+        monkeypatch.setattr(t.client, "send", send)
+        monkeypatch.setattr(t.rate_limiter, "reserve", lambda url: 0.01)
+        sleep = asyncio.sleep
+
+        async def wait(seconds):
+            events.append("wait")
+            await sleep(seconds)
+
+        monkeypatch.setattr(asyncio, "sleep", wait)
+        await t.get("https://api.twitter.com/2/tweets", params={"ids": "1"})
+        await t.close()
+        return events
+
+    assert asyncio.run(get()) == ["wait", "sign", "send"]
+
+
 # Alas, fetching the stream in GitHub action yields a 400 HTTP error
 # maybe this will go away since it used to work fine.
 
@@ -274,6 +886,228 @@ def test_stream():
     assert "data" not in rules
 
 
+class FakeStreamResponse:
+    """
+    Pretends to be a streaming response, delivering the given lines and then
+    waiting to be closed like an idle connection, or ending.
+    """
+
+    url = "https://api.twitter.com/2/tweets/sample/stream"
+
+    def __init__(self, lines, end=False):
+        self.lines = lines
+        self.end = end
+        self.closed = threading.Event()
+
+    def iter_lines(self):
+        for line in self.lines:
+            if self.closed.is_set():
+                return
+            yield line
+        if not self.end:
+            self.closed.wait()
+
+    def close(self):
+        self.closed.set()
+
+
+def test_stream_reader_overflow():
+    from twarc.stream import StreamReader, StreamMetrics
+
+    lines = [str(i).encode() for i in range(100)]
+
+    for overflow, first in [("drop-oldest", b"90"), ("drop-newest", b"0")]:
+        metrics = StreamMetrics()
+        reader = StreamReader(FakeStreamResponse(lines), 10, overflow, metrics)
+        while metrics.lines < 100:
+            time.sleep(0.01)
+        assert next(reader) == first
+        assert metrics.dropped == 90
+        assert metrics.buffer_peak == 10
+        reader.close()
+
+    # nothing is lost when blocking, the reader waits for space instead
+    metrics = StreamMetrics()
+    reader = StreamReader(FakeStreamResponse(lines), 10, "block", metrics)
+    time.sleep(0.2)
+    assert [next(reader) for _ in range(100)] == lines
+    assert metrics.dropped == 0
+    assert metrics.blocked_seconds > 0
+    reader.close()
+
+
+def test_stream_stall():
+    from twarc.stream import StreamReader, StreamMetrics, StreamStalled
+
+    # tweets created a second before they are received
+    tweet_id = str((int(time.time() * 1000) - 1000 - 1288834974657) << 22)
+
+    metrics = StreamMetrics()
+    lines = [b"", tweet_id.encode(), b""]
+    reader = StreamReader(FakeStreamResponse(lines), metrics=metrics, stall_timeout=0.2)
+    for line in reader:
+        if line:
+            metrics.tweet(line.decode(), reader.received)
+        else:
+            metrics.keepalive(reader.received)
+        if metrics.keepalives == 2:
+            break
+
+    # the connection stays open, but nothing more arrives
+    started = time.time()
+    with pytest.raises(StreamStalled):
+        next(reader)
+    assert 0.1 < time.time() - started < 1
+    reader.close()
+
+    snapshot = metrics.snapshot()
+    assert snapshot["stalls"] == 1
+    assert snapshot["tweets"] == 1
+    assert 1 <= snapshot["lag_seconds"] < 2
+    assert snapshot["keepalive_gap_seconds"] < 1
+    assert snapshot["idle_seconds"] >= 0.2
+    assert snapshot["tweets_per_second"] > 0
+
+
+def test_stream_dedupe(monkeypatch):
+    from twarc.stream import RecentIds, StreamMetrics
+
+    # ids a second apart
+    ids = [str(1500000000000000000 + (i * 1000 << 22)) for i in range(20)]
+
+    recent = RecentIds(window_seconds=5)
+    assert all(recent.add(i) for i in ids[:10])
+    assert not recent.add(ids[9])
+    assert len(recent) == 6
+
+    # the second connection delivers some of the same tweets again
+    connections = [ids[:10], ids[5:15]]
+
+    def fake_get(url, params=None, stream=False):
+        lines = [json.dumps({"data": {"id": i}}).encode() for i in connections[0]]
+        connections.pop(0)
+        if not connections:
+            lines.append(b'{"errors": [{"disconnect_type": "stop"}]}')
+        return FakeStreamResponse(lines, end=bool(connections))
+
+    client = twarc.Twarc2(bearer_token="x", metadata=False)
+    monkeypatch.setattr(client, "get", fake_get)
+    metrics = StreamMetrics()
+    event = threading.Event()
+    delivered = []
+    for result in client._stream("url", {}, event, False, metrics=metrics):
+        if "data" not in result:
+            break
+        delivered.append(result["data"]["id"])
+
+    assert delivered == ids[:15]
+    assert metrics.duplicates == 5
+    assert metrics.connections == 2
+
+
+def test_stream_backfill(monkeypatch):
+    from twarc.stream import backfill_minutes
+
+    assert backfill_minutes(20) == 1
+    assert backfill_minutes(130) == 3
+    assert backfill_minutes(3600) == 5
+
+    requested = []
+
+    def fake_get(url, params=None, stream=False):
+        requested.append(params.get("backfill_minutes"))
+        lines = [json.dumps({"data": {"id": str(len(requested))}}).encode()]
+        if len(requested) == 2:
+            lines.append(b'{"errors": [{"disconnect_type": "stop"}]}')
+        return FakeStreamResponse(lines, end=True)
+
+    client = twarc.Twarc2(bearer_token="x", metadata=False)
+    monkeypatch.setattr(client, "get", fake_get)
+    event = threading.Event()
+    for result in client._stream("url", {"backfill_minutes": 0}, event, False):
+        if "data" not in result:
+            break
+
+    # no backfill at the start, then enough to cover the disconnection
+    assert requested == [None, 1]
+
+
+def test_stream_rotate(tmp_path):
+    import gzip
+    from twarc.stream import RotatingFile
+
+    path = str(tmp_path / "stream.jsonl")
+    (tmp_path / "stream-002.jsonl.gz").write_bytes(b"")
+
+    out = RotatingFile(path, max_lines=2, compression="gzip")
+    for i in range(5):
+        out.write(json.dumps({"id": str(i)}) + "\n")
+    assert (tmp_path / "stream-005.jsonl.gz.part").exists()
+    out.close()
+
+    segments = sorted(f for f in os.listdir(tmp_path) if f != "stream-002.jsonl.gz")
+    assert segments == [
+        "stream-003.jsonl.gz",
+        "stream-004.jsonl.gz",
+        "stream-005.jsonl.gz",
+    ]
+    lines = []
+    for segment in segments:
+        with gzip.open(tmp_path / segment, "rt") as f:
+            lines.extend(json.loads(line)["id"] for line in f)
+    assert lines == ["0", "1", "2", "3", "4"]
+
+
+def test_stream_partition_by_rule(tmp_path):
+    from twarc.stream import RuleFiles
+
+    out = RuleFiles(str(tmp_path / "stream.jsonl"), max_open=1, batch_size=2)
+    for i in range(5):
+        rules = [{"id": "1", "tag": "cats"}]
+        if i % 2 == 0:
+            rules.append({"id": "2", "tag": "dogs & puppies"})
+        if i == 4:
+            rules.append({"id": "3"})
+            rules.append({"id": "4", "tag": "cats"})
+        out.write({"data": {"id": str(i)}, "matching_rules": rules})
+    out.write({"errors": [{"title": "operational-disconnect"}]})
+    assert len(out.files) == 1
+    out.close()
+
+    def ids(name):
+        with open(tmp_path / name) as f:
+            return [json.loads(line)["data"]["id"] for line in f]
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "stream-3.jsonl",
+        "stream-cats.jsonl",
+        "stream-dogs_puppies.jsonl",
+        "stream-unmatched.jsonl",
+    ]
+    assert ids("stream-cats.jsonl") == ["0", "1", "2", "3", "4"]
+    assert ids("stream-dogs_puppies.jsonl") == ["0", "2", "4"]
+    assert ids("stream-3.jsonl") == ["4"]
+    with open(tmp_path / "stream-unmatched.jsonl") as f:
+        assert "errors" in json.loads(f.read())
+
+    # batches for quiet rules are written after max_delay
+    out = RuleFiles(str(tmp_path / "quiet.jsonl"), max_delay=0.05)
+    out.write({"data": {"id": "10"}, "matching_rules": [{"id": "11"}]})
+    time.sleep(0.5)
+    assert ids("quiet-11.jsonl") == ["10"]
+    out.close()
+
+    # tags that would share a file get their rule's id added
+    out = RuleFiles(str(tmp_path / "shared.jsonl"))
+    out.write({"data": {"id": "5"}, "matching_rules": [{"id": "6", "tag": "a b"}]})
+    out.write({"data": {"id": "7"}, "matching_rules": [{"id": "8", "tag": "a/b"}]})
+    out.write({"data": {"id": "9"}, "matching_rules": [{"id": "a_b"}]})
+    out.close()
+    assert ids("shared-a_b.jsonl") == ["5"]
+    assert ids("shared-a_b-8.jsonl") == ["7"]
+    assert ids("shared-a_b-a_b.jsonl") == ["9"]
+
+
 def test_timeline():
     """
     Test the user timeline endpoints.
@@ -504,6 +1338,233 @@ def test_ensure_flattened():
         twarc.expansions.ensure_flattened([[{"data": {"fake": "list_of_lists"}}]])
 
 
+def test_iter_flattened():
+    users = [{"id": "1", "username": "alice"}]
+    page = {
+        "data": [{"id": str(i), "author_id": "1"} for i in range(3)],
+        "includes": {"users": users},
+        "meta": {"result_count": 3},
+        "__twarc": {"url": "https://api.twitter.com/2/tweets/search/recent"},
+    }
+    line = json.dumps(page)
+
+    tweets = twarc.expansions.iter_flattened(line)
+    tweet = next(tweets)
+    assert tweet["author"]["username"] == "alice"
+    assert "__twarc" in tweet
+    assert [tweet] + list(tweets) == twarc.expansions.ensure_flattened(page)
+
+    lazy = list(twarc.expansions.iter_flattened(line.encode("utf8"), lazy=True))
+    assert [t["author"]["id"] for t in lazy] == ["1", "1", "1"]
+
+    # anything other than a page of tweets is flattened as before
+    line = json.dumps(page["data"])
+    assert list(twarc.expansions.iter_flattened(line)) == page["data"]
+
+    # a page that lost the end of its tweets, or a comma between them
+    line = json.dumps(page)
+    truncated = line[: line.index('{"id": "1"')] + line[line.index('"includes"') :]
+    missing_comma = line.replace('}, {"id": "1"', '} {"id": "1"')
+    for line in [truncated, missing_comma]:
+        with pytest.raises(json.JSONDecodeError):
+            list(twarc.expansions.iter_flattened(line))
+
+
+def test_flatten_processes(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+    from twarc import command2
+
+    infile = tmp_path / "responses.jsonl"
+    with open(infile, "w") as f:
+        for i in range(50):
+            tweets = [{"id": f"{i}{j}", "author_id": "1"} for j in range(10)]
+            users = [{"id": "1", "username": "alice"}]
+            f.write(json.dumps({"data": tweets, "includes": {"users": users}}) + "\n")
+
+    # flatten a few lines at a time
+    monkeypatch.setattr(command2, "FLATTEN_CHUNK_SIZE", 2000)
+    runner = CliRunner()
+    for processes in ["1", "3"]:
+        outfile = tmp_path / f"flat{processes}.jsonl"
+        args = ["flatten", "--processes", processes, str(infile), str(outfile)]
+        result = runner.invoke(command2.twarc2, args)
+        assert result.exit_code == 0
+
+    flat = (tmp_path / "flat3.jsonl").read_text()
+    assert flat == (tmp_path / "flat1.jsonl").read_text()
+    assert len(flat.splitlines()) == 500
+    assert json.loads(flat.splitlines()[0])["author"]["username"] == "alice"
+
+
+def test_export_parquet(tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    from click.testing import CliRunner
+    from twarc import command2
+
+    infile = tmp_path / "responses.jsonl"
+    with open(infile, "w") as f:
+        for i in range(5):
+            tweets = [
+                {
+                    "id": f"{i}{j}",
+                    "author_id": "1",
+                    "created_at": "2022-05-01T12:00:00.000Z",
+                    "lang": "en",
+                    "entities": {"hashtags": [{"start": 0, "end": 4, "tag": "cat"}]},
+                }
+                for j in range(10)
+            ]
+            users = [{"id": "1", "username": "alice"}]
+            f.write(json.dumps({"data": tweets, "includes": {"users": users}}) + "\n")
+
+    outfile = tmp_path / "tweets.parquet"
+    args = ["export", "--row-group-size", "20", str(infile), str(outfile)]
+    result = CliRunner().invoke(command2.twarc2, args)
+    assert result.exit_code == 0
+
+    f = parquet.ParquetFile(outfile)
+    assert f.metadata.num_rows == 50
+    assert f.metadata.num_row_groups == 3
+    assert "public_metrics" in f.schema_arrow.names
+
+    tweet = f.read().to_pylist()[0]
+    assert tweet["id"] == "00"
+    assert tweet["author"]["username"] == "alice"
+    assert tweet["created_at"].year == 2022
+    assert tweet["entities"]["hashtags"][0]["tag"] == "cat"
+    assert tweet["geo"] is None
+
+
+def test_export_csv(tmp_path):
+    from click.testing import CliRunner
+    from twarc import command2
+
+    infile = tmp_path / "responses.jsonl"
+    with open(infile, "w") as f:
+        for i in range(5):
+            tweets = [
+                {
+                    "id": f"{i}{j}",
+                    "author_id": "1",
+                    "created_at": "2022-05-01T12:00:00.000Z",
+                    "text": "#cat\nmeow",
+                    "entities": {"hashtags": [{"start": 0, "end": 4, "tag": "cat"}]},
+                    "referenced_tweets": [{"type": "quoted", "id": "2"}],
+                }
+                for j in range(10)
+            ]
+            includes = {
+                "users": [{"id": "1", "username": "alice"}],
+                "tweets": [{"id": "2", "author_id": "1", "text": "hi"}],
+            }
+            f.write(json.dumps({"data": tweets, "includes": includes}) + "\n")
+
+    outfile = tmp_path / "tweets.csv"
+    args = ["export", "--format", "csv", str(infile), str(outfile)]
+    result = CliRunner().invoke(command2.twarc2, args)
+    assert result.exit_code == 0
+
+    with open(outfile, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 50
+    assert rows[0]["id"] == "00"
+    assert rows[0]["author.username"] == "alice"
+    assert rows[0]["quoted_username"] == "alice"
+    assert rows[0]["referenced_tweets.quoted.id"] == "2"
+    assert rows[0]["text"] == r"#cat\nmeow"
+    assert json.loads(rows[0]["entities.hashtags"]) == ["#cat"]
+    assert rows[0]["geo.place_id"] == ""
+
+    # the same rows when exported in parallel
+    processes = tmp_path / "processes.csv"
+    args = [
+        "export",
+        "--format",
+        "csv",
+        "--processes",
+        "3",
+        str(infile),
+        str(processes),
+    ]
+    result = CliRunner().invoke(command2.twarc2, args)
+    assert result.exit_code == 0
+    assert processes.read_bytes() == outfile.read_bytes()
+
+    args = [
+        "export",
+        "--format",
+        "csv",
+        "--columns",
+        "id,created_at",
+        "--date-format",
+        "%Y-%m-%d %H:%M",
+        str(infile),
+    ]
+    result = CliRunner().invoke(command2.twarc2, args)
+    assert result.exit_code == 0
+    assert result.output.splitlines()[:2] == ["id,created_at", "00,2022-05-01 12:00"]
+
+
+def test_codec():
+    from twarc import codec
+
+    data = {"id": "1", "text": "café ✨", "n": [1, 2.5, None, True]}
+    text = json.dumps(data)
+
+    try:
+        for backend in codec.BACKENDS:
+            try:
+                codec.configure(backend)
+            except ValueError:
+                continue
+            assert codec.loads(text) == data
+            assert codec.loads(text.encode("utf8")) == data
+            assert codec.loads('{"n": NaN}')["n"] != 0
+            assert codec.dumps(data) == text
+            assert codec.dumps(data, indent=2) == json.dumps(data, indent=2)
+            with pytest.raises(codec.JSONDecodeError):
+                codec.loads("{nope")
+
+        codec.configure("auto", compact_output=True)
+        assert json.loads(codec.dumps(data)) == data
+    finally:
+        codec.configure()
+
+
+def test_raw_page():
+    from twarc.client2 import RawPage
+
+    page = {
+        "data": [{"id": "2", "text": 'a "meta": {} here ✨'}],
+        "includes": {"users": [{"id": "1", "username": "alice"}]},
+        "meta": {"result_count": 1, "next_token": "abc", "newest_id": "2"},
+    }
+    content = json.dumps(page, separators=(",", ":"), ensure_ascii=False)
+
+    raw = RawPage(content.encode("utf8"), "https://api.twitter.com/2/tweets")
+    assert "data" in raw
+    assert raw["meta"] == page["meta"]
+    assert raw.get("meta", {}).get("next_token") == "abc"
+    assert raw.result_count == 1
+    assert raw.text.startswith(content[:-1])
+    decoded = json.loads(raw.text)
+    assert decoded["__twarc"]["url"] == "https://api.twitter.com/2/tweets"
+    assert {k: v for k, v in decoded.items() if k != "__twarc"} == page
+
+    # meta isn't last, so the page is decoded to find it
+    content = json.dumps({"meta": {"result_count": 0}, "errors": []}, indent=2)
+    raw = RawPage(content.encode("utf8"))
+    assert raw["meta"] == {"result_count": 0}
+    assert "data" not in raw
+    assert "\n" not in raw.text
+
+    # lookups don't have meta
+    raw = RawPage(b'{"errors":[{"value":"1"}]}', ids=["1"])
+    assert raw.get("meta") is None
+    assert "data" not in raw
+    assert raw.ids == ["1"]
+
+
 def test_ensure_flattened_errors():
     """
     Test that ensure_flattened doesn't return tweets for API responses that only contain errors.
@@ -512,6 +1573,68 @@ def test_ensure_flattened_errors():
     assert twarc.expansions.ensure_flattened(data) == []
 
 
+def test_flatten_expansion_points():
+    users = [
+        {"id": "1", "username": "alice", "pinned_tweet_id": "10"},
+        {
+            "id": "2",
+            "username": "bob",
+            "entities": {"description": {"mentions": [{"username": "alice"}]}},
+        },
+    ]
+    quoted = {"id": "10", "text": "hi", "author_id": "2"}
+    response = {
+        "data": [
+            {
+                "id": "20",
+                "text": "@bob look",
+                "author_id": "1",
+                "in_reply_to_user_id": "2",
+                "referenced_tweets": [{"type": "quoted", "id": "10"}],
+                "attachments": {"media_keys": ["3_1"], "poll_ids": ["5"]},
+                "entities": {"mentions": [{"start": 0, "end": 4, "username": "bob"}]},
+                "geo": {"place_id": "p1"},
+                "public_metrics": {"like_count": 1},
+                "note_tweet": {"entities": {"mentions": [{"username": "alice"}]}},
+            }
+        ],
+        "includes": {
+            "users": users,
+            "tweets": [quoted],
+            "media": [{"media_key": "3_1", "type": "photo"}],
+            "polls": [{"id": "5", "options": []}],
+            "places": [{"id": "p1", "full_name": "Somewhere"}],
+        },
+    }
+    original = json.dumps(response)
+    lazy = twarc.expansions.flatten(response, lazy=True)
+    assert lazy[0]["author"]["username"] == "alice"
+    assert lazy[0]["referenced_tweets"][0]["author"]["username"] == "bob"
+    assert json.dumps(response) == original
+
+    tweet = twarc.expansions.flatten(response)[0]
+    assert json.dumps(lazy, default=dict) == json.dumps([tweet])
+    assert lazy[0].to_dict() == tweet
+
+    assert tweet["author"]["username"] == "alice"
+    assert tweet["in_reply_to_user"]["username"] == "bob"
+    assert tweet["referenced_tweets"][0]["type"] == "quoted"
+    assert tweet["referenced_tweets"][0]["author"]["username"] == "bob"
+    assert tweet["attachments"]["media"] == [{"media_key": "3_1", "type": "photo"}]
+    assert tweet["attachments"]["poll"]["id"] == "5"
+    assert tweet["entities"]["mentions"][0]["id"] == "2"
+    assert tweet["entities"]["mentions"][0]["start"] == 0
+    assert tweet["geo"] == {"place_id": "p1", "id": "p1", "full_name": "Somewhere"}
+    assert tweet["public_metrics"] == {"like_count": 1}
+    assert tweet["note_tweet"]["entities"]["mentions"][0]["id"] == "1"
+
+    # users have pinned tweets and mentions in their descriptions expanded
+    user_response = {"data": users, "includes": {"users": users, "tweets": [quoted]}}
+    alice, bob = twarc.expansions.flatten(user_response)
+    assert alice["pinned_tweet"]["text"] == "hi"
+    assert bob["entities"]["description"]["mentions"][0]["id"] == "1"
+
+
 def test_ensure_user_id():
     """
     Test _ensure_user_id's ability to discriminate correctly between IDs and
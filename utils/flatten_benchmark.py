@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+Time twarc.expansions.flatten on pages of tweets, and compare it with the
+recursive implementation it replaced, checking that both give the same
+output. Pages are read from a file of API responses, like the output of
+twarc2 search, or generated if no file is given.
+
+Example usage:
+utils/flatten_benchmark.py tweets.jsonl
+utils/flatten_benchmark.py --pages 200
+"""
+
+import copy
+import json
+import time
+import random
+import argparse
+
+from collections import defaultdict
+
+from twarc.expansions import extract_includes, flatten
+
+
+def flatten_recursive(response):
+    """
+    The recursive flatten that looked inside every field of every tweet.
+    """
+    includes_users = defaultdict(
+        lambda: {},
+        {
+            **extract_includes(response, "users", "id"),
+            **extract_includes(response, "users", "username"),
+        },
+    )
+    includes_media = extract_includes(response, "media", "media_key")
+    includes_polls = extract_includes(response, "polls")
+    includes_places = extract_includes(response, "places")
+    includes_tweets = extract_includes(response, "tweets")
+
+    def expand_payload(payload):
+        if isinstance(payload, (str, bool, int, float)):
+            return payload
+        elif isinstance(payload, list):
+            payload = [expand_payload(item) for item in payload]
+            return payload
+        elif isinstance(payload, dict):
+            for key, value in payload.items():
+                payload[key] = expand_payload(value)
+
+        if "author_id" in payload:
+            payload["author"] = includes_users[payload["author_id"]]
+        if "in_reply_to_user_id" in payload:
+            payload["in_reply_to_user"] = includes_users[payload["in_reply_to_user_id"]]
+        if "media_keys" in payload:
+            payload["media"] = list(includes_media[k] for k in payload["media_keys"])
+        if "poll_ids" in payload and len(payload["poll_ids"]) > 0:
+            payload["poll"] = includes_polls[payload["poll_ids"][-1]]
+        if "geo" in payload and "place_id" in payload["geo"]:
+            place_id = payload["geo"]["place_id"]
+            payload["geo"] = {**payload["geo"], **includes_places[place_id]}
+        if "mentions" in payload:
+            payload["mentions"] = list(
+                {**user, **includes_users[user["username"]]}
+                for user in payload["mentions"]
+            )
+        if "referenced_tweets" in payload:
+            payload["referenced_tweets"] = list(
+                {**tweet, **includes_tweets[tweet["id"]]}
+                for tweet in payload["referenced_tweets"]
+            )
+        if "pinned_tweet_id" in payload:
+            payload["pinned_tweet"] = includes_tweets[payload["pinned_tweet_id"]]
+        return payload
+
+    for included_id, included_tweet in extract_includes(response, "tweets").items():
+        includes_tweets[included_id] = expand_payload(included_tweet)
+
+    data = response["data"]
+    tweets = expand_payload(data) if isinstance(data, list) else [expand_payload(data)]
+    if "__twarc" in response:
+        for tweet in tweets:
+            tweet["__twarc"] = response["__twarc"]
+    return tweets
+
+
+def generate_page(rand, size=100):
+    """
+    Generate a page of search results with the usual expansions.
+    """
+    users = [
+        {
+            "id": str(1000 + i),
+            "username": f"user{i}",
+            "name": f"User {i}",
+            "created_at": "2015-03-01T12:00:00.000Z",
+            "description": f"Hello from @user{i + 1} #tag{i}",
+            "entities": {
+                "description": {
+                    "mentions": [{"start": 11, "end": 17, "username": f"user{i + 1}"}],
+                    "hashtags": [{"start": 18, "end": 23, "tag": f"tag{i}"}],
+                },
+                "url": {"urls": [{"start": 0, "end": 23, "url": "https://t.co/x"}]},
+            },
+            "pinned_tweet_id": str(900 + i),
+            "public_metrics": {
+                "followers_count": rand.randint(0, 10000),
+                "following_count": rand.randint(0, 1000),
+                "tweet_count": rand.randint(0, 100000),
+                "listed_count": rand.randint(0, 100),
+            },
+            "verified": False,
+        }
+        for i in range(60)
+    ]
+
+    def tweet(tweet_id, references=()):
+        author = rand.choice(users)
+        mentioned = rand.sample(users, rand.randint(0, 3))
+        t = {
+            "id": str(tweet_id),
+            "text": " ".join("@" + u["username"] for u in mentioned) + " some text",
+            "author_id": author["id"],
+            "conversation_id": str(tweet_id),
+            "created_at": "2022-05-01T12:00:00.000Z",
+            "lang": "en",
+            "possibly_sensitive": False,
+            "reply_settings": "everyone",
+            "source": "Twitter Web App",
+            "edit_history_tweet_ids": [str(tweet_id)],
+            "public_metrics": {
+                "retweet_count": rand.randint(0, 100),
+                "reply_count": rand.randint(0, 10),
+                "like_count": rand.randint(0, 1000),
+                "quote_count": rand.randint(0, 10),
+            },
+            "context_annotations": [
+                {
+                    "domain": {"id": "10", "name": "Person", "description": "A person"},
+                    "entity": {"id": str(rand.randint(0, 99)), "name": "Someone"},
+                }
+                for _ in range(rand.randint(0, 4))
+            ],
+            "entities": {
+                "mentions": [
+                    {"start": 0, "end": 5, "username": u["username"], "id": u["id"]}
+                    for u in mentioned
+                ],
+                "hashtags": [{"start": 0, "end": 5, "tag": "tag"}],
+                "urls": [
+                    {
+                        "start": 0,
+                        "end": 23,
+                        "url": "https://t.co/x",
+                        "expanded_url": "https://example.com/",
+                        "display_url": "example.com",
+                    }
+                ],
+            },
+        }
+        if references:
+            t["referenced_tweets"] = [
+                {"type": kind, "id": str(ref)} for kind, ref in references
+            ]
+            if references[0][0] == "replied_to":
+                t["in_reply_to_user_id"] = rand.choice(users)["id"]
+        if rand.random() < 0.2:
+            t["attachments"] = {"media_keys": [f"3_{tweet_id}"]}
+        if rand.random() < 0.05:
+            t["attachments"] = {"poll_ids": [f"p{tweet_id}"]}
+        if rand.random() < 0.05:
+            t["geo"] = {"place_id": "place1"}
+        return t
+
+    # Included tweets quote older ones, some of which weren't included.
+    included = [
+        tweet(
+            100 + i,
+            [("quoted", rand.randint(0, 99 + i))] if rand.random() < 0.3 else [],
+        )
+        for i in range(40)
+    ]
+    data = []
+    for i in range(size):
+        kind = rand.choice([None, "retweeted", "quoted", "replied_to"])
+        references = [(kind, rand.randint(100, 139))] if kind else []
+        data.append(tweet(10000 + i, references))
+
+    media = [
+        {"media_key": key, "type": "photo", "url": "https://pbs.twimg.com/x.jpg"}
+        for t in data + included
+        for key in t.get("attachments", {}).get("media_keys", [])
+    ]
+    polls = [
+        {"id": poll_id, "options": [{"position": 1, "label": "yes", "votes": 1}]}
+        for t in data + included
+        for poll_id in t.get("attachments", {}).get("poll_ids", [])
+    ]
+    return {
+        "data": data,
+        "includes": {
+            "users": users,
+            "tweets": included,
+            "media": media,
+            "polls": polls,
+            "places": [{"id": "place1", "full_name": "Somewhere", "country": "X"}],
+        },
+        "meta": {"result_count": size},
+        "__twarc": {"url": "https://api.twitter.com/2/tweets/search/recent"},
+    }
+
+
+def timed(func, pages):
+    pages = copy.deepcopy(pages)
+    started = time.perf_counter()
+    results = [func(page) for page in pages]
+    return time.perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("infile", nargs="?", help="a file of API responses")
+    parser.add_argument("--pages", type=int, default=100, help="pages to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.infile:
+        with open(args.infile) as f:
+            pages = [json.loads(line) for line in f if line.strip()]
+    else:
+        rand = random.Random(args.seed)
+        pages = [generate_page(rand) for _ in range(args.pages)]
+    tweets = sum(len(page.get("data", [])) for page in pages)
+
+    old_seconds, old = timed(flatten_recursive, pages)
+    new_seconds, new = timed(flatten, pages)
+    if json.dumps(old) != json.dumps(new):
+        raise SystemExit("flatten output differs from the recursive flatten")
+
+    print(f"{len(pages)} pages, {tweets} tweets")
+    print(f"recursive: {old_seconds:.3f}s ({tweets / old_seconds:,.0f} tweets/s)")
+    print(f"flatten:   {new_seconds:.3f}s ({tweets / new_seconds:,.0f} tweets/s)")
+    print(f"speedup:   {old_seconds / new_seconds:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
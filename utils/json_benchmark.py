@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Time twarc2 commands with each of the JSON libraries that are installed, to
+see how many tweets a second they get through. search is given pages from a
+fake API, with and without --passthrough, and flatten and dehydrate read
+those pages from a file, which can also be a file of API responses you
+give, like the output of twarc2 search.
+
+Example usage:
+utils/json_benchmark.py
+utils/json_benchmark.py --pages 200 tweets.jsonl
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+
+from click.testing import CliRunner
+
+from twarc import codec
+from twarc.client2 import Twarc2
+from twarc.command2 import twarc2
+
+from flatten_benchmark import generate_page
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+        self.url = "https://api.twitter.com/2/tweets/search/recent"
+        self.status_code = 200
+        self.headers = {}
+        self.text = content.decode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+
+def fake_api(pages):
+    """
+    Patch Twarc2 to return the pages, as they were sent by Twitter.
+    """
+    responses = []
+    for i, page in enumerate(pages):
+        page = {key: value for key, value in page.items() if key != "__twarc"}
+        page["meta"] = dict(page.get("meta", {}))
+        page["meta"].pop("next_token", None)
+        if i < len(pages) - 1:
+            page["meta"]["next_token"] = f"token{i + 1}"
+        responses.append(json.dumps(page).encode("utf-8"))
+
+    def get(self, url, params=None, **kwargs):
+        params = params or {}
+        token = params.get("next_token") or params.get("pagination_token") or "token0"
+        return FakeResponse(responses[int(token[5:])])
+
+    Twarc2.get = get
+    Twarc2.connect = lambda self: None
+
+
+def run(args):
+    result = CliRunner().invoke(twarc2, args)
+    if result.exit_code != 0:
+        raise SystemExit(f"twarc2 {' '.join(args)} failed:\n{result.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("infile", nargs="?", help="a file of API responses")
+    parser.add_argument("--pages", type=int, default=50, help="pages to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.infile:
+        with open(args.infile) as f:
+            pages = [json.loads(line) for line in f if line.strip()]
+    else:
+        rand = random.Random(args.seed)
+        pages = [generate_page(rand) for _ in range(args.pages)]
+    tweets = sum(len(page.get("data", [])) for page in pages)
+    fake_api(pages)
+    logging.disable(logging.WARNING)
+
+    options = [["--json-backend", "json"]]
+    for name in ["simdjson", "orjson"]:
+        try:
+            codec.configure(name)
+            options.append(["--json-backend", name])
+        except ValueError:
+            print(f"{name} is not installed")
+    if codec.backend == "orjson":
+        options.append(["--json-backend", "orjson", "--compact-json"])
+
+    commands = {
+        "search": lambda out: ["search", "--limit", str(tweets), "cats", out],
+        "passthrough": lambda out: [
+            "search",
+            "--passthrough",
+            "--limit",
+            str(tweets),
+            "cats",
+            out,
+        ],
+        "flatten": lambda out: ["flatten", infile, out],
+        "dehydrate": lambda out: ["dehydrate", infile, out],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        infile = os.path.join(tmp, "pages.jsonl")
+        with open(infile, "w") as f:
+            for page in pages:
+                f.write(json.dumps(page) + "\n")
+
+        print(f"{len(pages)} pages, {tweets} tweets, tweets/s:")
+        print(f"{'':<30}" + "".join(f"{name:>12}" for name in commands))
+        for option in options:
+            row = f"{' '.join(option[1:]):<30}"
+            for name, command in commands.items():
+                out = os.path.join(tmp, f"{name}.jsonl")
+                global_args = ["--bearer-token", "x", "--log", os.devnull]
+                started = time.perf_counter()
+                run(global_args + option + command(out) + ["--hide-progress"])
+                seconds = time.perf_counter() - started
+                os.remove(out)
+                row += f"{tweets / seconds:>12,.0f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()